@@ -32,10 +32,10 @@ class BootstrapTarball(BaseTarball, Source):
         self.tarball_checksum = checksum
         BaseTarball.__init__(self)
 
-    def verify(self, fname, fatal=True):
+    def verify(self, fname, fatal=True, found_checksum=None):
         if self.tarball_checksum is False:
             return True
-        return super().verify(fname, fatal)
+        return super().verify(fname, fatal, found_checksum=found_checksum)
 
 
 class BootstrapperBase(object):
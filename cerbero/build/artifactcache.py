@@ -0,0 +1,264 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import asyncio
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+
+from cerbero.build.recipe import BaseUniversalRecipe
+from cerbero.enums import Architecture
+from cerbero.errors import FatalError
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+ARTIFACT_EXT = '.tar.xz'
+METADATA_EXT = '.json'
+
+
+class ArtifactCache(object):
+    """
+    Cache of the files installed by each recipe, addressed by a key that
+    changes with the recipe, its dependencies and the configuration.
+
+    Artifacts are stored in a local directory with the layout
+    C{<key[:2]>/<key>.tar.xz}, next to a C{<key>.json} file with their
+    metadata. The same layout can be served by any HTTP server and used as
+    a remote cache with the C{artifact_cache_url} setting.
+
+    @ivar cache_dir: directory with the artifacts
+    @type cache_dir: str
+    @ivar url: base URL of a remote cache
+    @type url: str
+    """
+
+    def __init__(self, config, cookbook):
+        self.config = config
+        self.cookbook = cookbook
+        self.url = config.artifact_cache_url
+        self.cache_dir = config.artifact_cache_dir
+        if self.cache_dir is None and self.url:
+            self.cache_dir = os.path.join(config.home_dir, 'artifacts')
+        self._keys = {}
+        self._fingerprint = None
+
+    @staticmethod
+    def enabled(config):
+        """
+        Whether the configuration uses an artifact cache
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @rtype: bool
+        """
+        return bool(config.artifact_cache_dir or config.artifact_cache_url)
+
+    def can_cache(self, recipe):
+        """
+        Whether the files of a recipe can be cached. Universal recipes
+        can't, since they merge the build of each architecture.
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @rtype: bool
+        """
+        if isinstance(recipe, BaseUniversalRecipe):
+            return False
+        return self.config.target_arch != Architecture.UNIVERSAL
+
+    def recipe_key(self, recipe):
+        """
+        Gets the key of the artifact of a recipe, a hash of the recipe
+        checksum, its built version, the configuration and the keys of all
+        its dependencies
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: the key
+        @rtype: str
+        """
+        if recipe.name in self._keys:
+            return self._keys[recipe.name]
+        if self._fingerprint is None:
+            # Shared by the hosts building with the same prefix
+            self._fingerprint = self.config.get_fingerprint(host_independent=True)
+        h = hashlib.sha256()
+        h.update(recipe.name.encode('utf-8'))
+        h.update(recipe.get_checksum())
+        h.update(recipe.built_version().encode('utf-8'))
+        h.update(self._fingerprint.encode('utf-8'))
+        for dep in self.cookbook.list_recipe_deps(recipe.name):
+            if dep.name != recipe.name:
+                h.update(('%s:%s' % (dep.name, self.recipe_key(dep))).encode('utf-8'))
+        self._keys[recipe.name] = h.hexdigest()
+        return self._keys[recipe.name]
+
+    def artifact_path(self, key, ext=ARTIFACT_EXT):
+        """
+        Relative path of an artifact in the cache, also used for the URL of
+        the remote cache
+
+        @param key: the key of the artifact
+        @type key: str
+        @param ext: the extension of the file
+        @type ext: str
+        @return: the relative path
+        @rtype: str
+        """
+        return '%s/%s%s' % (key[:2], key, ext)
+
+    async def restore(self, recipe, prefix=None, logfile=None):
+        """
+        Installs the files of a recipe from the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param prefix: prefix where the files are installed, the recipe's
+                       one by default
+        @type prefix: str
+        @return: whether the recipe was found in the cache
+        @rtype: bool
+        """
+        tarball = await self.fetch(recipe, logfile)
+        if tarball is None:
+            return False
+        await self.install(recipe, tarball, prefix, logfile)
+        return True
+
+    async def fetch(self, recipe, logfile=None):
+        """
+        Gets the artifact of a recipe, downloading and verifying it from the
+        remote cache if it's not in the local one
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: path of the artifact or None if it's not in the cache
+        @rtype: str
+        """
+        return await self._fetch_artifact(self.recipe_key(recipe), logfile)
+
+    async def install(self, recipe, tarball, prefix=None, logfile=None):
+        """
+        Installs the files of an artifact returned by L{fetch}
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param tarball: path of the artifact
+        @type tarball: str
+        @param prefix: prefix where the files are installed, the recipe's
+                       one by default
+        @type prefix: str
+        """
+        m.log(_('Restoring %s from the artifact cache (%s)') % (recipe.name, self.recipe_key(recipe)), logfile)
+        await shell.unpack(tarball, prefix or recipe.config.prefix, logfile=logfile)
+
+    async def store(self, recipe, prefix=None, logfile=None):
+        """
+        Stores the files installed by a recipe in the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param prefix: prefix where the files were installed, the recipe's
+                       one by default
+        @type prefix: str
+        @return: the key of the artifact or None if there was nothing to store
+        @rtype: str
+        """
+        if self.config.artifact_cache_dir is None:
+            # Remote caches are read-only
+            return None
+        prefix = prefix or recipe.config.prefix
+        key = self.recipe_key(recipe)
+        files = sorted(set(recipe.files_list() + recipe.devel_files_list()))
+        if not files:
+            return None
+        metadata = {
+            'recipe': recipe.name,
+            'key': key,
+            'built_version': recipe.built_version(),
+            'files': files,
+        }
+        m.log(_('Storing %s in the artifact cache (%s)') % (recipe.name, key), logfile)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write_artifact, key, prefix, metadata)
+        return key
+
+    def _write_artifact(self, key, prefix, metadata):
+        path = os.path.join(self.cache_dir, self.artifact_path(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with tarfile.open(fileobj=f, mode='w:xz') as tf:
+                    for name in metadata['files']:
+                        tf.add(os.path.join(prefix, name), arcname=name)
+            with open(tmp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            metadata['sha256'] = h.hexdigest()
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        # The metadata is written last, and its presence marks the artifact as
+        # complete
+        meta_path = os.path.join(self.cache_dir, self.artifact_path(key, METADATA_EXT))
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=1)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    async def _fetch_artifact(self, key, logfile):
+        path = os.path.join(self.cache_dir, self.artifact_path(key))
+        meta_path = os.path.join(self.cache_dir, self.artifact_path(key, METADATA_EXT))
+        if os.path.exists(meta_path) and os.path.exists(path):
+            return path
+        if not self.url:
+            return None
+        base_url = self.url.rstrip('/')
+        try:
+            await shell.download(
+                '%s/%s' % (base_url, self.artifact_path(key, METADATA_EXT)),
+                meta_path + '.tmp',
+                overwrite=True,
+                logfile=logfile,
+            )
+        except FatalError:
+            # Not in the remote cache
+            return None
+        try:
+            with open(meta_path + '.tmp', 'r') as f:
+                metadata = json.load(f)
+            await shell.download('%s/%s' % (base_url, self.artifact_path(key)), path, overwrite=True, logfile=logfile)
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            if h.hexdigest() != metadata['sha256']:
+                raise FatalError(_('Checksum mismatch for artifact %s') % key)
+        except Exception as ex:
+            m.warning(_('Could not fetch artifact %s: %s') % (key, ex))
+            for p in (path, meta_path + '.tmp'):
+                if os.path.exists(p):
+                    os.remove(p)
+            return None
+        os.replace(meta_path + '.tmp', meta_path)
+        return path
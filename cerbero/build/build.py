@@ -27,6 +27,7 @@ from itertools import chain
 from cerbero.enums import Platform, Architecture, Distro, DistroVersion, LibraryType
 from cerbero.errors import FatalError, InvalidRecipeError
 from cerbero.utils import shell, add_system_libs, determine_num_cargo_jobs
+from cerbero.utils import jobserver
 from cerbero.utils import messages as m
 
 
@@ -410,6 +411,21 @@ class Build(object):
             return self.config.num_of_cpus
         return None
 
+    def jobserver_cmd(self, cmd):
+        """
+        Prepares a command that runs parallel jobs to take them from the
+        jobserver of the build, if there is one
+
+        @param cmd: the command
+        @type cmd: list
+        @return: the command without its number of jobs and its environment
+        @rtype: tuple
+        """
+        server = jobserver.get_jobserver()
+        if server is None or (self.num_of_cpus() or 1) <= 1 or not jobserver.is_client(cmd, self.env):
+            return cmd, self.env
+        return jobserver.strip_jobs(cmd), server.client_env(self.env)
+
 
 class CustomBuild(Build, ModifyEnvBase):
     def __init__(self):
@@ -525,7 +541,8 @@ class MakefilesBase(Build, ModifyEnvBase):
             os.makedirs(make_dir)
 
         self.maybe_add_system_libs(step='compile')
-        await shell.async_call(self.make, make_dir, logfile=self.logfile, env=self.env)
+        cmd, env = self.jobserver_cmd(self.make)
+        await shell.async_call(cmd, make_dir, logfile=self.logfile, env=env)
 
     @modify_environment
     async def install(self):
@@ -1292,7 +1309,8 @@ class Meson(Build, ModifyEnvBase):
     @modify_environment
     async def compile(self):
         self.maybe_add_system_libs(step='compile')
-        await shell.async_call(self.make, self.build_dir, logfile=self.logfile, env=self.env)
+        cmd, env = self.jobserver_cmd(self.make)
+        await shell.async_call(cmd, self.build_dir, logfile=self.logfile, env=env)
 
     @modify_environment
     async def install(self):
@@ -1469,7 +1487,8 @@ class Cargo(Build, ModifyEnvBase):
             '--root',
             self.config.prefix,
         ] + self.get_cargo_args()
-        await self.retry_run(shell.async_call, cmd, logfile=self.logfile, env=self.env)
+        cmd, env = self.jobserver_cmd(cmd)
+        await self.retry_run(shell.async_call, cmd, logfile=self.logfile, env=env)
 
 
 class CargoC(Cargo):
@@ -1521,8 +1540,8 @@ class CargoC(Cargo):
     @modify_environment
     async def compile(self):
         self.maybe_add_system_libs(step='configure+compile')
-        cmd = [self.cargo, 'cbuild'] + self.get_cargoc_args()
-        await self.retry_run(shell.async_call, cmd, self.build_dir, logfile=self.logfile, env=self.env)
+        cmd, env = self.jobserver_cmd([self.cargo, 'cbuild'] + self.get_cargoc_args())
+        await self.retry_run(shell.async_call, cmd, self.build_dir, logfile=self.logfile, env=env)
 
     @modify_environment
     async def install(self):
@@ -17,8 +17,8 @@
 # Boston, MA 02111-1307, USA.
 
 from collections import defaultdict
+import multiprocessing
 import os
-import pickle
 import time
 import traceback
 
@@ -26,14 +26,35 @@ from cerbero.config import USER_CONFIG_DIR, Platform, Architecture, Distro, Dist
 from cerbero.build.build import BuildType
 from cerbero.build.source import SourceType
 from cerbero.errors import FatalError, RecipeNotFoundError, InvalidRecipeError
-from cerbero.utils import _, shell, parse_file, imp_load_source
+from cerbero.utils import _, shell, hashing, parse_file, imp_load_source
 from cerbero.utils import messages as m
 from cerbero.utils.manifest import Manifest
 from cerbero.build import recipe as crecipe
+from cerbero.build import recipecache
+from cerbero.build.statusstore import StatusStore
 
 
 COOKBOOK_NAME = 'cookbook'
 USER_COOKBOOK_FILE = os.path.join(USER_CONFIG_DIR, COOKBOOK_NAME)
+# Sidecar of the cookbook file with the digests of the recipe files
+HASH_INDEX_EXT = '.hashes'
+
+# CookBook and recipes repository used by the workers loading the recipes,
+# inherited from the parent process when forking
+_loader_state = None
+
+
+def _load_recipes_metadata(filepath):
+    cookbook, repo = _loader_state
+    invalid_recipes = len(cookbook._invalid_recipes)
+    recipes = cookbook._load_recipes_from_file(filepath, True, cookbook._load_custom(repo))
+    # Errors are reported by loading the file again in the main process
+    if not recipes or invalid_recipes != len(cookbook._invalid_recipes):
+        return filepath, None
+    metadata = [recipecache.RecipeMetadata.from_recipe(r) for r in recipes]
+    if None in metadata:
+        return filepath, None
+    return filepath, [md.to_dict() for md in metadata]
 
 
 class RecipeStatus(object):
@@ -88,16 +109,22 @@ class CookBook(object):
     @type recipes: dict
     @ivar status: dictionary with the L{cerbero.cookbook.RecipeStatus}
     @type status: dict
+    @ivar lazy: use the cached metadata of the recipes and only load them
+                when they are needed, for commands that don't build them
+    @type lazy: bool
     """
 
     RECIPE_EXT = '.recipe'
 
-    def __init__(self, config, load=True, offline=False, skip_errors=False, reset_status=True):
+    def __init__(self, config, load=True, offline=False, skip_errors=False, reset_status=True, lazy=False):
         self.offline = offline
+        self.lazy = lazy
         self.set_config(config)
         self.recipes = {}  # recipe_name -> recipe
         self._invalid_recipes = {}  # recipe -> error
         self._mtimes = {}
+        self._custom_modules = {}  # repo -> custom.py module
+        self._status_store = None
 
         if not load:
             return
@@ -192,7 +219,9 @@ class CookBook(object):
         status.steps.append(step)
         status.touch()
         self.status[recipe_name] = status
-        self.save()
+        self._save_recipe_status(recipe_name)
+        if step in (crecipe.BuildSteps.INSTALL[1], crecipe.BuildSteps.POST_INSTALL[1]):
+            self.reset_recipe_files_lists(recipe_name)
 
     def update_build_status(self, recipe_name, built_version):
         """
@@ -208,7 +237,7 @@ class CookBook(object):
         status.built_version = built_version
         status.touch()
         self.status[recipe_name] = status
-        self.save()
+        self._save_recipe_status(recipe_name)
 
     def recipe_built_version(self, recipe_name):
         """
@@ -242,7 +271,94 @@ class CookBook(object):
         """
         if recipe_name in self.status:
             del self.status[recipe_name]
-            self.save()
+            try:
+                self._get_status_store().delete(recipe_name)
+            except Exception as ex:
+                m.warning(_('Could not cache the CookBook: %s') % ex)
+            self.reset_recipe_files_lists(recipe_name)
+
+    def get_recipe_peak_memory(self, recipe_name):
+        """
+        Gets the peak memory used by the last compilation of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the peak memory in bytes or None if unknown
+        @rtype: int
+        """
+        try:
+            return self._get_status_store().get_peak_memory(recipe_name)
+        except Exception as ex:
+            m.warning(_('Could not read the CookBook cache: %s') % ex)
+            return None
+
+    def update_recipe_peak_memory(self, recipe_name, peak_memory):
+        """
+        Records the peak memory used to compile a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param peak_memory: the peak memory in bytes
+        @type peak_memory: int
+        """
+        try:
+            self._get_status_store().set_peak_memory(recipe_name, peak_memory)
+        except Exception as ex:
+            m.warning(_('Could not cache the CookBook: %s') % ex)
+
+    def get_recipe_files_list(self, recipe_name, key, signature):
+        """
+        Gets a list of files of a recipe computed previously
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param key: key of the list
+        @type key: str
+        @param signature: signature of the prefix the list must be valid for
+        @type signature: str
+        @return: the list of files or None if unknown
+        @rtype: list
+        """
+        try:
+            return self._get_status_store().get_files_list(recipe_name, key, signature)
+        except Exception as ex:
+            m.warning(_('Could not read the CookBook cache: %s') % ex)
+            return None
+
+    def update_recipe_files_list(self, recipe_name, key, signature, files):
+        """
+        Records a list of files of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param key: key of the list
+        @type key: str
+        @param signature: signature of the prefix the list was computed from
+        @type signature: str
+        @param files: the list of files
+        @type files: list
+        """
+        try:
+            self._get_status_store().set_files_list(recipe_name, key, signature, files)
+        except Exception as ex:
+            m.warning(_('Could not cache the CookBook: %s') % ex)
+
+    def reset_recipe_files_lists(self, recipe_name):
+        """
+        Forgets the lists of files of a recipe, after it installed files
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        """
+        recipe = self.recipes.get(recipe_name)
+        if isinstance(recipe, recipecache.LazyRecipe):
+            recipe = recipe.load() if recipe.is_loaded() else None
+        if recipe is not None:
+            recipe.reset_files_lists()
+        try:
+            self._get_status_store().delete_files_lists(recipe_name)
+        except Exception as ex:
+            m.warning(_('Could not cache the CookBook: %s') % ex)
 
     def recipe_needs_build(self, recipe_name):
         """
@@ -317,26 +433,39 @@ class CookBook(object):
         else:
             return USER_COOKBOOK_FILE
 
+    def _get_status_store(self):
+        cache_file = self._cache_file(self.get_config())
+        if self._status_store is None or self._status_store.path != cache_file:
+            if self._status_store is not None:
+                self._status_store.close()
+            self._status_store = StatusStore(cache_file)
+            self._status_store.load()
+        return self._status_store
+
     def _restore_cache(self):
         self.status = {}
-        cachefile = self._cache_file(self.get_config())
-        if not os.path.isfile(cachefile):
-            # From-scratch build
-            return
+        if self._status_store is not None:
+            self._status_store.close()
+        self._status_store = StatusStore(self._cache_file(self.get_config()))
         try:
-            with open(cachefile, 'rb') as f:
-                self.status = pickle.load(f)
-        except Exception:
-            m.warning(_('Could not recover status'))
+            self.status = self._status_store.load()
+        except Exception as ex:
+            m.warning(_('Could not recover status: %s') % ex)
+        cache_file = self._cache_file(self.get_config())
+        if cache_file != os.devnull:
+            hashing.get_hasher().load_index(cache_file + HASH_INDEX_EXT)
 
     def save(self):
         try:
-            cache_file = self._cache_file(self.get_config())
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
-            with open(cache_file, 'wb') as f:
-                pickle.dump(self.status, f)
-        except IOError as ex:
+            self._get_status_store().save_all(self.status)
+            hashing.get_hasher().save_index()
+        except Exception as ex:
+            m.warning(_('Could not cache the CookBook: %s') % ex)
+
+    def _save_recipe_status(self, recipe_name):
+        try:
+            self._get_status_store().save(recipe_name, self.status[recipe_name])
+        except Exception as ex:
             m.warning(_('Could not cache the CookBook: %s') % ex)
 
     def _find_deps(self, recipe, state=None, ordered=None):
@@ -379,6 +508,10 @@ class CookBook(object):
         self.recipes = {}
         recipes = defaultdict(dict)
         recipes_repos = self._config.get_recipes_repos()
+        # Only the lazy cookbooks use the metadata of the recipes cache
+        self._recipes_cache = recipecache.RecipesCache(self._config) if self.lazy else None
+        if self._recipes_cache is not None:
+            self._recipes_cache.load()
         for reponame, (repodir, priority) in recipes_repos.items():
             new_recipes = self._load_recipes_from_dir(repodir, skip_errors)
             priority_recipes = recipes[int(priority)]
@@ -393,12 +526,18 @@ class CookBook(object):
             if overridden:
                 m.warning(f'Overriding recipes during priority {key}: {overridden}')
             self.recipes.update(new_recipes)
+        if self._recipes_cache is not None:
+            self._recipes_cache.save()
 
         if not reset_status:
             return
 
         # Check for updates in the recipe file to reset the status
+        changed = []
         for recipe in list(self.recipes.values()):
+            # Recipes not loaded are only used to inspect them, not to build
+            if isinstance(recipe, recipecache.LazyRecipe):
+                continue
             # Set the offline property, used by the recipe while performing the
             # fetch build step
             recipe.offline = self.offline
@@ -417,23 +556,24 @@ class CookBook(object):
             # inherited from a different file, f.ex. recipes/custom.py
             if recipe.built_version() != st.built_version:
                 self.reset_recipe_status(recipe.name)
+            elif recipe.get_mtime() > st.mtime:
+                # The mtime is different, check the file hash now
+                changed.append(recipe)
+
+        # Recipes and their patches are hashed in parallel threads
+        hashes = hashing.get_hasher().map(lambda r: r.get_checksum(), changed)
+        for recipe, current_hash in zip(changed, hashes):
+            st = self.status[recipe.name]
+            # Use getattr as file_hash we added later
+            if getattr(st, 'file_hash', 0) == current_hash:
+                # Update the status with the mtime
+                st.touch()
             else:
-                rmtime = recipe.get_mtime()
-                if rmtime > st.mtime:
-                    # The mtime is different, check the file hash now
-                    # Use getattr as file_hash we added later
-                    saved_hash = getattr(st, 'file_hash', 0)
-                    current_hash = recipe.get_checksum()
-                    if saved_hash == current_hash:
-                        # Update the status with the mtime
-                        st.touch()
-                    else:
-                        self.reset_recipe_status(recipe.name)
+                self.reset_recipe_status(recipe.name)
 
-    def _load_recipes_from_dir(self, repo, skip_errors):
-        recipes = {}
-        recipes_files = shell.find_files('*%s' % self.RECIPE_EXT, repo)
-        recipes_files.extend(shell.find_files('*/*%s' % self.RECIPE_EXT, repo))
+    def _load_custom(self, repo):
+        if repo in self._custom_modules:
+            return self._custom_modules[repo]
         custom = None
         # If a manifest is being used or if recipes_commits is defined, disable
         # usage of tarballs when tagged for release. We need to do this before
@@ -444,22 +584,76 @@ class CookBook(object):
         m_path = os.path.join(repo, 'custom.py')
         if os.path.exists(m_path):
             custom = imp_load_source('custom', m_path)
+        self._custom_modules[repo] = custom
+        return custom
+
+    def _load_recipes_from_dir(self, repo, skip_errors):
+        recipes = {}
+        recipes_files = shell.find_files('*%s' % self.RECIPE_EXT, repo)
+        recipes_files.extend(shell.find_files('*/*%s' % self.RECIPE_EXT, repo))
+        keys = {}
+        if self.lazy:
+            custom_key = ''
+            m_path = os.path.join(repo, 'custom.py')
+            if os.path.exists(m_path):
+                custom_key = recipecache.file_key(m_path)
+            keys = dict((f, recipecache.file_key(f, custom_key)) for f in recipes_files)
+            if self._config.parallel_recipes_loading:
+                missing = [f for f in recipes_files if self._recipes_cache.get(f, keys[f]) is None]
+                self._load_recipes_metadata_parallel(repo, missing, keys)
         for f in recipes_files:
-            # Try to load recipes with the custom.py module located in the
-            # recipes dir which can contain private classes and methods with
-            # common code for gstreamer recipes.
-            try:
-                recipes_from_file = self._load_recipes_from_file(f, skip_errors, custom)
-            except RecipeNotFoundError:
-                m.warning(_('Could not found a valid recipe in %s') % f)
-            if recipes_from_file is None:
-                continue
+            cached = self._recipes_cache.get(f, keys[f]) if self.lazy else None
+            if cached is not None:
+                recipes_from_file = [self._lazy_recipe(md, repo, f) for md in cached]
+            else:
+                # Try to load recipes with the custom.py module located in the
+                # recipes dir which can contain private classes and methods with
+                # common code for gstreamer recipes.
+                invalid_recipes = len(self._invalid_recipes)
+                try:
+                    recipes_from_file = self._load_recipes_from_file(f, skip_errors, self._load_custom(repo))
+                except RecipeNotFoundError:
+                    m.warning(_('Could not found a valid recipe in %s') % f)
+                if recipes_from_file is None:
+                    continue
+                # Only cache files which loaded without errors
+                if self.lazy and recipes_from_file and invalid_recipes == len(self._invalid_recipes):
+                    self._recipes_cache.set(f, keys[f], recipes_from_file)
             for recipe in recipes_from_file:
                 if recipe.name in recipes:
                     m.warning(f'Overriding {recipes[recipe.name]} by {recipe} from {f}')
                 recipes[recipe.name] = recipe
         return recipes
 
+    def _load_recipes_metadata_parallel(self, repo, recipes_files, keys):
+        global _loader_state
+        # Recipes are parsed from the globals of the parent process, which
+        # requires forking
+        jobs = min(self._config.num_of_cpus or 1, len(recipes_files))
+        if jobs < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+            return
+        _loader_state = (self, repo)
+        try:
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(jobs) as pool:
+                for f, metadata in pool.imap_unordered(_load_recipes_metadata, recipes_files, chunksize=4):
+                    if metadata is not None:
+                        self._recipes_cache.set_metadata(f, keys[f], metadata)
+        finally:
+            _loader_state = None
+
+    def _lazy_recipe(self, metadata, repo, filepath):
+        def load(name):
+            recipes = self._load_recipes_from_file(filepath, False, self._load_custom(repo))
+            for recipe in recipes:
+                recipe.offline = self.offline
+            for recipe in recipes:
+                if recipe.name == name:
+                    return recipe
+            raise FatalError(_('Recipe %s could not be loaded from %s') % (name, filepath))
+
+        return recipecache.LazyRecipe(metadata, load)
+
     def _load_recipes_from_file(self, filepath, skip_errors, custom):
         recipes = []
         d = {
@@ -0,0 +1,166 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import json
+import os
+import shutil
+
+from cerbero.utils import shell
+
+
+CRATES_IO = 'registry+https://github.com/rust-lang/crates.io-index'
+CHECKSUM_FILE = '.cargo-checksum.json'
+
+
+def parse_cargo_lock(path, tomllib):
+    """
+    Parses the packages of a Cargo.lock file
+
+    @param path: path of the Cargo.lock file
+    @type path: str
+    @param tomllib: the TOML module, see
+                    L{cerbero.config.Config.find_toml_module}
+    @type tomllib: module
+    @return: a dict with the keys of each package, like name, version,
+             source and checksum
+    @rtype: list
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return tomllib.loads(f.read()).get('package', [])
+
+
+class CrateStore(object):
+    """
+    Host-wide store of the crates vendored with 'cargo vendor', addressed by
+    their checksum in Cargo.lock, so that the recipes vendoring the same
+    crates, in any configuration, share them.
+
+    Crates are stored as C{<path>/<checksum[:2]>/<checksum>}. When all the
+    crates of a Cargo.lock are in the store, the vendor directory is created
+    hard linking them instead of running 'cargo vendor', that doesn't need
+    to access the network nor to copy them from the cargo registry cache.
+    Since cargo verifies the vendored files with their checksums, changing
+    them breaks the build instead of the crates in the store. Crates are
+    never removed, the store can be deleted at any time to reclaim its space.
+
+    @ivar path: directory of the store
+    @type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def from_config(config):
+        """
+        Gets the store of a configuration
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @return: the store or None if it's not enabled
+        @rtype: L{CrateStore}
+        """
+        if not config.cargo_vendor_store:
+            return None
+        return CrateStore(config.cargo_vendor_store)
+
+    @staticmethod
+    def config_toml(vendor_dir):
+        """
+        @param vendor_dir: the vendor directory
+        @type vendor_dir: str
+        @return: the cargo configuration to use the vendored crates, like
+                 the one printed by 'cargo vendor'
+        @rtype: str
+        """
+        return (
+            '[source.crates-io]\n'
+            'replace-with = "vendored-sources"\n'
+            '\n'
+            '[source.vendored-sources]\n'
+            'directory = "%s"\n' % vendor_dir.replace('\\', '/')
+        )
+
+    def crate_path(self, checksum):
+        """
+        @param checksum: checksum of a crate in Cargo.lock
+        @type checksum: str
+        @return: path of the crate in the store
+        @rtype: str
+        """
+        return os.path.join(self.path, checksum[:2], checksum)
+
+    def vendor(self, packages, vendor_dir):
+        """
+        Creates a vendor directory with the crates of the store
+
+        @param packages: the packages of a Cargo.lock
+        @type packages: list
+        @param vendor_dir: the vendor directory, replaced if it exists
+        @type vendor_dir: str
+        @return: whether all the crates were in the store, the vendor
+                 directory is not changed otherwise
+        @rtype: bool
+        """
+        crates = []
+        for package in packages:
+            if 'source' not in package:
+                # A member of the workspace
+                continue
+            if package['source'] != CRATES_IO or 'checksum' not in package:
+                return False
+            path = self.crate_path(package['checksum'])
+            if not os.path.isdir(path):
+                return False
+            crates.append(('%s-%s' % (package['name'], package['version']), path))
+        if os.path.exists(vendor_dir):
+            shutil.rmtree(vendor_dir)
+        os.makedirs(vendor_dir)
+        for name, path in crates:
+            # Cargo finds the crates from their Cargo.toml, whatever the name
+            # of their directory
+            shutil.copytree(path, os.path.join(vendor_dir, name), symlinks=True, copy_function=shell.link_or_copy)
+        return True
+
+    def add_vendor_dir(self, packages, vendor_dir):
+        """
+        Adds the crates of a vendor directory created by 'cargo vendor'
+
+        @param packages: the packages of the Cargo.lock it was created from
+        @type packages: list
+        @param vendor_dir: the vendor directory
+        @type vendor_dir: str
+        @return: the number of crates added
+        @rtype: int
+        """
+        checksums = set(p['checksum'] for p in packages if p.get('source') == CRATES_IO and 'checksum' in p)
+        added = 0
+        for entry in os.scandir(vendor_dir):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                with open(os.path.join(entry.path, CHECKSUM_FILE), 'r') as f:
+                    checksum = json.load(f).get('package')
+            except (OSError, ValueError):
+                continue
+            if checksum not in checksums or os.path.isdir(self.crate_path(checksum)):
+                continue
+            shell.publish_tree(entry.path, self.crate_path(checksum), shell.link_or_copy)
+            added += 1
+        return added
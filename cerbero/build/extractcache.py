@@ -0,0 +1,112 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import hashlib
+import os
+import shutil
+
+from cerbero.utils import shell
+
+
+class ExtractCache(object):
+    """
+    Host-wide cache of the source trees extracted from tarballs with their
+    patches applied, so that extracting them again, after a --full-reset or
+    in another configuration, is a copy of the tree instead of unpacking the
+    tarball, committing it to git and applying the patches.
+
+    Trees are stored as C{<path>/<key[:2]>/<key>}, with a key computed from
+    the checksum of the tarball and of the patches, and restored with
+    reflinks where the filesystem supports them. They are never hard linked
+    since builds can modify the sources in place. Trees are never removed,
+    the cache can be deleted at any time to reclaim its space.
+
+    @ivar path: directory of the cache
+    @type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def from_config(config):
+        """
+        Gets the cache of a configuration
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @return: the cache or None if it's not enabled
+        @rtype: L{ExtractCache}
+        """
+        if not config.extract_cache:
+            return None
+        return ExtractCache(config.extract_cache)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Computes the key of a tree
+
+        @param parts: everything that changes the extracted tree, like the
+                      checksum of the tarball and of the patches
+        @type parts: list
+        @return: the key
+        @rtype: str
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(('%s\0' % (part,)).encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def tree_path(self, key):
+        """
+        @param key: the key of a tree
+        @type key: str
+        @return: path of the tree in the cache
+        @rtype: str
+        """
+        return os.path.join(self.path, key[:2], key)
+
+    def restore(self, key, dest):
+        """
+        Copies a tree of the cache
+
+        @param key: the key of the tree
+        @type key: str
+        @param dest: the copy, that must not exist
+        @type dest: str
+        @return: whether the tree was in the cache
+        @rtype: bool
+        """
+        path = self.tree_path(key)
+        if not os.path.isdir(path):
+            return False
+        shutil.copytree(path, dest, symlinks=True, copy_function=shell.reflink_or_copy)
+        return True
+
+    def store(self, key, src):
+        """
+        Stores a copy of a tree in the cache
+
+        @param key: the key of the tree
+        @type key: str
+        @param src: the tree
+        @type src: str
+        """
+        shell.publish_tree(src, self.tree_path(key), shell.reflink_or_copy)
@@ -16,9 +16,9 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import hashlib
 import os
 import re
-import glob
 import shutil
 import inspect
 from functools import partial
@@ -31,13 +31,14 @@ from cerbero.utils import shell
 from cerbero.utils import messages as m
 from cerbero.errors import FatalError
 from cerbero.build.build import BuildType
+from cerbero.build import prefixindex
 
 
 def find_shlib_regex(config, libname, prefix, libdir, ext, regex):
     # Use globbing to find all files that look like they might match
     # this library to narrow down our exact search
     fpath = os.path.join(libdir, '*{0}*{1}*'.format(libname, ext))
-    found = glob.glob(os.path.join(prefix, fpath))
+    found = prefixindex.glob(fpath, prefix)
     # Find which of those actually match via an exact regex
     # Ideally Python should provide a function for regex file 'globbing'
     matches = []
@@ -74,7 +75,7 @@ def find_dll_implib(config, libname, prefix, libdir, ext, regex):
     implib_notfound = []
     for implib in implibs:
         path = os.path.join(prefix, implibdir, implib)
-        if not os.path.exists(path):
+        if not prefixindex.exists(os.path.join(implibdir, implib), prefix):
             implib_notfound.append(implib)
             continue
         dllname = get_implib_dllname(config, path)
@@ -91,8 +92,7 @@ def find_dll_implib(config, libname, prefix, libdir, ext, regex):
     # name. This is to cover cases like libgcc_s_sjlj-1.dll which don't have an
     # import library since they're only used at runtime.
     dllname = 'lib{}.dll'.format(libname)
-    path = os.path.join(prefix, libdir, dllname)
-    if os.path.exists(path):
+    if prefixindex.exists(os.path.join(libdir, dllname), prefix):
         return [os.path.join(libdir, dllname)]
     if len(implib_notfound) == len(implibs):
         m.warning('No import libraries found for {!r}'.format(libname))
@@ -108,7 +108,7 @@ def find_pdb_implib(config, libname, prefix):
     pdbs = []
     for dll in dlls:
         pdb = dll[:-3] + 'pdb'
-        if os.path.exists(os.path.join(prefix, pdb)):
+        if prefixindex.exists(pdb, prefix):
             pdbs.append(pdb)
     return pdbs
 
@@ -215,6 +215,7 @@ class FilesProvider(object):
         else:
             raise AssertionError
         self.py_prefixes = config.py_prefixes
+        self._files_lists = {}  # key -> (signature of the prefix, files)
         self.add_files_bins_devel()
         self.add_license_files()
         self.update_categories()
@@ -233,10 +234,10 @@ class FilesProvider(object):
         directories
         """
         # fill directories
-        if os.path.isdir(os.path.join(self.config.prefix, file)):
-            found = self._ls_dir(os.path.join(self.config.prefix, file))
+        if prefixindex.isdir(file, self.config.prefix):
+            found = prefixindex.ls_dir(file, self.config.prefix)
         else:
-            found = shell.ls_files([file], self.config.prefix)
+            found = prefixindex.ls_files([file], self.config.prefix)
         return found
 
     def _search_library(self, file):
@@ -271,6 +272,30 @@ class FilesProvider(object):
                 nonvalidated.append(each)
             return nonvalidated
 
+        # The files found for the same patterns are reused until the prefix
+        # changes, also by other cerbero processes through the cookbook
+        index = prefixindex.get_prefix_index(self.config.prefix)
+        if index is None:
+            return self._search_existing(files)
+        signature = index.signature()
+        h = hashlib.sha1(self.config.prefix.encode('utf-8', 'surrogateescape'))
+        for f, searchfunc in sorted(files.items()):
+            h.update(('\0%s\0%s' % (f, searchfunc.__name__ if searchfunc else '')).encode('utf-8', 'surrogateescape'))
+        key = h.hexdigest()
+        cached = self._files_lists.get(key)
+        if cached is None or cached[0] != signature:
+            cookbook = getattr(self.config, 'cookbook', None)
+            vfs = None
+            if cookbook is not None:
+                vfs = cookbook.get_recipe_files_list(self.name, key, signature)
+            if vfs is None:
+                vfs = self._search_existing(files)
+                if cookbook is not None:
+                    cookbook.update_recipe_files_list(self.name, key, signature, vfs)
+            cached = self._files_lists[key] = (signature, vfs)
+        return list(cached[1])
+
+    def _search_existing(self, files):
         # Validate all the files with the ones in the prefix
         vfs = []
         for f, searchfunc in files.items():
@@ -336,6 +361,12 @@ class FilesProvider(object):
             self.files_bins_devel = []
         self.files_bins_devel += pdbs
 
+    def reset_files_lists(self):
+        """
+        Forgets the lists of files computed, after the recipe installed files
+        """
+        self._files_lists = {}
+
     def devel_files_list(self, only_existing=True):
         """
         Return the list of development files, which consists in the files and
@@ -527,16 +558,16 @@ class FilesProvider(object):
         return libs
 
     def _pyfile_get_name(self, f) -> Optional[List[str]]:
-        if os.path.exists(os.path.join(self.config.prefix, f)):
+        if prefixindex.exists(f, self.config.prefix):
             return [f]
         for py_prefix in self.py_prefixes:
             original_path = os.path.join(py_prefix, f)
-            if os.path.exists(os.path.join(self.config.prefix, original_path)):
+            if prefixindex.exists(original_path, self.config.prefix):
                 return [original_path]
             elif '*' in f:
-                fs = glob.glob(os.path.join(self.config.prefix, original_path), recursive=True)
+                fs = prefixindex.glob(original_path, self.config.prefix)
                 if fs:
-                    return [os.path.relpath(f, start=self.config.prefix) for f in fs]
+                    return fs
             elif os.path.isabs(f):
                 # A files_* entry is not made relative properly
                 raise RuntimeError(f'An absolute path "{f}"was supplied, please set relative paths only')
@@ -548,7 +579,7 @@ class FilesProvider(object):
             splitedext = os.path.splitext(f)
             for ex in ['', 'm']:
                 f = splitedext[0] + '.' + cpythonname + ex + splitedext[1]
-                if os.path.exists(os.path.join(self.config.prefix, f)):
+                if prefixindex.exists(f, self.config.prefix):
                     return [f]
         return None
 
@@ -694,6 +725,10 @@ class UniversalFilesProvider(FilesProvider):
             setattr(self, name, partial(self._aggregate_files_list_func, name))
         self.config = config
 
+    def reset_files_lists(self):
+        for r in self._recipes.values():
+            r.reset_files_lists()
+
     def _aggregate_files_list_func(self, funcname, *args):
         files = []
         for r in self._recipes.values():
@@ -16,7 +16,9 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
 import sys
+import time
 import tempfile
 import shutil
 import traceback
@@ -27,8 +29,13 @@ from subprocess import CalledProcessError
 from cerbero.enums import Platform, LibraryType
 from cerbero.errors import BuildStepError, FatalError, AbortedError
 from cerbero.build.recipe import Recipe, BuildSteps
-from cerbero.utils import N_, shell, run_tasks, determine_num_of_cpus
+from cerbero.build.artifactcache import ArtifactCache
+from cerbero.build.source import get_logfile
+from cerbero.build.telemetry import BuildTelemetry, TimedLock
+from cerbero.build import prefixindex
+from cerbero.utils import N_, shell, run_tasks, determine_num_of_cpus, determine_available_ram
 from cerbero.utils import add_system_libs, messages as m
+from cerbero.utils import jobserver
 from cerbero.utils.shell import BuildStatusPrinter
 
 
@@ -53,6 +60,11 @@ class RecoveryActions(object):
         ]
 
 
+# First version of GNU make that can use a jobserver on a named pipe
+JOBSERVER_MAKE_VERSION = '4.4'
+MiB = 1024 * 1024
+
+
 class RetryRecipeError(Exception):
     pass
 
@@ -61,6 +73,240 @@ class SkipRecipeError(Exception):
     pass
 
 
+class RecipeGraph(object):
+    """
+    Dependency graph of the recipes cooked by the L{Oven}.
+
+    The graph is sorted topologically once and the values used to
+    prioritize the build steps are precomputed in linear time, so that
+    scheduling a step is just a lookup.
+
+    @ivar deps: dependencies for each recipe name
+    @type deps: dict
+    @ivar rdeps: reverse dependencies for each recipe name
+    @type rdeps: dict
+    @ivar order: recipe names sorted so that dependencies come first
+    @type order: list
+    @ivar critical_path: number of recipes in the longest path from a final
+                         target to each recipe, including both ends
+    @type critical_path: dict
+    @ivar fan_out: number of reverse dependencies of each recipe
+    @type fan_out: dict
+    """
+
+    def __init__(self, recipe_deps):
+        """
+        @param recipe_deps: dependencies for each recipe name
+        @type recipe_deps: dict
+        """
+        self.deps = recipe_deps
+        self.rdeps = {r: [] for r in recipe_deps}
+        for r, deps in recipe_deps.items():
+            for dep in deps:
+                if dep in self.rdeps:
+                    self.rdeps[dep].append(r)
+        self.order = self._sort()
+        self.fan_out = {r: len(rdeps) for r, rdeps in self.rdeps.items()}
+        self.critical_path = {}
+        # reverse dependencies are visited before their dependencies
+        for r in reversed(self.order):
+            self.critical_path[r] = 1 + max((self.critical_path[x] for x in self.rdeps[r]), default=0)
+
+    def _sort(self):
+        # Kahn's algorithm
+        pending = {r: len([d for d in deps if d in self.rdeps]) for r, deps in self.deps.items()}
+        ready = collections.deque(sorted(r for r, count in pending.items() if count == 0))
+        order = []
+        while ready:
+            r = ready.popleft()
+            order.append(r)
+            for rdep in self.rdeps[r]:
+                pending[rdep] -= 1
+                if pending[rdep] == 0:
+                    ready.append(rdep)
+        if len(order) != len(self.deps):
+            cycle = sorted(r for r, count in pending.items() if count > 0)
+            raise FatalError(N_('Dependency cycle found between recipes: %s') % ' '.join(cycle))
+        return order
+
+    def targets(self):
+        """
+        Final targets, the recipes without reverse dependencies
+
+        @return: set of recipe names
+        @rtype: set
+        """
+        return set(r for r, count in self.fan_out.items() if count == 0)
+
+
+class RecipeReadyTracker(object):
+    """
+    Tracks the recipes of a L{RecipeGraph} that are ready to be built,
+    keeping a counter of the dependencies not built yet for each recipe so
+    that finishing a recipe only needs to visit its reverse dependencies.
+    """
+
+    def __init__(self, graph, built=None):
+        """
+        @param graph: the dependency graph of the recipes
+        @type graph: L{RecipeGraph}
+        @param built: names of the recipes already built
+        @type built: set
+        """
+        self.graph = graph
+        self.built = set(built or [])
+        self.pending = {}
+        for r, deps in graph.deps.items():
+            self.pending[r] = len([d for d in deps if d in graph.rdeps and d not in self.built])
+
+    def ready(self):
+        """
+        Recipes not built yet with all their dependencies built
+
+        @return: list of recipe names in build order
+        @rtype: list
+        """
+        return [r for r in self.graph.order if r not in self.built and self.pending[r] == 0]
+
+    def mark_built(self, recipe_name):
+        """
+        Marks a recipe as built
+
+        @param recipe_name: name of the recipe built
+        @type recipe_name: str
+        @return: names of the recipes that became ready to be built
+        @rtype: list
+        """
+        if recipe_name in self.built:
+            return []
+        self.built.add(recipe_name)
+        ready = []
+        for rdep in self.graph.rdeps[recipe_name]:
+            self.pending[rdep] -= 1
+            if self.pending[rdep] == 0 and rdep not in self.built:
+                ready.append(rdep)
+        return ready
+
+
+class RecipeStepPriority(object):
+    """
+    Priority of a recipe step in the build queues. Steps from recipes in
+    a longer path to the final targets and with more reverse dependencies
+    are built first.
+    """
+
+    # can't use a tuple as Recipe doens't implement __lt__() as
+    # required by PriorityQueue
+    def __init__(self, graph, recipe, count, step):
+        self.recipe = recipe
+        self.step = step
+        self.inverse_priority = graph.critical_path[recipe.name]
+        self.inverse_priority *= graph.fan_out[recipe.name] + 1
+        self.count = count
+        self.queued = time.monotonic()
+
+        if step is not None:
+            # buf already started recipes
+            self.inverse_priority *= 4
+        if step is BuildSteps.INSTALL[1]:
+            # buf installs
+            self.inverse_priority *= 8
+        if hasattr(recipe, 'allow_parallel_build') and not recipe.allow_parallel_build:
+            self.inverse_priority *= 2
+
+    def __lt__(self, other):
+        # return lower for larger path lengths
+        return self.inverse_priority > other.inverse_priority
+
+
+class MemoryBudget(object):
+    """
+    Admits the compilation of recipes while the sum of their estimated peak
+    memory fits in the budget. A recipe is always admitted when nothing else
+    is being compiled, even if its estimate exceeds the budget.
+
+    @ivar total: the budget in bytes
+    @type total: int
+    @ivar used: the memory reserved by the recipes being compiled
+    @type used: int
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.reservations = 0
+        self._waiters = []
+
+    def _fits(self, size):
+        return self.reservations == 0 or self.used + size <= self.total
+
+    async def acquire(self, size):
+        """
+        Reserves memory, waiting until it fits in the budget
+
+        @param size: the memory in bytes
+        @type size: int
+        """
+        while not self._fits(size):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self.used += size
+        self.reservations += 1
+
+    def release(self, size):
+        """
+        Gives back memory reserved with L{acquire}
+
+        @param size: the memory in bytes
+        @type size: int
+        """
+        self.used -= size
+        self.reservations -= 1
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def reserve(self, size):
+        """
+        @param size: the memory in bytes
+        @type size: int
+        @return: a lock reserving the memory while held
+        @rtype: L{MemoryReservation}
+        """
+        return MemoryReservation(self, size)
+
+
+class MemoryReservation(object):
+    """
+    Reservation of memory from a L{MemoryBudget}, used like a lock. Releasing
+    it when it's not held does nothing.
+    """
+
+    def __init__(self, budget, size):
+        self.budget = budget
+        self.size = size
+        self.held = False
+
+    async def acquire(self):
+        await self.budget.acquire(self.size)
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.budget.release(self.size)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *args):
+        self.release()
+
+
 class Oven(object):
     """
     This oven cooks recipes with all their ingredients
@@ -106,22 +352,30 @@ class Oven(object):
         self.interactive = self.config.interactive
         self.deps_only = deps_only
         shell.DRY_RUN = dry_run
+        shell.PROCESS_ACCOUNTING = self.config.process_accounting
         self.jobs = jobs
         self.steps_filter = steps_filter
         if not self.jobs:
             self.jobs = determine_num_of_cpus()
         if self.config.platform == Platform.WINDOWS:
-            self._build_lock = asyncio.Semaphore(self.jobs / 2)
+            self._build_lock = TimedLock(asyncio.Semaphore(self.jobs / 2), 'build')
         else:
-            self._build_lock = asyncio.Semaphore(2)
+            self._build_lock = TimedLock(asyncio.Semaphore(2), 'build')
         # Add a separate lock for Rust tasks that will
         # be required if only one concurrent job is allowed.
-        self._architecture_lock = asyncio.Semaphore(1)
+        self._architecture_lock = TimedLock(asyncio.Semaphore(1), 'architecture')
         # Can't install in parallel because of the risk of two recipes writing
         # to the same file at the same time. TODO: Need to use DESTDIR + prefix
         # merging + file list tracking for collision detection before we can
         # enable this.
-        self._install_lock = asyncio.Lock()
+        self._install_lock = TimedLock(asyncio.Lock(), 'install')
+        self.telemetry = BuildTelemetry({RetryRecipeError: 'retry', SkipRecipeError: 'skip'})
+        self._recipe_deps = {}
+        self._jobserver = None
+        self._memory_budget = None
+        self._artifact_cache = None
+        if ArtifactCache.enabled(self.config):
+            self._artifact_cache = ArtifactCache(self.config, self.cookbook)
 
     async def start_cooking(self):
         """
@@ -152,7 +406,69 @@ class Oven(object):
         self._build_status_printer = BuildStatusPrinter(steps, self.interactive)
         self._static_libraries_built = []
 
-        await self._cook_recipes(ordered_recipes)
+        self._start_jobserver()
+        budget = self.config.memory_budget
+        self._memory_budget = MemoryBudget(budget * MiB if budget else determine_available_ram())
+        try:
+            await self._cook_recipes(ordered_recipes)
+        finally:
+            self._stop_jobserver()
+            self._write_telemetry()
+
+    def _start_jobserver(self):
+        if not self.config.jobserver or shell.DRY_RUN:
+            return
+        if not jobserver.Jobserver.supported():
+            m.warning(N_('The jobserver is not supported on this platform'))
+            return
+        tool, version, newer = shell.check_tool_version('make', JOBSERVER_MAKE_VERSION, self.config.env)
+        if tool is None:
+            m.warning(N_('The jobserver needs GNU make >= %s, but it was not found') % JOBSERVER_MAKE_VERSION)
+            return
+        if not newer:
+            m.warning(N_('The jobserver needs GNU make >= %s, but %s was found') % (JOBSERVER_MAKE_VERSION, version))
+            return
+        self._jobserver = jobserver.Jobserver(self.config.num_of_cpus)
+        jobserver.set_jobserver(self._jobserver)
+        m.message(N_('Sharing %d jobs between the recipes with a jobserver') % self._jobserver.slots)
+
+    def _recipe_peak_memory(self, recipe):
+        # Estimate declared by the recipe or learned from its last build
+        if recipe.peak_memory:
+            return recipe.peak_memory * MiB
+        return self.cookbook.get_recipe_peak_memory(recipe.name)
+
+    def _memory_reservation(self, recipe):
+        peak_memory = self._recipe_peak_memory(recipe)
+        if not peak_memory:
+            return None
+        return TimedLock(self._memory_budget.reserve(peak_memory), 'memory')
+
+    @staticmethod
+    def _recipe_jobs(recipe):
+        num_of_cpus = getattr(recipe, 'num_of_cpus', None)
+        return (num_of_cpus() if num_of_cpus else None) or 1
+
+    def _stop_jobserver(self):
+        if self._jobserver is None:
+            return
+        jobserver.set_jobserver(None)
+        self._jobserver.close()
+        self._jobserver = None
+
+    def _write_telemetry(self):
+        if not self.telemetry.events:
+            return
+        trace_path = os.path.join(self.config.logs, 'build-trace.json')
+        try:
+            self.telemetry.write_chrome_trace(trace_path)
+        except OSError as ex:
+            m.warning(N_('Could not write the build trace %s: %s') % (trace_path, ex))
+            trace_path = None
+        for line in self.telemetry.summary(self._recipe_deps):
+            m.output(line, sys.stdout)
+        if trace_path:
+            m.output(N_('Build trace written to %s') % trace_path, sys.stdout)
 
     async def _cook_recipes(self, recipes):
         recipes = set(recipes)
@@ -183,58 +499,13 @@ class Oven(object):
             deps = all_deps_without_recipe(r)
             recipe_deps[r] = deps
 
-        # precompute the reverse deps for each recipe
-        def rdeps(recipe):
-            ret = []
-            for r, deps in recipe_deps.items():
-                if recipe in deps:
-                    ret.append(r)
-            return ret
-
-        recipe_rdeps = {}
-        for r in recipe_deps.keys():
-            recipe_rdeps[r] = rdeps(r)
-
-        def find_recipe_dep_path(from_name, to_name):
-            # returns a list of recipe names in reverse order that describes
-            # the path for building @from_name
-            # None if there is no path
-            if from_name == to_name:
-                return [to_name]
-            for dep in recipe_deps[from_name]:
-                val = find_recipe_dep_path(dep, to_name)
-                if val:
-                    return [from_name] + val
-
-        def find_longest_path(to_recipes):
-            # return the longest path from the targets to one of @to_recipes
-            def yield_path_lengths():
-                for f in recipe_targets:
-                    for t in to_recipes:
-                        path = find_recipe_dep_path(f, t)
-                        if path:
-                            yield len(path)
-
-            return max((length for length in yield_path_lengths()))
-
-        def find_buildable_recipes():
-            # This is a dumb algorithm that only looks for all available
-            # recipes that can be built.  We use a priority queue for
-            # the smarts.
-            for recipe in recipes:
-                if recipe.name in built_recipes:
-                    continue
-                if recipe.name in building_recipes:
-                    continue
-
-                if len(recipe_deps[recipe.name]) == 0:
-                    yield recipe
-                    continue
+        # precompute the reverse deps and the scheduling priorities
+        graph = RecipeGraph(recipe_deps)
+        self._recipe_deps = graph.deps
 
-                built_deps = set((dep for dep in recipe_deps[recipe.name] if dep in built_recipes))
-                if len(built_deps) > 0 and built_deps == set(recipe_deps[recipe.name]):
-                    # we have a new dep buildable
-                    yield recipe
+        # track the recipes whose dependencies are all built
+        recipes_by_name = dict((r.name, r) for r in recipes)
+        ready_tracker = RecipeReadyTracker(graph, built_recipes)
 
         class MutableInt:
             def __init__(self):
@@ -242,29 +513,6 @@ class Oven(object):
 
         counter = MutableInt()
 
-        class RecipeStepPriority:
-            # can't use a tuple as Recipe doens't implement __lt__() as
-            # required by PriorityQueue
-            def __init__(self, recipe, count, step):
-                self.recipe = recipe
-                self.step = step
-                self.inverse_priority = find_longest_path((recipe.name,))
-                self.inverse_priority *= len(recipe_rdeps[recipe.name]) + 1
-                self.count = count
-
-                if step is not None:
-                    # buf already started recipes
-                    self.inverse_priority *= 4
-                if step is BuildSteps.INSTALL[1]:
-                    # buf installs
-                    self.inverse_priority *= 8
-                if hasattr(recipe, 'allow_parallel_build') and not recipe.allow_parallel_build:
-                    self.inverse_priority *= 2
-
-            def __lt__(self, other):
-                # return lower for larger path lengths
-                return self.inverse_priority > other.inverse_priority
-
         def recipe_next_step(recipe, step):
             assert step is not None
             if step == 'init':
@@ -279,16 +527,19 @@ class Oven(object):
         def add_buildable_recipes(recipe):
             built_recipes.add(recipe.name)
             building_recipes.remove(recipe.name)
-            for buildable in find_buildable_recipes():
+            for name in ready_tracker.mark_built(recipe.name):
+                buildable = recipes_by_name[name]
                 building_recipes.add(buildable.name)
-                default_queue.put_nowait(RecipeStepPriority(buildable, 0, 'init'))
+                default_queue.put_nowait(RecipeStepPriority(graph, buildable, 0, 'init'))
 
-        async def cook_recipe_worker(q, steps):
+        async def cook_recipe_worker(q, steps, worker_id):
+            self.telemetry.start_worker(worker_id, ', '.join(s for s in all_steps if s in steps))
             while True:
                 recipe_d = await q.get()
                 recipe = recipe_d.recipe
                 step = recipe_d.step
                 count = recipe_d.count
+                queue_wait = time.monotonic() - recipe_d.queued
 
                 if step == 'init':
                     counter.i += 1
@@ -297,20 +548,52 @@ class Oven(object):
                         add_buildable_recipes(recipe)
                         q.task_done()
                         continue
+                    if await self._cook_restore_recipe(recipe, count):
+                        self._cook_finish_recipe(recipe, count)
+                        add_buildable_recipes(recipe)
+                        q.task_done()
+                        continue
                     step = recipe_next_step(recipe, step)
 
                 lock = locks[step]
                 if step == BuildSteps.COMPILE[1]:
-                    if not hasattr(recipe, 'allow_parallel_build') or not recipe.allow_parallel_build:
+                    if self._jobserver is not None:
+                        # Every compilation takes a slot of the jobserver, and
+                        # the parallel ones take more from it for their jobs
+                        lock = TimedLock(self._jobserver, 'jobserver')
+                    elif not hasattr(recipe, 'allow_parallel_build') or not recipe.allow_parallel_build:
                         # only allow a limited number of recipes that can fill all
                         # CPU cores to execute concurrently.  Any recipe that does
                         # not support parallel builds will always be executed
                         lock = None
 
-                async def build_recipe_steps(step):
+                # The memory is reserved before taking a compile slot, so that
+                # recipes waiting for it don't hold a slot others could use
+                memory = self._memory_reservation(recipe) if step == BuildSteps.COMPILE[1] else None
+
+                async def build_recipe_steps(step, memory):
                     # run the steps
+                    wait = queue_wait
                     while step in steps:
-                        await self._cook_recipe_step_with_prompt(recipe, step, count)
+                        if step == BuildSteps.COMPILE[1] and memory is None:
+                            memory = self._memory_reservation(recipe)
+                            if memory is not None:
+                                await memory.acquire()
+                        try:
+                            with self.telemetry.record_step(recipe.name, step, wait) as event:
+                                done = await self._cook_recipe_step_with_prompt(recipe, step, count)
+                                if not done:
+                                    event.status = 'skipped'
+                        finally:
+                            if memory is not None:
+                                memory.release()
+                                memory = None
+                        if step == BuildSteps.COMPILE[1] and event.usage.maxrss:
+                            # learn the estimate for the next builds from the
+                            # biggest process, once for each of the jobs
+                            peak_memory = event.usage.maxrss * self._recipe_jobs(recipe)
+                            self.cookbook.update_recipe_peak_memory(recipe.name, peak_memory)
+                        wait = 0.0
                         step = recipe_next_step(recipe, step)
                     return step
 
@@ -319,11 +602,19 @@ class Oven(object):
                         recipe._lock = self._architecture_lock
                     else:
                         recipe._lock = None
-                    if lock:
-                        async with lock:
-                            step = await build_recipe_steps(step)
-                    else:
-                        step = await build_recipe_steps(step)
+                    try:
+                        if memory is not None:
+                            await memory.acquire()
+                        if lock:
+                            async with lock:
+                                step = await build_recipe_steps(step, memory)
+                        else:
+                            step = await build_recipe_steps(step, memory)
+                    finally:
+                        if memory is not None:
+                            memory.release()
+                    if step is None:
+                        await self._cook_store_recipe(recipe)
                 except RetryRecipeError:
                     step = 'init'
                 except SkipRecipeError:
@@ -338,7 +629,7 @@ class Oven(object):
 
                 q.task_done()
                 if next_queue:
-                    next_queue.put_nowait(RecipeStepPriority(recipe, count, step))
+                    next_queue.put_nowait(RecipeStepPriority(graph, recipe, count, step))
 
         # all the steps we are performing
         all_steps = ['init'] + [s[1] for s in next(iter(recipes)).steps]
@@ -401,12 +692,12 @@ class Oven(object):
                 # through all the steps after
                 if install_done:
                     continue
-                tasks.append(asyncio.ensure_future(cook_recipe_worker(queues[step], install_steps)))
+                tasks.append(asyncio.ensure_future(cook_recipe_worker(queues[step], install_steps, len(tasks))))
                 used_steps.extend(install_steps)
                 install_done = True
             else:
                 for i in range(count):
-                    tasks.append(asyncio.ensure_future(cook_recipe_worker(queues[step], [step])))
+                    tasks.append(asyncio.ensure_future(cook_recipe_worker(queues[step], [step], len(tasks))))
                 used_steps.append(step)
             used_jobs += count
         general_jobs = self.jobs - used_jobs
@@ -433,7 +724,8 @@ class Oven(object):
         )
 
         for i in range(self.jobs - used_jobs):
-            tasks.append(asyncio.ensure_future(cook_recipe_worker(default_queue, set(all_steps) - set(used_steps))))
+            general_steps = set(all_steps) - set(used_steps)
+            tasks.append(asyncio.ensure_future(cook_recipe_worker(default_queue, general_steps, len(tasks))))
 
         async def recipes_done():
             async def heartbeat_output():
@@ -451,9 +743,10 @@ class Oven(object):
 
         # push the initial set of recipes that have no dependencies to start
         # building
-        for recipe in find_buildable_recipes():
+        for name in ready_tracker.ready():
+            recipe = recipes_by_name[name]
             building_recipes.add(recipe.name)
-            default_queue.put_nowait(RecipeStepPriority(recipe, 0, 'init'))
+            default_queue.put_nowait(RecipeStepPriority(graph, recipe, 0, 'init'))
 
         try:
             await run_tasks(tasks, recipes_done())
@@ -463,7 +756,7 @@ class Oven(object):
 
     async def _cook_recipe_step_with_prompt(self, recipe, step, count):
         try:
-            await self._cook_recipe_step(recipe, step, count)
+            return await self._cook_recipe_step(recipe, step, count)
         except BuildStepError as be:
             if not self.interactive:
                 raise be
@@ -489,7 +782,7 @@ class Oven(object):
                 # propagate up to the task manager to retry the recipe entirely
                 raise RetryRecipeError()
             elif action == RecoveryActions.RETRY_STEP:
-                await self._cook_recipe_step(recipe, step, count)
+                return await self._cook_recipe_step(recipe, step, count)
             elif action == RecoveryActions.SKIP:
                 # propagate up to the task manager to retry the recipe entirely
                 raise SkipRecipeError()
@@ -499,10 +792,10 @@ class Oven(object):
     async def _cook_recipe_step(self, recipe, step, count):
         # check if the current step needs to be done
         if self.steps_filter is not None and step not in self.steps_filter:
-            return
+            return False
         if self.cookbook.step_done(recipe.name, step) and not self.force:
             self._build_status_printer.update_recipe_step(count, recipe.name, step)
-            return
+            return False
         try:
             # call step function
             stepfunc = getattr(recipe, step)
@@ -511,12 +804,17 @@ class Oven(object):
                 raise FatalError(N_('Step %s not found') % step)
 
             self._build_status_printer.update_recipe_step(count, recipe.name, step)
-            ret = stepfunc()
-            if asyncio.iscoroutine(ret):
-                await ret
+            try:
+                ret = stepfunc()
+                if asyncio.iscoroutine(ret):
+                    await ret
+            finally:
+                # The step might have installed files in the prefix
+                prefixindex.mark_stale()
             self._build_status_printer.remove_recipe(recipe.name)
             # update status successfully
             self.cookbook.update_step_status(recipe.name, step)
+            return True
         except asyncio.CancelledError:
             raise
         except FatalError as e:
@@ -554,6 +852,37 @@ class Oven(object):
         recipe.force = self.force
         return False
 
+    def _use_artifact_cache(self, recipe):
+        if self._artifact_cache is None or shell.DRY_RUN:
+            return False
+        # Partial builds don't install the recipe
+        if self.steps_filter is not None:
+            return False
+        return self._artifact_cache.can_cache(recipe)
+
+    async def _cook_restore_recipe(self, recipe, count):
+        if self.force or not self._use_artifact_cache(recipe):
+            return False
+        logfile = get_logfile(recipe)
+        # Downloaded without the install lock, other recipes keep installing
+        tarball = await self._artifact_cache.fetch(recipe, logfile=logfile)
+        if tarball is None:
+            return False
+        # Restoring installs the files in the prefix
+        async with self._install_lock:
+            await self._artifact_cache.install(recipe, tarball, logfile=logfile)
+            prefixindex.mark_stale()
+        m.log(N_('Recipe %s restored from the artifact cache') % recipe.name, sys.stdout)
+        return True
+
+    async def _cook_store_recipe(self, recipe):
+        if not self._use_artifact_cache(recipe):
+            return
+        try:
+            await self._artifact_cache.store(recipe, logfile=get_logfile(recipe))
+        except Exception as ex:
+            m.warning(N_('Could not store %s in the artifact cache: %s') % (recipe.name, ex))
+
     def _cook_finish_recipe(self, recipe, count):
         self._build_status_printer.built(count, recipe.name)
         self.cookbook.update_build_status(recipe.name, recipe.built_version())
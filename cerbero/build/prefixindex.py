@@ -0,0 +1,489 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+In-memory index of the files installed in a prefix, used by the
+L{cerbero.build.filesprovider.FilesProvider} to resolve the files of the
+recipes without scanning the filesystem for each pattern.
+"""
+
+import functools
+import glob as pyglob
+import hashlib
+import os
+import re
+import time
+
+from cerbero.utils import hashing, shell
+
+# Kinds of entries
+FILE = 'f'
+DIR = 'd'
+# Symlinks to directories are not followed, like os.walk does
+DIR_LINK = 'l'
+BROKEN_LINK = 'x'
+
+# Disables the index, resolving the files in the filesystem
+ENABLED = True
+
+_indexes = {}
+_MAGIC = re.compile(r'[*?[]')
+
+
+class NotIndexed(Exception):
+    """
+    Raised for lookups through symlinks to directories, which must be
+    resolved in the filesystem
+    """
+
+
+def get_prefix_index(prefix):
+    """
+    Gets the index of a prefix, scanning it the first time
+
+    @param prefix: path of the prefix
+    @type prefix: str
+    @return: the index or None if disabled
+    @rtype: L{PrefixIndex}
+    """
+    if not ENABLED:
+        return None
+    prefix = os.path.abspath(prefix)
+    index = _indexes.get(prefix)
+    if index is None:
+        index = _indexes[prefix] = PrefixIndex(prefix)
+    return index
+
+
+def mark_stale(prefix=None):
+    """
+    Marks the index of a prefix, or all of them, to be refreshed before the
+    next lookup, after something was installed in it
+
+    @param prefix: path of the prefix, all prefixes if None
+    @type prefix: str
+    """
+    if prefix is None:
+        indexes = _indexes.values()
+    else:
+        indexes = [i for i in [_indexes.get(os.path.abspath(prefix))] if i]
+    for index in indexes:
+        index.stale = True
+
+
+def clear_indexes():
+    """
+    Drops the indexes of all the prefixes, which will be scanned again
+    """
+    _indexes.clear()
+
+
+@functools.lru_cache(maxsize=4096)
+def translate(segment):
+    """
+    Translates a glob pattern matching a path component to a regular
+    expression
+
+    @param segment: the pattern
+    @type segment: str
+    @return: the compiled regular expression
+    @rtype: re.Pattern
+    """
+    i, n = 0, len(segment)
+    res = ''
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            res += '.*'
+        elif c == '?':
+            res += '.'
+        elif c == '[':
+            j = i
+            if j < n and segment[j] == '!':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:
+                res += '\\['
+            else:
+                stuff = re.sub(r'([&~|])', r'\\\1', segment[i:j].replace('\\', '\\\\'))
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] in ('^', '['):
+                    stuff = '\\' + stuff
+                res += '[%s]' % stuff
+        else:
+            res += re.escape(c)
+    return re.compile(res, re.DOTALL)
+
+
+class PrefixIndex(object):
+    """
+    Trie of the entries of a prefix, with a node for each directory holding
+    the kind of its children. Directories are rescanned when their mtime
+    changes, which happens when entries are added to them or removed, and
+    while their mtime is too recent to tell apart later changes, see
+    L{cerbero.utils.hashing.RACY_INTERVAL}.
+
+    @ivar prefix: path of the prefix
+    @type prefix: str
+    @ivar stale: whether the index must be refreshed before the next lookup
+    @type stale: bool
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.stale = False
+        self._dirs = {}  # relpath -> (mtime_ns, {name: kind}, racy)
+        self._signature = None
+        self.refresh()
+
+    def _scan_dir(self, relpath, mtime, racy):
+        children = {}
+        try:
+            entries = list(os.scandir(os.path.join(self.prefix, relpath)))
+        except (FileNotFoundError, NotADirectoryError):
+            self._dirs.pop(relpath, None)
+            return
+        for entry in entries:
+            if entry.is_symlink():
+                if entry.is_dir():
+                    kind = DIR_LINK
+                elif os.path.exists(entry.path):
+                    kind = FILE
+                else:
+                    kind = BROKEN_LINK
+            elif entry.is_dir(follow_symlinks=False):
+                kind = DIR
+            else:
+                kind = FILE
+            children[entry.name] = kind
+        self._dirs[relpath] = (mtime, children, racy)
+
+    def refresh(self):
+        """
+        Rescans the directories of the prefix that changed since the last
+        scan
+        """
+        pending = ['']
+        seen = set()
+        changed = False
+        now = time.time()
+        while pending:
+            relpath = pending.pop()
+            seen.add(relpath)
+            try:
+                mtime = os.stat(os.path.join(self.prefix, relpath)).st_mtime_ns
+            except OSError:
+                continue
+            old = self._dirs.get(relpath)
+            if old is None or old[0] != mtime or old[2]:
+                # Entries added in the same mtime tick would go unnoticed
+                self._scan_dir(relpath, mtime, now - mtime / 1e9 < hashing.RACY_INTERVAL)
+                node = self._dirs.get(relpath)
+                if node is None or old is None or node[:2] != old[:2]:
+                    changed = True
+                if node is None:
+                    continue
+            else:
+                node = old
+            for name, kind in node[1].items():
+                if kind == DIR:
+                    pending.append(self._join(relpath, name))
+        for relpath in set(self._dirs) - seen:
+            changed = True
+            del self._dirs[relpath]
+        if changed:
+            self._signature = None
+        self.stale = False
+
+    def signature(self):
+        """
+        Gets a digest of the modification times of all the directories of
+        the prefix, which changes whenever entries are added or removed, to
+        validate results computed from the index in other processes
+
+        @return: the hex digest
+        @rtype: str
+        """
+        if self.stale:
+            self.refresh()
+        if self._signature is None:
+            h = hashlib.sha1()
+            for relpath in sorted(self._dirs):
+                mtime, children, racy = self._dirs[relpath]
+                h.update(('%s\0%d\0' % (relpath, mtime)).encode('utf-8', 'surrogateescape'))
+                if racy:
+                    # The mtime might not change with the next entries
+                    h.update(('%s\0' % '/'.join(sorted(children))).encode('utf-8', 'surrogateescape'))
+            self._signature = h.hexdigest()
+        return self._signature
+
+    @staticmethod
+    def _join(relpath, name):
+        return relpath + '/' + name if relpath else name
+
+    def _kind(self, relpath):
+        if self.stale:
+            self.refresh()
+        if relpath in ('', '.'):
+            return DIR
+        parent, _, name = relpath.rpartition('/')
+        node = self._dirs.get(parent)
+        if node is None:
+            if self._kind(parent) == DIR_LINK:
+                raise NotIndexed(relpath)
+            return None
+        return node[1].get(name)
+
+    def _children(self, relpath):
+        node = self._dirs.get(relpath)
+        if node is None:
+            if self._kind(relpath) == DIR_LINK:
+                raise NotIndexed(relpath)
+            return {}
+        return node[1]
+
+    @staticmethod
+    def _relpath(path):
+        if not path:
+            return ''
+        if os.path.isabs(path):
+            raise NotIndexed(path)
+        relpath = os.path.normpath(path).replace(os.sep, '/')
+        if relpath == '..' or relpath.startswith('../'):
+            raise NotIndexed(path)
+        return relpath.rstrip('/')
+
+    def exists(self, path):
+        """
+        @param path: path relative to the prefix
+        @type path: str
+        @return: whether the path exists, following symlinks
+        @rtype: bool
+        """
+        kind = self._kind(self._relpath(path))
+        return kind not in (None, BROKEN_LINK)
+
+    def isdir(self, path):
+        """
+        @param path: path relative to the prefix
+        @type path: str
+        @return: whether the path is a directory, following symlinks
+        @rtype: bool
+        """
+        return self._kind(self._relpath(path)) in (DIR, DIR_LINK)
+
+    def ls_dir(self, path):
+        """
+        Lists the files in a directory and its subdirectories, like
+        L{cerbero.utils.shell.ls_dir}
+
+        @param path: path of the directory relative to the prefix
+        @type path: str
+        @return: paths of the files relative to the prefix
+        @rtype: list
+        """
+        files = []
+        pending = [self._relpath(path)]
+        if self._kind(pending[0]) == DIR_LINK:
+            raise NotIndexed(path)
+        while pending:
+            relpath = pending.pop()
+            for name, kind in self._children(relpath).items():
+                if kind == DIR:
+                    pending.append(self._join(relpath, name))
+                elif kind != DIR_LINK:
+                    files.append(self._join(relpath, name))
+        return files
+
+    def _descendants(self, relpath, hidden, files=False):
+        found = [relpath]
+        pending = [relpath]
+        while pending:
+            parent = pending.pop()
+            for name, kind in self._children(parent).items():
+                if not hidden and name.startswith('.'):
+                    continue
+                child = self._join(parent, name)
+                if kind == DIR:
+                    found.append(child)
+                    pending.append(child)
+                elif kind == DIR_LINK and not hidden:
+                    # glob.glob follows them
+                    raise NotIndexed(child)
+                elif files:
+                    found.append(child)
+        return found
+
+    def glob(self, pattern, hidden=True):
+        """
+        Finds the paths matching a glob pattern, with the semantics of
+        pathlib.Path.glob, or the ones of glob.glob with recursive=True if
+        hidden files are not matched
+
+        @param pattern: the pattern, relative to the prefix
+        @type pattern: str
+        @param hidden: whether wildcards match names starting with a dot
+        @type hidden: bool
+        @return: the paths found, relative to the prefix
+        @rtype: list
+        """
+        if self.stale:
+            self.refresh()
+        if os.path.isabs(pattern) or '..' in pattern.split('/'):
+            raise NotIndexed(pattern)
+        segments = [s for s in pattern.split('/') if s not in ('', '.')]
+        current = ['']
+        for i, segment in enumerate(segments):
+            last = i == len(segments) - 1
+            found = []
+            if segment == '**':
+                # glob.glob also matches the files with a trailing '**'
+                for relpath in current:
+                    found.extend(self._descendants(relpath, hidden, last and not hidden))
+            elif not _MAGIC.search(segment):
+                for relpath in current:
+                    path = self._join(relpath, segment)
+                    kind = self._kind(path)
+                    # Like os.path.lexists for glob.glob and os.path.exists for pathlib
+                    if kind == DIR or (last and kind is not None and (not hidden or kind != BROKEN_LINK)):
+                        found.append(path)
+                    elif kind == DIR_LINK:
+                        raise NotIndexed(path)
+            else:
+                regex = translate(segment)
+                for relpath in current:
+                    for name, kind in self._children(relpath).items():
+                        if not hidden and name.startswith('.') and not segment.startswith('.'):
+                            continue
+                        if not regex.fullmatch(name):
+                            continue
+                        if kind == DIR_LINK and not last:
+                            raise NotIndexed(self._join(relpath, name))
+                        if last or kind == DIR:
+                            found.append(self._join(relpath, name))
+            current = found
+        return [p for p in current if p]
+
+
+def ls_files(files, prefix):
+    """
+    Like L{cerbero.utils.shell.ls_files}, using the index of the prefix
+
+    @param files: glob patterns relative to the prefix
+    @type files: list
+    @param prefix: path of the prefix
+    @type prefix: str
+    @return: the paths found, relative to the prefix
+    @rtype: list
+    """
+    index = get_prefix_index(prefix)
+    if index is None:
+        return shell.ls_files(files, prefix)
+    sfiles = set()
+    for f in ' '.join(files).split():
+        try:
+            sfiles.update(index.glob(f))
+        except NotIndexed:
+            sfiles.update(shell.ls_files([f], prefix))
+    return list(sfiles)
+
+
+def ls_dir(path, prefix):
+    """
+    Like L{cerbero.utils.shell.ls_dir}, using the index of the prefix
+
+    @param path: path of the directory relative to the prefix
+    @type path: str
+    @param prefix: path of the prefix
+    @type prefix: str
+    @return: paths of the files relative to the prefix
+    @rtype: list
+    """
+    index = get_prefix_index(prefix)
+    if index is not None:
+        try:
+            return index.ls_dir(path)
+        except NotIndexed:
+            pass
+    return shell.ls_dir(os.path.join(prefix, path), prefix)
+
+
+def glob(pattern, prefix):
+    """
+    Like glob.glob with recursive=True, using the index of the prefix
+
+    @param pattern: glob pattern relative to the prefix
+    @type pattern: str
+    @param prefix: path of the prefix
+    @type prefix: str
+    @return: the paths found, relative to the prefix
+    @rtype: list
+    """
+    index = get_prefix_index(prefix)
+    if index is not None:
+        try:
+            return index.glob(pattern, hidden=False)
+        except NotIndexed:
+            pass
+    found = pyglob.glob(os.path.join(prefix, pattern), recursive=True)
+    return [os.path.relpath(f, start=prefix) for f in found]
+
+
+def exists(path, prefix):
+    """
+    Like os.path.exists, using the index of the prefix
+
+    @param path: path relative to the prefix
+    @type path: str
+    @param prefix: path of the prefix
+    @type prefix: str
+    @rtype: bool
+    """
+    index = get_prefix_index(prefix)
+    if index is not None:
+        try:
+            return index.exists(path)
+        except NotIndexed:
+            pass
+    return os.path.exists(os.path.join(prefix, path))
+
+
+def isdir(path, prefix):
+    """
+    Like os.path.isdir, using the index of the prefix
+
+    @param path: path relative to the prefix
+    @type path: str
+    @param prefix: path of the prefix
+    @type prefix: str
+    @rtype: bool
+    """
+    index = get_prefix_index(prefix)
+    if index is not None:
+        try:
+            return index.isdir(path)
+        except NotIndexed:
+            pass
+    return os.path.isdir(os.path.join(prefix, path))
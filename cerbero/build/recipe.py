@@ -48,6 +48,10 @@ def log_step_output(recipe, stepfunc):
         recipe.old_logfile = recipe.logfile  # Allow calling build steps recursively
         recipe.logfile = open(path, 'w+')
 
+    def log_usage(usage):
+        if usage.count:
+            m.log('Resources used by the commands of the step: %s' % usage, recipe.logfile)
+
     def close_file():
         # if logfile is empty, remove it
         pos = recipe.logfile.tell()
@@ -99,10 +103,12 @@ def log_step_output(recipe, stepfunc):
     async def async_wrapped(*args, **kwargs):
         open_file()
         try:
-            ret = await stepfunc(*args, **kwargs)
+            with shell.account_processes(shell.ProcessUsage()) as usage:
+                ret = await stepfunc(*args, **kwargs)
         except FatalError:
             handle_exception()
             raise
+        log_usage(usage)
         close_file()
         return ret
 
@@ -202,6 +208,10 @@ class Recipe(FilesProvider, metaclass=MetaRecipe):
     @type runtime_dep: bool
     @cvar bash_completions: list of bash completion scripts for shell
     @type bash_completions: list
+    @cvar peak_memory: estimate of the memory in MiB needed to compile the
+                       recipe, used by the Oven to avoid compiling together
+                       recipes that don't fit in the RAM
+    @type peak_memory: int
     """
 
     # Licenses are declared as an array of License.enums or dicts of the type:
@@ -247,6 +257,7 @@ class Recipe(FilesProvider, metaclass=MetaRecipe):
     runtime_dep = False
     bash_completions = None
     skip_steps = None
+    peak_memory = None
 
     # Internal properties
     force = False
@@ -608,8 +619,8 @@ SOFTWARE LICENSE COMPLIANCE.\n\n"""
         # Only relocate files are that are potentially relocatable and
         # remove duplicates by symbolic links so we relocate libs only
         # once.
-        for f in set([get_real_path(x) for x in self.files_list() if file_is_relocatable(x)]):
-            relocator.relocate_file(f)
+        files = set([get_real_path(x) for x in self.files_list() if file_is_relocatable(x)])
+        relocator.relocate_files(sorted(files), jobs=self.config.num_of_cpus)
 
     def code_sign(self):
         """
@@ -1062,7 +1073,7 @@ class UniversalMergedRecipe(BaseUniversalRecipe, UniversalMergedFilesProvider):
         # merge the common files
         inputs = reduce(lambda x, y: x & y, arch_inputs.values())
         output = self._config.prefix
-        generator = OSXUniversalGenerator(output, logfile=self.logfile)
+        generator = OSXUniversalGenerator(output, logfile=self.logfile, jobs=self._config.num_of_cpus)
         dirs = [recipe.config.prefix for arch, recipe in self._recipes.items()]
         await generator.merge_files(inputs, dirs)
 
@@ -1074,9 +1085,14 @@ class UniversalMergedRecipe(BaseUniversalRecipe, UniversalMergedFilesProvider):
                     arch_files[f] = {(arch, recipe)}
                 else:
                     arch_files[f].add((arch, recipe))
-        # merge the architecture specific files
+        # merge the architecture specific files, grouped by the archs that
+        # have them
+        arch_groups = {}
         for f, archs in arch_files.items():
-            await generator.merge_files([f], [recipe.config.prefix for arch, recipe in archs])
+            dirs = tuple(sorted(recipe.config.prefix for arch, recipe in archs))
+            arch_groups.setdefault(dirs, []).append(f)
+        for dirs, files in arch_groups.items():
+            await generator.merge_files(files, list(dirs))
 
 
 def import_recipe(file, class_name='Recipe'):
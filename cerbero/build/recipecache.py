@@ -0,0 +1,390 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import json
+import os
+
+from cerbero.build.build import BuildType
+from cerbero.build.source import SourceType
+from cerbero.build.recipe import BaseUniversalRecipe
+from cerbero.enums import License, LicenseDescription
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+CACHE_VERSION = 1
+CACHE_DIR_NAME = 'recipes-cache'
+
+# Modules defining the default behaviour of the recipes, any change on them
+# can change the metadata of the recipes
+_CODE_FILES = ['recipe.py', 'source.py', 'build.py', 'filesprovider.py', 'cookbook.py', 'recipecache.py']
+_code_fingerprint = None
+
+
+def code_fingerprint():
+    """
+    Gets a fingerprint of the cerbero code used to load the recipes
+
+    @return: the fingerprint
+    @rtype: str
+    """
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        h = hashlib.sha256()
+        build_dir = os.path.dirname(os.path.abspath(__file__))
+        paths = [os.path.join(build_dir, f) for f in _CODE_FILES]
+        paths.append(os.path.join(os.path.dirname(build_dir), 'enums.py'))
+        for path in paths:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        _code_fingerprint = h.hexdigest()
+    return _code_fingerprint
+
+
+def file_key(filepath, custom_key=''):
+    """
+    Gets the key of the cached metadata of a recipe file
+
+    @param filepath: path of the recipe file
+    @type filepath: str
+    @param custom_key: hash of the custom.py module of the recipes repository
+    @type custom_key: str
+    @return: the key
+    @rtype: str
+    """
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        h.update(f.read())
+    h.update(custom_key.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _enum_key(enum, value):
+    for k, v in vars(enum).items():
+        if not k.startswith('_') and v is value:
+            return k
+    return None
+
+
+def _licenses_by_acronym():
+    return dict((v.acronym, v) for v in vars(License).values() if isinstance(v, LicenseDescription))
+
+
+class RecipeMetadata(object):
+    """
+    Metadata of a recipe that can be used without loading the recipe
+
+    It only contains builtin types so that it can be serialized.
+    """
+
+    __slots__ = [
+        'name',
+        'version',
+        'filepath',
+        'deps',
+        'list_deps',
+        'runtime_dep',
+        'stype',
+        'btype',
+        'built_version',
+        'categories',
+        'licenses',
+    ]
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, kwargs.get(k))
+
+    @classmethod
+    def from_recipe(cls, recipe):
+        """
+        Extracts the metadata from a loaded recipe
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: the metadata or None if the recipe can't be cached
+        @rtype: L{RecipeMetadata}
+        """
+        r = recipe
+        if isinstance(recipe, BaseUniversalRecipe):
+            r = recipe._proxy_recipe
+        stype = _enum_key(SourceType, r.stype)
+        btype = _enum_key(BuildType, r.btype)
+        if stype is None or btype is None:
+            return None
+        # git recipes compute the built version from the checkout
+        built_version = None
+        if not hasattr(r.stype, 'built_version'):
+            built_version = r.built_version()
+
+        known_licenses = _licenses_by_acronym()
+
+        def acronyms(licenses):
+            for license in licenses:
+                if known_licenses.get(license.acronym) is not license:
+                    raise ValueError(license)
+            return [license.acronym for license in licenses]
+
+        categories = r._files_categories()
+        licenses_categories = set(categories)
+        for attr in dir(r):
+            for prefix in ('licenses_', 'platform_licenses_'):
+                if attr.startswith(prefix):
+                    licenses_categories.add(attr[len(prefix) :])
+        try:
+            by_categories = r.list_licenses_by_categories(licenses_categories)
+            licenses = dict((c, acronyms(x)) for c, x in by_categories.items())
+            licenses[''] = acronyms(r.flatten_licenses(r.licenses))
+        except ValueError:
+            return None
+        return cls(
+            name=r.name,
+            version=r.version,
+            filepath=r.__file__,
+            deps=list(r.deps),
+            list_deps=r.list_deps(),
+            runtime_dep=r.runtime_dep,
+            stype=stype,
+            btype=btype,
+            built_version=built_version,
+            categories=categories,
+            licenses=licenses,
+        )
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+
+class LazyRecipe(object):
+    """
+    Placeholder of a recipe, that answers from the cached L{RecipeMetadata}
+    and loads the real recipe the first time any other attribute is needed.
+    """
+
+    def __init__(self, metadata, loader):
+        """
+        @param metadata: the recipe metadata
+        @type metadata: L{RecipeMetadata}
+        @param loader: function called with the recipe name returning the
+                       loaded recipe
+        @type loader: function
+        """
+        object.__setattr__(self, '_metadata', metadata)
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_recipe', None)
+
+    def is_loaded(self):
+        return self._recipe is not None
+
+    def load(self):
+        """
+        Loads the real recipe
+
+        @return: the recipe
+        @rtype: L{cerbero.build.recipe.Recipe}
+        """
+        if self._recipe is None:
+            object.__setattr__(self, '_recipe', self._loader(self._metadata.name))
+        return self._recipe
+
+    @property
+    def name(self):
+        return self._metadata.name
+
+    @property
+    def version(self):
+        if self.is_loaded():
+            return self._recipe.version
+        return self._metadata.version
+
+    @property
+    def deps(self):
+        if self.is_loaded():
+            return self._recipe.deps
+        return self._metadata.deps
+
+    @property
+    def runtime_dep(self):
+        if self.is_loaded():
+            return self._recipe.runtime_dep
+        return self._metadata.runtime_dep
+
+    @property
+    def stype(self):
+        if self.is_loaded():
+            return self._recipe.stype
+        return getattr(SourceType, self._metadata.stype)
+
+    @property
+    def btype(self):
+        if self.is_loaded():
+            return self._recipe.btype
+        return getattr(BuildType, self._metadata.btype)
+
+    @property
+    def categories(self):
+        if self.is_loaded():
+            return self._recipe.categories
+        return self._metadata.categories
+
+    @property
+    def __file__(self):
+        return self._metadata.filepath
+
+    def list_deps(self):
+        if self.is_loaded():
+            return self._recipe.list_deps()
+        return list(self._metadata.list_deps)
+
+    def built_version(self):
+        if self.is_loaded() or self._metadata.built_version is None:
+            return self.load().built_version()
+        return self._metadata.built_version
+
+    def _files_categories(self):
+        if self.is_loaded():
+            return self._recipe._files_categories()
+        return list(self._metadata.categories)
+
+    def list_licenses_by_categories(self, categories):
+        if self.is_loaded():
+            return self._recipe.list_licenses_by_categories(categories)
+        known_licenses = _licenses_by_acronym()
+        licenses = {}
+        for c in categories:
+            if c in licenses:
+                raise Exception('multiple licenses for the same category %s defined' % c)
+            acronyms = self._metadata.licenses.get(c or '', self._metadata.licenses[''])
+            licenses[c] = [known_licenses[x] for x in acronyms]
+        return licenses
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<LazyRecipe %s>' % self.name
+
+
+class RecipesCache(object):
+    """
+    Persistent cache of the metadata of the recipes, stored per recipe file
+    and invalidated when the file, the custom.py module of its repository,
+    the configuration or the variants change.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._entries = {}
+        self._dirty = False
+        fingerprint = hashlib.sha256()
+        fingerprint.update(config.get_fingerprint().encode('utf-8'))
+        fingerprint.update(code_fingerprint().encode('utf-8'))
+        self.path = os.path.join(config.home_dir, CACHE_DIR_NAME, fingerprint.hexdigest() + '.json')
+
+    def load(self):
+        self._entries = {}
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self._entries = data['files']
+        except Exception as ex:
+            m.warning(_('Could not load the recipes cache %s: %s') % (self.path, ex))
+
+    def save(self):
+        if not self._dirty:
+            return
+        data = {'version': CACHE_VERSION, 'files': self._entries}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except (IOError, OSError) as ex:
+            m.warning(_('Could not save the recipes cache %s: %s') % (self.path, ex))
+
+    def get(self, filepath, key):
+        """
+        Gets the cached metadata of the recipes of a file
+
+        @param filepath: path of the recipe file
+        @type filepath: str
+        @param key: the key of the file, see L{file_key}
+        @type key: str
+        @return: list of L{RecipeMetadata} or None if not cached
+        @rtype: list
+        """
+        entry = self._entries.get(filepath)
+        if entry is None or entry['key'] != key:
+            return None
+        return [RecipeMetadata(**d) for d in entry['recipes']]
+
+    def set(self, filepath, key, recipes):
+        """
+        Caches the metadata of the recipes loaded from a file
+
+        @param filepath: path of the recipe file
+        @type filepath: str
+        @param key: the key of the file, see L{file_key}
+        @type key: str
+        @param recipes: the recipes loaded from the file
+        @type recipes: list
+        @return: whether the recipes were cached
+        @rtype: bool
+        """
+        metadata = []
+        for recipe in recipes:
+            md = RecipeMetadata.from_recipe(recipe)
+            if md is None:
+                self.remove(filepath)
+                return False
+            metadata.append(md.to_dict())
+        self.set_metadata(filepath, key, metadata)
+        return True
+
+    def set_metadata(self, filepath, key, metadata):
+        """
+        Caches the metadata of the recipes of a file
+
+        @param filepath: path of the recipe file
+        @type filepath: str
+        @param key: the key of the file, see L{file_key}
+        @type key: str
+        @param metadata: metadata of the recipes, see L{RecipeMetadata.to_dict}
+        @type metadata: list
+        """
+        self._entries[filepath] = {'key': key, 'recipes': metadata}
+        self._dirty = True
+
+    def remove(self, filepath):
+        if filepath in self._entries:
+            del self._entries[filepath]
+            self._dirty = True
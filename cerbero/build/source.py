@@ -25,12 +25,14 @@ import urllib.parse
 import urllib.error
 import collections
 import asyncio
-from hashlib import sha256
 
 from cerbero.config import Distro, DistroVersion, Platform, DEFAULT_MIRRORS
-from cerbero.utils import git, svn, shell, N_
+from cerbero.utils import git, svn, shell, download, hashing, N_
 from cerbero.errors import FatalError, CommandError, InvalidRecipeError
 from cerbero.build.build import BuildType
+from cerbero.build.sourcestore import SourceStore
+from cerbero.build.extractcache import ExtractCache
+from cerbero.build.cratestore import CrateStore, parse_cargo_lock
 import cerbero.utils.messages as m
 
 URL_TEMPLATES = {
@@ -65,6 +67,10 @@ class Source(object):
     cargo_lock = None
     strip = 1
     offline = False
+    # Shared by all the source handlers, keyed by the git repository or
+    # tarball path, so that recipes using the same sources can be fetched
+    # concurrently without stepping on each other.
+    _fetch_locks = collections.defaultdict(asyncio.Lock)
     _extract_locks = collections.defaultdict(asyncio.Lock)
     _extract_done = set()
 
@@ -132,17 +138,33 @@ class Source(object):
             shutil.copy(self.relative_path(self.cargo_lock), os.path.join(self.src_dir, 'Cargo.lock'))
         if not self.have_cargo_lock_file():
             await self.retry_run(self.cargo_update, offline, logfile)
-        m.log('Running cargo vendor to vendor sources', logfile=logfile)
-        vendor_args = [self.cargo_vendor_cache_dir]
-        if offline:
-            vendor_args += ['--frozen', '--offline']
-        ct = await shell.async_call_output(
-            [self.cargo, 'vendor'] + vendor_args,
-            cmd_dir=self.src_dir,
-            env=self.env,
-            cpu_bound=False,
-            logfile=logfile,
-        )
+        loop = asyncio.get_event_loop()
+        store = CrateStore.from_config(self.config)
+        packages = None
+        if store is not None:
+            tomllib = self.config.find_toml_module()
+            if tomllib is None:
+                m.log('toml module not found, not using the crate store', logfile=logfile)
+                store = None
+            else:
+                packages = parse_cargo_lock(os.path.join(self.src_dir, 'Cargo.lock'), tomllib)
+        if store is not None and await loop.run_in_executor(None, store.vendor, packages, self.cargo_vendor_cache_dir):
+            m.log('Vendored sources from the crate store %s' % store.path, logfile=logfile)
+            ct = CrateStore.config_toml(self.cargo_vendor_cache_dir)
+        else:
+            m.log('Running cargo vendor to vendor sources', logfile=logfile)
+            vendor_args = [self.cargo_vendor_cache_dir]
+            if offline:
+                vendor_args += ['--frozen', '--offline']
+            ct = await shell.async_call_output(
+                [self.cargo, 'vendor'] + vendor_args,
+                cmd_dir=self.src_dir,
+                env=self.env,
+                cpu_bound=False,
+                logfile=logfile,
+            )
+            if store is not None:
+                await loop.run_in_executor(None, store.add_vendor_dir, packages, self.cargo_vendor_cache_dir)
         dot_cargo = os.path.join(self.src_dir, '.cargo')
         os.makedirs(dot_cargo, exist_ok=True)
         # Append so we don't overwrite any existing .cargo/config.toml settings
@@ -174,15 +196,38 @@ class Source(object):
         for subproj_name, _ in downloads:
             subprojects.append(subproj_name)
         m.log(f'Downloading meson subprojects: {", ".join(subprojects)}', logfile=logfile)
-        for subproj_name, ((url, fallback_url), fpath, fhash) in downloads:
+        # Downloads are limited by the non CPU bound semaphore
+        await asyncio.gather(
+            *[
+                self._download_subproject_file(url, fallback_url, fpath, fhash, logfile)
+                for _, ((url, fallback_url), fpath, fhash) in downloads
+            ]
+        )
+
+    async def _download_subproject_file(self, url, fallback_url, fpath, fhash, logfile):
+        store = SourceStore.from_config(self.config)
+        found_checksum = None
+        if store is not None and not os.path.exists(fpath) and store.link(fhash, fpath):
+            m.log(f'Found {url} in the source store {store.path}', logfile=logfile)
+        else:
             fallback_urls = self.get_fallback_urls(fpath)
             if fallback_url:
                 # Our mirror implementation assumes that the basename is the same
                 fallback_urls.append(fallback_url)
-            await shell.download(
+            # The checksum is computed while downloading
+            found_checksum = await download.download(
                 url, fpath, check_cert=self.check_cert, overwrite=False, logfile=logfile, fallback_urls=fallback_urls
             )
-            self.verify(fpath, fhash)
+        if found_checksum is None:
+            loop = asyncio.get_event_loop()
+            found_checksum = await loop.run_in_executor(None, hashing.get_hasher().file_digest, fpath, 'sha256')
+        if found_checksum != fhash:
+            movedto = fpath + '.failed-checksum'
+            os.replace(fpath, movedto)
+            m.log(f'Checksum failed, {fpath} moved to {movedto}', logfile=logfile)
+            raise FatalError('Checksum for {} is {!r} instead of {!r}'.format(fpath, found_checksum, fhash))
+        if store is not None:
+            store.add(fhash, fpath)
 
     async def meson_subprojects_extract(self, offline):
         logfile = get_logfile(self)
@@ -359,6 +404,9 @@ class BaseTarball(object):
 
     async def fetch(self, redownload=False):
         fname = self._get_download_path(self.tarball_name)
+        store = SourceStore.from_config(self.config)
+        if store is not None and not os.path.exists(fname) and self._link_from_store(store, fname):
+            return
         if self.offline:
             if not os.path.isfile(fname):
                 msg = 'Offline mode: tarball {!r} not found in local sources ({})'
@@ -368,7 +416,7 @@ class BaseTarball(object):
             return
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
-        await shell.download(
+        found_checksum = await download.download(
             self.url,
             fname,
             check_cert=self.check_cert,
@@ -376,20 +424,28 @@ class BaseTarball(object):
             logfile=get_logfile(self),
             fallback_urls=self.get_fallback_urls(self.url),
         )
-        self.verify(fname, self.tarball_checksum)
+        self.verify(fname, self.tarball_checksum, found_checksum=found_checksum)
+        if store is not None:
+            store.add(self.tarball_checksum, fname)
+
+    def _link_from_store(self, store, fname):
+        if not store.link(self.tarball_checksum, fname):
+            return False
+        # Subclasses override verify() with another signature
+        if not BaseTarball.verify(self, fname, self.tarball_checksum, fatal=False):
+            store.remove(self.tarball_checksum)
+            return False
+        m.action(N_('Found %s in the source store %s') % (self.url, store.path), logfile=get_logfile(self))
+        return True
 
     @staticmethod
     def _checksum(fname):
-        h = sha256()
-        with open(fname, 'rb') as f:
-            # Read in chunks of 512k till f.read() returns b'' instead of reading
-            # the whole file at once which will fail on systems with low memory
-            for block in iter(lambda: f.read(512 * 1024), b''):
-                h.update(block)
-        return h.hexdigest()
-
-    def verify(self, fname, checksum, fatal=True):
-        found_checksum = self._checksum(fname)
+        # Streamed in chunks and memoized while the file is unchanged
+        return hashing.get_hasher().file_digest(fname, 'sha256')
+
+    def verify(self, fname, checksum, fatal=True, found_checksum=None):
+        if found_checksum is None:
+            found_checksum = self._checksum(fname)
         if checksum is None:
             raise FatalError(
                 'tarball_checksum is missing in {}.recipe for tarball {}\n'
@@ -419,9 +475,12 @@ class BaseTarball(object):
             if self.offline:
                 # Can't fetch in offline mode
                 raise
-            await self.fetch(redownload=True)
+            await self.redownload()
             await shell.unpack(fname, unpack_dir, logfile=logfile)
 
+    async def redownload(self):
+        await self.fetch(redownload=True)
+
 
 class Tarball(BaseTarball, Source):
     def __init__(self):
@@ -438,6 +497,28 @@ class Tarball(BaseTarball, Source):
         BaseTarball.__init__(self)
 
     async def fetch(self, redownload=False):
+        await self._fetch_tarball(redownload)
+        # Extract outside of the fetch lock: a corrupted tarball is
+        # redownloaded from extract_tarball(), which takes the lock again
+        if issubclass(self.btype, BuildType.CARGO):
+            m.log(f'Extracting project {self.name} to run cargo vendor', logfile=get_logfile(self))
+            await self.extract_impl(fetching=True)
+            self._extract_done.add(self.src_dir)
+        elif self.btype == BuildType.MESON and self.meson_subprojects:
+            m.log(f'Extracting project {self.name} to fetch subprojects', logfile=get_logfile(self))
+            await self.extract_impl(fetching=True)
+            self._extract_done.add(self.src_dir)
+
+    async def _fetch_tarball(self, redownload=False):
+        fname = self._get_download_path(self.tarball_name)
+        # Could have multiple recipes using the same tarball
+        async with self._fetch_locks[fname]:
+            await self.fetch_impl(redownload)
+
+    async def redownload(self):
+        await self._fetch_tarball(redownload=True)
+
+    async def fetch_impl(self, redownload=False):
         fname = self._get_download_path(self.tarball_name)
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
@@ -455,19 +536,45 @@ class Tarball(BaseTarball, Source):
             shutil.copy(cached_file, fname)
         else:
             await super().fetch(redownload=redownload)
-        if issubclass(self.btype, BuildType.CARGO):
-            m.log(f'Extracting project {self.name} to run cargo vendor', logfile=get_logfile(self))
-            await self.extract_impl(fetching=True)
-            self._extract_done.add(self.src_dir)
-        elif self.btype == BuildType.MESON and self.meson_subprojects:
-            m.log(f'Extracting project {self.name} to fetch subprojects', logfile=get_logfile(self))
-            await self.extract_impl(fetching=True)
-            self._extract_done.add(self.src_dir)
+
+    def _patch_paths(self):
+        return [p if os.path.isabs(p) else self.relative_path(p) for p in self.patches]
+
+    def _extract_cache_key(self):
+        if self.tarball_checksum is None:
+            return None
+        hasher = hashing.get_hasher()
+        patches = ['%s:%s' % (os.path.basename(p), hasher.file_digest(p)) for p in self._patch_paths()]
+        return ExtractCache.key(
+            self.tarball_checksum,
+            self.tarball_dirname,
+            self.tarball_is_bomb,
+            self.strip,
+            self.config.extract_git_init,
+            *patches,
+        )
 
     async def extract_impl(self, fetching=False):
-        m.action(N_('Extracting tarball to %s') % self.src_dir, logfile=get_logfile(self))
         if os.path.exists(self.src_dir):
             shutil.rmtree(self.src_dir)
+        loop = asyncio.get_event_loop()
+        cache = ExtractCache.from_config(self.config)
+        key = self._extract_cache_key() if cache is not None else None
+        if key is not None and await loop.run_in_executor(None, cache.restore, key, self.src_dir):
+            m.action(
+                N_('Restored extracted sources to %s from %s') % (self.src_dir, cache.path), logfile=get_logfile(self)
+            )
+        else:
+            await self._extract_and_patch()
+            if key is not None:
+                await loop.run_in_executor(None, cache.store, key, self.src_dir)
+        if issubclass(self.btype, BuildType.CARGO):
+            await self.cargo_vendor(not fetching or self.offline)
+        elif self.btype == BuildType.MESON and self.meson_subprojects:
+            await self.meson_subprojects_extract(not fetching or self.offline)
+
+    async def _extract_and_patch(self):
+        m.action(N_('Extracting tarball to %s') % self.src_dir, logfile=get_logfile(self))
         unpack_dir = self.config.sources
         if self.tarball_is_bomb:
             unpack_dir = self.src_dir
@@ -478,18 +585,14 @@ class Tarball(BaseTarball, Source):
             # Since we just extracted this, a Windows anti-virus might still
             # have a lock on files inside it.
             shell.windows_proof_rename(extracted, self.src_dir)
-        git.init_directory(self.src_dir, logfile=get_logfile(self))
-        for patch in self.patches:
-            if not os.path.isabs(patch):
-                patch = self.relative_path(patch)
-            if self.strip == 1:
+        use_git = self.config.extract_git_init
+        if use_git:
+            git.init_directory(self.src_dir, logfile=get_logfile(self))
+        for patch in self._patch_paths():
+            if self.strip == 1 and use_git:
                 git.apply_patch(patch, self.src_dir, logfile=get_logfile(self))
             else:
                 shell.apply_patch(patch, self.src_dir, self.strip, logfile=get_logfile(self))
-        if issubclass(self.btype, BuildType.CARGO):
-            await self.cargo_vendor(not fetching or self.offline)
-        elif self.btype == BuildType.MESON and self.meson_subprojects:
-            await self.meson_subprojects_extract(not fetching or self.offline)
 
 
 class GitCache(Source):
@@ -501,7 +604,6 @@ class GitCache(Source):
     commit = None
     use_submodules = True
 
-    _fetch_locks = collections.defaultdict(asyncio.Lock)
     _fetch_done = set()
 
     def __init__(self):
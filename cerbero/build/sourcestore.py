@@ -0,0 +1,199 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import re
+import tempfile
+import time
+
+from cerbero.utils import shell
+from cerbero.utils import messages as m
+
+
+class SourceStore(object):
+    """
+    Host-wide store of the downloaded tarballs, addressed by their SHA-256
+    checksum, so that all the cerbero checkouts and configurations of a host
+    download them only once.
+
+    Files are stored as C{<path>/sha256/<checksum[:2]>/<checksum>} and hard
+    linked, or reflinked or copied when that's not possible, into the
+    download directory of each configuration. Their modification time is
+    updated each time they are used, to evict the least recently used ones
+    when the store grows over its maximum size.
+
+    @ivar path: directory of the store
+    @type path: str
+    @ivar max_size: maximum size of the store in bytes, None for unlimited
+    @type max_size: int
+    """
+
+    CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def from_config(config):
+        """
+        Gets the store of a configuration
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @return: the store or None if it's not enabled
+        @rtype: L{SourceStore}
+        """
+        if not config.source_store:
+            return None
+        max_size = config.source_store_max_size
+        return SourceStore(config.source_store, max_size * 1024 * 1024 if max_size else None)
+
+    def file_path(self, checksum):
+        """
+        @param checksum: SHA-256 checksum of a file
+        @type checksum: str
+        @return: path of the file in the store
+        @rtype: str
+        """
+        return os.path.join(self.path, 'sha256', checksum[:2], checksum)
+
+    def link(self, checksum, dest):
+        """
+        Links a file of the store
+
+        @param checksum: SHA-256 checksum of the file
+        @type checksum: str
+        @param dest: the link
+        @type dest: str
+        @return: whether the file is in the store
+        @rtype: bool
+        """
+        if not self.CHECKSUM_RE.match(checksum or ''):
+            return False
+        path = self.file_path(checksum)
+        try:
+            # Mark it as recently used
+            os.utime(path)
+        except OSError:
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shell.link_or_copy(path, dest)
+        return True
+
+    def add(self, checksum, src):
+        """
+        Adds a file to the store, evicting the least recently used ones if
+        it grows over its maximum size
+
+        @param checksum: SHA-256 checksum of the file
+        @type checksum: str
+        @param src: the file
+        @type src: str
+        """
+        if not self.CHECKSUM_RE.match(checksum or ''):
+            return
+        path = self.file_path(checksum)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Other processes might be adding the same file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            shell.link_or_copy(src, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if self.max_size is not None:
+            self.gc(self.max_size)
+
+    def remove(self, checksum):
+        """
+        Removes a file from the store
+
+        @param checksum: SHA-256 checksum of the file
+        @type checksum: str
+        """
+        try:
+            os.remove(self.file_path(checksum))
+        except OSError:
+            pass
+
+    def list_files(self):
+        """
+        Lists the files in the store from the least recently used one
+
+        @return: list of (path, stat) tuples
+        @rtype: list
+        """
+        files = []
+        root = os.path.join(self.path, 'sha256')
+        if not os.path.isdir(root):
+            return files
+        for d in os.scandir(root):
+            if not d.is_dir():
+                continue
+            for f in os.scandir(d.path):
+                if f.is_file() and self.CHECKSUM_RE.match(f.name):
+                    files.append((f.path, f.stat()))
+        files.sort(key=lambda f: f[1].st_mtime)
+        return files
+
+    def gc(self, max_size=None, max_age=None, dry_run=False):
+        """
+        Evicts the least recently used files until the store fits in the
+        maximum size, and the files unused for too long
+
+        @param max_size: maximum size in bytes, the one of the store by default
+        @type max_size: int
+        @param max_age: maximum time in seconds since the files were used
+        @type max_age: float
+        @param dry_run: only report what would be removed
+        @type dry_run: bool
+        @return: the number of files removed, the bytes they used in the
+                 store and the bytes actually reclaimed, since the files
+                 still linked from a download directory keep using them
+        @rtype: tuple
+        """
+        files = self.list_files()
+        if max_size is None:
+            max_size = self.max_size
+        total = sum(st.st_size for path, st in files)
+        now = time.time()
+        removed = freed = reclaimed = 0
+        for path, st in files:
+            too_big = max_size is not None and total - freed > max_size
+            too_old = max_age is not None and now - st.st_mtime > max_age
+            if not too_big and not too_old:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except OSError as ex:
+                    m.warning('Could not remove %s from the source store: %s' % (path, ex))
+                    continue
+            removed += 1
+            freed += st.st_size
+            if st.st_nlink == 1:
+                reclaimed += st.st_size
+        return removed, freed, reclaimed
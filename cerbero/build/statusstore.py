@@ -0,0 +1,260 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class StatusStore(object):
+    """
+    Stores the build status of the recipes of a L{cerbero.build.cookbook.CookBook}
+    in a SQLite database with one row per recipe, so that updating the
+    status of a recipe is a single atomic transaction.
+
+    Cache files in the old format, a pickled dictionary with the status of
+    all the recipes, are migrated when loaded.
+
+    Statistics of the previous builds of the recipes are stored in a
+    separate table, since they must survive the resets of their status.
+    Another one stores the lists of files of the recipes, computed from the
+    prefix, with the signature of the prefix they are valid for.
+    """
+
+    def __init__(self, path):
+        """
+        @param path: path of the cache file
+        @type path: str
+        """
+        self.path = path
+        self._conn = None
+        self._blobs = {}  # recipe_name -> pickled status stored
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the status of all the recipes
+
+        @return: the status of each recipe
+        @rtype: dict
+        """
+        self.close()
+        self._blobs = {}
+        if self.path == os.devnull:
+            # Status is not persisted
+            self._conn = self._connect(':memory:')
+            return {}
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        if self._needs_migration(self.path):
+            self._migrate()
+        try:
+            self._conn = self._connect(self.path)
+            return self._load_rows()
+        except sqlite3.DatabaseError as ex:
+            m.warning(_('Could not recover status from %s: %s') % (self.path, ex))
+            self.close()
+            os.replace(self.path, self.path + '.old')
+            self._conn = self._connect(self.path)
+            return {}
+
+    def save(self, recipe_name, status):
+        """
+        Saves the status of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param status: status of the recipe
+        @type status: L{cerbero.build.cookbook.RecipeStatus}
+        """
+        blob = pickle.dumps(status)
+        if self._blobs.get(recipe_name) == blob:
+            return
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO status (recipe, data) VALUES (?, ?)', (recipe_name, blob))
+        self._blobs[recipe_name] = blob
+
+    def delete(self, recipe_name):
+        """
+        Removes the status of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM status WHERE recipe = ?', (recipe_name,))
+        self._blobs.pop(recipe_name, None)
+
+    def save_all(self, status):
+        """
+        Saves the status of all the recipes in a single transaction, only
+        writing the ones that changed
+
+        @param status: the status of each recipe
+        @type status: dict
+        """
+        blobs = dict((name, pickle.dumps(st)) for name, st in status.items())
+        changed = [(name, blob) for name, blob in blobs.items() if self._blobs.get(name) != blob]
+        removed = [(name,) for name in self._blobs if name not in blobs]
+        if not changed and not removed:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM status WHERE recipe = ?', removed)
+            self._conn.executemany('INSERT OR REPLACE INTO status (recipe, data) VALUES (?, ?)', changed)
+        self._blobs = blobs
+
+    def get_peak_memory(self, recipe_name):
+        """
+        Gets the peak memory recorded for the compilation of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the peak memory in bytes or None if unknown
+        @rtype: int
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT peak_memory FROM stats WHERE recipe = ?', (recipe_name,)).fetchone()
+        return row[0] if row else None
+
+    def set_peak_memory(self, recipe_name, peak_memory):
+        """
+        Records the peak memory used to compile a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param peak_memory: the peak memory in bytes
+        @type peak_memory: int
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO stats (recipe, peak_memory) VALUES (?, ?)', (recipe_name, peak_memory)
+            )
+
+    def get_files_list(self, recipe_name, key, signature):
+        """
+        Gets a list of files of a recipe stored with L{set_files_list}
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param key: key of the list
+        @type key: str
+        @param signature: signature of the prefix the list was computed from
+        @type signature: str
+        @return: the list or None if not stored for this signature
+        @rtype: list
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT signature, files FROM files_lists WHERE recipe = ? AND key = ?', (recipe_name, key)
+            ).fetchone()
+        if row is None or row[0] != signature:
+            return None
+        return json.loads(row[1])
+
+    def set_files_list(self, recipe_name, key, signature, files):
+        """
+        Stores a list of files of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param key: key of the list
+        @type key: str
+        @param signature: signature of the prefix the list was computed from
+        @type signature: str
+        @param files: the list of files
+        @type files: list
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files_lists (recipe, key, signature, files) VALUES (?, ?, ?, ?)',
+                (recipe_name, key, signature, json.dumps(files)),
+            )
+
+    def delete_files_lists(self, recipe_name):
+        """
+        Removes the lists of files stored for a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM files_lists WHERE recipe = ?', (recipe_name,))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self, path):
+        conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS status (recipe TEXT PRIMARY KEY, data BLOB NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stats (recipe TEXT PRIMARY KEY, peak_memory INTEGER)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files_lists (recipe TEXT NOT NULL, key TEXT NOT NULL, '
+                'signature TEXT NOT NULL, files TEXT NOT NULL, PRIMARY KEY (recipe, key))'
+            )
+        return conn
+
+    def _load_rows(self):
+        status = {}
+        for name, blob in self._conn.execute('SELECT recipe, data FROM status'):
+            try:
+                status[name] = pickle.loads(blob)
+            except Exception as ex:
+                m.warning(_('Could not recover status of recipe %s: %s') % (name, ex))
+                continue
+            self._blobs[name] = bytes(blob)
+        return status
+
+    def _migrate(self):
+        # Convert a cache file with the pickled status of all the recipes,
+        # keeping a copy of it
+        try:
+            with open(self.path, 'rb') as f:
+                status = pickle.load(f)
+        except Exception as ex:
+            m.warning(_('Could not recover status from %s: %s') % (self.path, ex))
+            status = {}
+        tmp = self.path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = self._connect(tmp)
+        with conn:
+            rows = [(name, pickle.dumps(st)) for name, st in status.items()]
+            conn.executemany('INSERT INTO status (recipe, data) VALUES (?, ?)', rows)
+        conn.close()
+        shutil.copy2(self.path, self.path + '.old')
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _needs_migration(path):
+        # SQLite uses empty files as empty databases
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) != SQLITE_HEADER
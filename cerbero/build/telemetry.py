@@ -0,0 +1,314 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import time
+
+from cerbero.errors import AbortedError
+from cerbero.utils.shell import ProcessUsage, account_processes
+
+
+# Worker running in the current asyncio task, inherited by the tasks it
+# creates
+_current_worker = contextvars.ContextVar('cerbero_build_worker', default=None)
+
+# Number of recipes listed in the resource usage summary
+TOP_RECIPES = 5
+
+
+class WorkerState(object):
+    """
+    State of a build worker, one of the tasks consuming the build queues
+
+    @ivar worker_id: the id of the worker
+    @type worker_id: int
+    @ivar name: the steps handled by the worker
+    @type name: str
+    @ivar lock_waits: time spent waiting for each lock since the last step
+                      was recorded
+    @type lock_waits: dict
+    """
+
+    def __init__(self, worker_id, name):
+        self.worker_id = worker_id
+        self.name = name
+        self.lock_waits = collections.defaultdict(float)
+
+
+class StepEvent(object):
+    """
+    Timing of a recipe step, with timestamps in seconds relative to the
+    beginning of the build, and the resources used by the commands it ran
+    """
+
+    __slots__ = ['recipe', 'step', 'worker', 'start', 'end', 'queue_wait', 'lock_waits', 'status', 'usage']
+
+    def __init__(self, recipe, step, worker, start, queue_wait):
+        self.recipe = recipe
+        self.step = step
+        self.worker = worker
+        self.start = start
+        self.end = start
+        self.queue_wait = queue_wait
+        self.lock_waits = {}
+        self.status = 'ok'
+        self.usage = ProcessUsage()
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class TimedLock(object):
+    """
+    Wraps an asyncio lock or semaphore to account the time spent waiting
+    for it to the worker acquiring it
+    """
+
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+
+    async def acquire(self):
+        start = time.monotonic()
+        await self.lock.acquire()
+        worker = _current_worker.get()
+        if worker is not None:
+            worker.lock_waits[self.name] += time.monotonic() - start
+
+    def release(self):
+        self.lock.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *args):
+        self.release()
+
+
+class BuildTelemetry(object):
+    """
+    Records the timing of the steps run by the L{cerbero.build.oven.Oven}
+    and exports them as a Chrome trace-event file, that can be opened in
+    chrome://tracing or https://ui.perfetto.dev, and as a summary of the
+    critical path of the build.
+    """
+
+    def __init__(self, exception_status=None):
+        """
+        @param exception_status: status recorded for the steps raising each
+                                 exception type, 'failed' by default
+        @type exception_status: dict
+        """
+        self.start_time = time.monotonic()
+        self.events = []
+        self.workers = {}
+        self.exception_status = {AbortedError: 'aborted', asyncio.CancelledError: 'aborted'}
+        self.exception_status.update(exception_status or {})
+
+    def now(self):
+        """
+        @return: seconds since the beginning of the build
+        @rtype: float
+        """
+        return time.monotonic() - self.start_time
+
+    def start_worker(self, worker_id, name):
+        """
+        Registers the worker running in the current task
+
+        @param worker_id: the id of the worker
+        @type worker_id: int
+        @param name: the steps handled by the worker
+        @type name: str
+        """
+        worker = WorkerState(worker_id, name)
+        self.workers[worker_id] = worker
+        _current_worker.set(worker)
+
+    @contextlib.contextmanager
+    def record_step(self, recipe_name, step, queue_wait=0.0):
+        """
+        Records the step run in the context. Its status is set from the
+        exception raised, if any, and can be changed with the yielded
+        L{StepEvent}. The resources used by the commands run in the context
+        are accounted to it when the process accounting is enabled.
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param step: the step
+        @type step: str
+        @param queue_wait: time the step waited in the build queue
+        @type queue_wait: float
+        """
+        worker = _current_worker.get()
+        event = StepEvent(recipe_name, step, worker.worker_id if worker else 0, self.now(), queue_wait)
+        try:
+            with account_processes(event.usage):
+                yield event
+        except BaseException as ex:
+            event.status = 'failed'
+            for exc_type, status in self.exception_status.items():
+                if isinstance(ex, exc_type):
+                    event.status = status
+            raise
+        finally:
+            event.end = self.now()
+            if worker is not None:
+                event.lock_waits = dict(worker.lock_waits)
+                worker.lock_waits.clear()
+            self.events.append(event)
+
+    def to_chrome_trace(self):
+        """
+        @return: the events in the Chrome trace-event format
+        @rtype: dict
+        """
+        trace = []
+        pid = os.getpid()
+        for worker in self.workers.values():
+            trace.append(
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': worker.worker_id,
+                    'args': {'name': 'worker %d (%s)' % (worker.worker_id, worker.name)},
+                }
+            )
+        for e in self.events:
+            args = {'recipe': e.recipe, 'status': e.status, 'queue_wait_ms': round(e.queue_wait * 1000, 3)}
+            for name, wait in e.lock_waits.items():
+                args['%s_lock_wait_ms' % name] = round(wait * 1000, 3)
+            if e.usage.count:
+                args['processes'] = e.usage.count
+                args['user_cpu_s'] = round(e.usage.utime, 3)
+                args['sys_cpu_s'] = round(e.usage.stime, 3)
+                args['peak_rss_mb'] = round(e.usage.maxrss / (1024 * 1024), 1)
+            trace.append(
+                {
+                    'name': '%s:%s' % (e.recipe, e.step),
+                    'cat': e.step,
+                    'ph': 'X',
+                    'ts': round(e.start * 1e6),
+                    'dur': round(e.duration * 1e6),
+                    'pid': pid,
+                    'tid': e.worker,
+                    'args': args,
+                }
+            )
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the Chrome trace-event file
+
+        @param path: path of the file
+        @type path: str
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def recipe_usage(self):
+        """
+        Aggregates the resources used by the commands of each recipe
+
+        @return: for each recipe, a tuple with the L{ProcessUsage} of the
+                 recipe and a dict with the one of each of its steps
+        @rtype: dict
+        """
+        usages = {}
+        for e in self.events:
+            if not e.usage.count:
+                continue
+            total, steps = usages.setdefault(e.recipe, (ProcessUsage(), collections.OrderedDict()))
+            total.add(e.usage)
+            steps.setdefault(e.step, ProcessUsage()).add(e.usage)
+        return usages
+
+    def critical_path(self, deps):
+        """
+        Finds the chain of recipes that determined the length of the build,
+        starting from the last recipe to finish and following the
+        dependency that finished the latest
+
+        @param deps: the dependencies of each recipe
+        @type deps: dict
+        @return: list of (recipe, start, end, steps) from the first recipe
+                 built, with steps a dict of the time spent in each step
+        @rtype: list
+        """
+        spans = {}
+        for e in self.events:
+            start, end, steps = spans.get(e.recipe, (e.start, e.end, collections.OrderedDict()))
+            steps[e.step] = steps.get(e.step, 0.0) + e.duration
+            spans[e.recipe] = (min(start, e.start), max(end, e.end), steps)
+        if not spans:
+            return []
+        path = []
+        recipe = max(spans, key=lambda r: spans[r][1])
+        while recipe is not None:
+            path.append((recipe,) + spans[recipe])
+            built_deps = [d for d in deps.get(recipe, ()) if d in spans and d not in [p[0] for p in path]]
+            recipe = max(built_deps, key=lambda r: spans[r][1]) if built_deps else None
+        path.reverse()
+        return path
+
+    def summary(self, deps):
+        """
+        Formats the critical path and the usage of the workers
+
+        @param deps: the dependencies of each recipe
+        @type deps: dict
+        @return: the lines of the summary
+        @rtype: list
+        """
+        if not self.events:
+            return []
+        wall = max(e.end for e in self.events)
+        lines = ['Critical path:', '%-32s %10s %10s  %s' % ('recipe', 'start', 'duration', 'slowest step')]
+        for recipe, start, end, steps in self.critical_path(deps):
+            slowest = max(steps, key=steps.get)
+            lines.append('%-32s %9.1fs %9.1fs  %s (%.1fs)' % (recipe, start, end - start, slowest, steps[slowest]))
+        busy = sum(e.duration for e in self.events)
+        queue_wait = sum(e.queue_wait for e in self.events)
+        lock_waits = collections.defaultdict(float)
+        for e in self.events:
+            for name, wait in e.lock_waits.items():
+                lock_waits[name] += wait
+        usage = busy / (wall * len(self.workers)) * 100 if wall > 0 and self.workers else 0
+        lines.append(
+            'Wall time %.1fs, %d workers busy %.0f%% of the time, %.1fs waiting in queues'
+            % (wall, len(self.workers), usage, queue_wait)
+        )
+        if lock_waits:
+            lines.append(
+                'Lock waits: ' + ', '.join('%s %.1fs' % (name, wait) for name, wait in sorted(lock_waits.items()))
+            )
+        usages = self.recipe_usage()
+        if usages:
+            lines.append('Recipes using the most memory:')
+            for recipe in sorted(usages, key=lambda r: usages[r][0].maxrss, reverse=True)[:TOP_RECIPES]:
+                lines.append('  %-30s %s' % (recipe, usages[recipe][0]))
+        return lines
@@ -18,15 +18,19 @@
 
 import os
 import sys
+import glob
 import json
+import asyncio
 import tempfile
-import pickle
 import shutil
 from hashlib import sha256
 
 from cerbero.commands import Command, register_command
+from cerbero.build.cookbook import CookBook
+from cerbero.build.statusstore import StatusStore
 from cerbero.enums import Platform, Distro
 from cerbero.errors import FatalError
+from cerbero.tools.prefixrelocator import PrefixRelocator
 from cerbero.utils import N_, ArgparseArgument, git, shell, run_until_complete
 from cerbero.utils import messages as m
 
@@ -34,8 +38,11 @@ from cerbero.utils import messages as m
 class BaseCache(Command):
     base_url = 'https://artifacts.gstreamer-foundation.net/cerbero-deps'
     ssh_address = 'cerbero-deps-uploader@artifacts.gstreamer-foundation.net'
-    deps_filename = 'cerbero-deps.tar.xz'
+    deps_basename = 'cerbero-deps'
     log_filename = 'cerbero-deps.log'
+    manifest_filename = 'cerbero-deps.manifest.json'
+    chunks_dirname = 'cache-chunks'
+    manifest_version = 1
     log_size = 10
     dry_run = False
 
@@ -80,11 +87,6 @@ class BaseCache(Command):
                 return line[2:split_idx]
         raise FatalError('Failed to relocate prefix: could not deduce cache homedir')
 
-    def get_gnu_sed(self, config):
-        if config.platform == Platform.DARWIN:
-            return os.path.join(config.build_tools_prefix, 'bin', 'sed')
-        return 'sed'
-
     # FIXME: move this to utils
     def checksum(self, fname):
         h = sha256()
@@ -157,12 +159,31 @@ class BaseCache(Command):
             m.warning('Could not get cache list: %s' % e.msg)
         return deps
 
-    def get_deps_filepath(self, config):
-        return os.path.join(config.home_dir, self.deps_filename)
+    def get_deps_filename(self, codec):
+        return '%s.%s' % (self.deps_basename, shell.TAR_COMPRESSORS[codec].suffix)
+
+    def get_deps_filepath(self, config, codec='xz'):
+        return os.path.join(config.home_dir, self.get_deps_filename(codec))
 
     def get_log_filepath(self, config):
         return os.path.join(config.home_dir, self.log_filename)
 
+    def get_manifest_filepath(self, config):
+        return os.path.join(config.home_dir, self.manifest_filename)
+
+    def get_chunks_dir(self, config):
+        return os.path.join(config.home_dir, self.chunks_dirname)
+
+    def is_manifest(self, url):
+        return url.endswith(self.manifest_filename)
+
+    def load_manifest(self, filepath):
+        with open(filepath, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.manifest_version:
+            raise FatalError('Unsupported cache manifest version in %s' % filepath)
+        return manifest
+
     def run(self, config, args):
         self.dry_run = args.dry_run
         if not config.uninstalled:
@@ -189,37 +210,7 @@ class FetchCache(BaseCache):
             m.warning(f'Did not find cache for commit {sha}')
         return None
 
-    @staticmethod
-    def _is_mach_o_file(filename):
-        fileext = os.path.splitext(filename)[1]
-        if '.dylib' in fileext:
-            return True
-        filedesc = shell.check_output(['file', '-bh', filename])
-        if fileext == '.a' and 'ar archive' in filedesc:
-            return False
-        return filedesc.startswith('Mach-O')
-
-    @staticmethod
-    def _list_shared_libraries(object_file):
-        res = shell.check_output(['otool', '-L', object_file]).splitlines()
-        # We don't use the first line
-        libs = res[1:]
-        # Remove the first character tabulation
-        libs = [x[1:] for x in libs]
-        # Remove the version info
-        libs = [x.split(' ', 1)[0] for x in libs]
-        return libs
-
-    @classmethod
-    def _change_lib_paths(self, object_file, old_path, new_path):
-        for lib in self._list_shared_libraries(object_file):
-            if old_path not in lib:
-                continue
-            new = lib.replace(old_path, new_path)
-            cmd = ['install_name_tool', '-change', lib, new, object_file]
-            shell.new_call(cmd, fail=True, verbose=True)
-
-    def relocate_macos_build_tools(self, config, old_paths, new_path):
+    def relocate_macos_build_tools(self, relocator, config):
         """
         build-tools on macOS have absolute paths as install names for all
         Mach-O files, so we need to relocate them to the new prefix.
@@ -230,14 +221,7 @@ class FetchCache(BaseCache):
             os.path.join(config.build_tools_prefix, 'bin'),
             os.path.join(config.build_tools_prefix, 'lib'),
         ]
-        for dir_path in paths:
-            for dirpath, _dirnames, filenames in os.walk(dir_path):
-                for f in filenames:
-                    object_file = os.path.join(dirpath, f)
-                    if not self._is_mach_o_file(object_file):
-                        continue
-                    for path in old_paths:
-                        self._change_lib_paths(object_file, path, new_path)
+        relocator.relocate_mach_o_files(paths)
 
     def mark_windows_build_tools_dirty(self, config):
         """
@@ -246,13 +230,11 @@ class FetchCache(BaseCache):
         prefix. Currently, this is just Meson in build-tools.
         """
         cache_file = os.path.join(config.home_dir, config.build_tools_cache)
-        with open(cache_file, 'rb+') as f:
-            p = pickle.load(f)
-            # Reset the recipe status
-            del p['meson']
-            f.seek(0)
-            f.truncate(0)
-            pickle.dump(p, f)
+        store = StatusStore(cache_file)
+        store.load()
+        # Reset the recipe status
+        store.delete('meson')
+        store.close()
 
     def relocate_prefix(self, config):
         """
@@ -265,21 +247,67 @@ class FetchCache(BaseCache):
         if origin == dest:
             return
         m.action(f'Relocating text files from {origin} to {dest}')
-        sed = self.get_gnu_sed(config)
-        # This is hacky, but fast enough
         origins = [origin]
         if origin.startswith('/var/'):
             origins.append(f'/private/{origin}')  # macOS APFS symbolic link
-        for o in origins:
-            shell.call(f'grep -lrIe {o} {dest} | xargs {sed} "s#{o}#{dest}#g" -i', verbose=True)
+        relocator = PrefixRelocator(origins, dest, jobs=config.num_of_cpus)
+        relocator.relocate_text_files([dest])
         # Need to relocate RPATHs and names in binaries
         if config.platform == Platform.DARWIN:
-            self.relocate_macos_build_tools(config, origins, dest)
+            self.relocate_macos_build_tools(relocator, config)
         elif config.platform == Platform.WINDOWS:
             self.mark_windows_build_tools_dirty(config)
 
+    async def fetch_chunk(self, config, dep, chunk):
+        chunk_path = os.path.join(self.get_chunks_dir(config), chunk['file'])
+        if os.path.exists(chunk_path):
+            if self.checksum(chunk_path) == chunk['sha256']:
+                return False
+            os.remove(chunk_path)
+        url = '%s/%s/%s' % (os.path.dirname(dep['url']), self.chunks_dirname, chunk['file'])
+        await shell.download(url, chunk_path, overwrite=True)
+        if self.checksum(chunk_path) != chunk['sha256']:
+            os.remove(chunk_path)
+            raise FatalError('Corrupted cache chunk %s' % chunk['file'])
+        return True
+
+    async def fetch_chunked_dep(self, config, dep):
+        """
+        Fetches a cache split in chunks, downloading only the chunks that are
+        not in the local chunks directory already
+        """
+        manifest_path = self.get_manifest_filepath(config)
+        m.action(f'Downloading deps cache manifest {dep["url"]}')
+        if self.dry_run:
+            return
+        await shell.download(dep['url'], manifest_path, overwrite=True)
+        if dep['checksum'] != self.checksum(manifest_path):
+            raise FatalError('Corrupted cache manifest')
+        manifest = self.load_manifest(manifest_path)
+        chunks = manifest['chunks']
+        tasks = [self.fetch_chunk(config, dep, chunk) for chunk in chunks]
+        downloaded = await asyncio.gather(*tasks)
+        size = sum(c['size'] for c, d in zip(chunks, downloaded) if d) / (1024 * 1024)
+        m.message(f'Downloaded {downloaded.count(True)} of {len(chunks)} cache chunks ({size:.2f}MB)')
+        for chunk in chunks:
+            chunk_path = os.path.join(self.get_chunks_dir(config), chunk['file'])
+            m.action(f'Unpacking {chunk["name"]} cache chunk')
+            await shell.unpack_tar_stream(chunk_path, config.home_dir)
+        # Remove the chunks no longer used
+        used = set(c['file'] for c in chunks)
+        for f in os.listdir(self.get_chunks_dir(config)):
+            if f not in used:
+                os.remove(os.path.join(self.get_chunks_dir(config), f))
+
     async def fetch_dep(self, config, dep):
         is_ci = 'CI' in os.environ
+        if self.is_manifest(dep['url']):
+            try:
+                await self.fetch_chunked_dep(config, dep)
+            except FatalError as e:
+                m.warning('Could not retrieve dependencies for commit %s: %s' % (dep['commit'], e.msg))
+            self.relocate_prefix(config)
+            return
         try:
             dep_path = os.path.join(config.home_dir, os.path.basename(dep['url']))
             m.action(f'Downloading deps cache {dep["url"]}')
@@ -289,7 +317,10 @@ class FetchCache(BaseCache):
             if dep['checksum'] != self.checksum(dep_path):
                 m.warning('Corrupted dependency file, ignoring.')
             m.action(f'Unpacking deps cache {dep_path}')
-            await shell.unpack(dep_path, config.home_dir)
+            if shell.tar_compressor_for(dep_path):
+                await shell.unpack_tar_stream(dep_path, config.home_dir)
+            else:
+                await shell.unpack(dep_path, config.home_dir)
             if is_ci:
                 m.action('Unpack complete, deleting artifact')
                 os.remove(dep_path)
@@ -315,37 +346,39 @@ class GenCache(BaseCache):
     def __init__(self, args=None):
         if args is None:
             args = []
+        args += [
+            ArgparseArgument(
+                '--codec',
+                action='store',
+                choices=list(shell.TAR_COMPRESSORS.keys()),
+                default='xz',
+                help='compressor used for the cache file',
+            ),
+            ArgparseArgument(
+                '--level', action='store', type=int, default=None, help='compression level, the codec default if unset'
+            ),
+            ArgparseArgument(
+                '--chunked',
+                action='store_true',
+                default=False,
+                help='split the cache in a chunk per recipe, listed in a manifest, so that only the '
+                'chunks that changed are uploaded and fetched',
+            ),
+        ]
         BaseCache.__init__(self, args)
 
-    def create_tarball_tarfile(self, workdir, out_file, *in_files, exclude=None):
-        import tarfile
-
-        m.action('Generating cache file with tarfile + xz')
-
-        def exclude_filter(tarinfo):
-            for each in exclude:
-                if each in tarinfo.name:
-                    return None
-            return tarinfo
-
-        prev_cwd = os.getcwd()
-        os.chdir(workdir)
-        out_tar, _ = os.path.splitext(out_file)
-        try:
-            with tarfile.open(out_tar, 'w') as tf:
-                for in_file in in_files:
-                    tf.add(in_file, filter=exclude_filter)
-        finally:
-            os.chdir(prev_cwd)
-        m.action('Compressing cache file with xz')
-        shell.new_call(['xz', '--threads=0', out_tar])
+    def create_tarball_tarfile(self, workdir, out_file, *in_files, exclude=None, codec='xz', level=None):
+        cmd = shell.compress_cmd(codec, level)
+        m.action(f'Generating cache file with tarfile streaming to {cmd!r}')
+        if not self.dry_run:
+            shell.write_tar(out_file, workdir, in_files, codec, level, exclude)
 
-    def create_tarball_tar(self, workdir, out_file, *in_files, exclude=None):
+    def create_tarball_tar(self, workdir, out_file, *in_files, exclude=None, codec='xz', level=None):
         cmd = [
             shell.get_tar_cmd(),
             '-C',
             workdir,
-            '--use-compress-program=xz --threads=0',
+            '--use-compress-program=' + ' '.join(shell.compress_cmd(codec, level)),
         ]
         for each in exclude:
             cmd += ['--exclude=' + each]
@@ -355,19 +388,143 @@ class GenCache(BaseCache):
         if not self.dry_run:
             shell.new_call(cmd)
 
-    def create_tarball(self, config, workdir, *args):
+    def create_tarball(self, config, workdir, *args, codec='xz', level=None):
         exclude = ['var/tmp']
         # MSYS tar seems to hang sometimes while compressing on Windows CI, so
         # use the tarfile module
         if config.platform == Platform.WINDOWS:
-            self.create_tarball_tarfile(workdir, *args, exclude=exclude)
+            self.create_tarball_tarfile(workdir, *args, exclude=exclude, codec=codec, level=level)
         else:
-            self.create_tarball_tar(workdir, *args, exclude=exclude)
+            self.create_tarball_tar(workdir, *args, exclude=exclude, codec=codec, level=level)
+
+    @staticmethod
+    def _list_files(workdir, path):
+        # Files, symlinks and empty directories, relative to workdir
+        full_path = os.path.join(workdir, path)
+        if not os.path.isdir(full_path) or os.path.islink(full_path):
+            return [path] if os.path.lexists(full_path) else []
+        files = []
+        for dirpath, dirnames, filenames in os.walk(full_path):
+            reldir = os.path.relpath(dirpath, workdir)
+            links = [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+            if not dirnames and not filenames:
+                files.append(reldir)
+            files += [os.path.join(reldir, f) for f in filenames + links]
+        return files
+
+    @staticmethod
+    def _chunk_key(workdir, files):
+        # Files restored from a chunk keep their size, mode and mtime, so
+        # unchanged recipes get the same key after fetching the cache
+        h = sha256()
+        for f in files:
+            path = os.path.join(workdir, f)
+            st = os.lstat(path)
+            target = os.readlink(path) if os.path.islink(path) else ''
+            h.update(f'{f}\0{st.st_size}\0{int(st.st_mtime)}\0{st.st_mode}\0{target}\n'.encode('utf-8'))
+        return h.hexdigest()
+
+    def split_chunks(self, config, workdir, in_files, exclude):
+        """
+        Splits the files of the cache in a chunk per recipe, with the files
+        installed by the recipe in the prefix, a chunk per build-tools
+        recipe, a small status chunk with the cache files, which change in
+        every build, and a base chunk with everything else
+        """
+
+        def excluded(f):
+            return any(each in f for each in exclude)
+
+        def recipe_chunks(recipes_config, name_prefix):
+            prefix = os.path.relpath(recipes_config.prefix, workdir)
+            # The status of the recipes being archived must not be reset
+            cookbook = recipes_config.cookbook
+            if cookbook is None or cookbook.get_config() is not recipes_config or not cookbook.recipes:
+                cookbook = CookBook(recipes_config, reset_status=False)
+            for recipe in cookbook.get_recipes_list():
+                files = []
+                for f in sorted(set(recipe.files_list() + recipe.devel_files_list())):
+                    for path in self._list_files(workdir, os.path.normpath(os.path.join(prefix, f))):
+                        if path not in claimed and not excluded(path):
+                            claimed.add(path)
+                            files.append(path)
+                if files:
+                    chunks.append((name_prefix + recipe.name, sorted(files)))
+
+        claimed = set()
+        chunks = []
+        status = []
+        for status_file in (config.cache_file, config.build_tools_cache):
+            if status_file in in_files and os.path.lexists(os.path.join(workdir, status_file)):
+                claimed.add(status_file)
+                status.append(status_file)
+        recipe_chunks(config, '')
+        if config.build_tools_config is not None:
+            recipe_chunks(config.build_tools_config, 'build-tools/')
+        base = []
+        for in_file in in_files:
+            base += [f for f in self._list_files(workdir, in_file) if f not in claimed and not excluded(f)]
+        chunks.insert(0, ('base', sorted(base)))
+        if status:
+            chunks.insert(1, ('status', sorted(status)))
+        return chunks
+
+    def gen_chunks(self, config, workdir, in_files, codec, level, exclude):
+        """
+        Generates the chunks of the cache and returns the manifest listing
+        them. Chunks already in the local chunks directory, like the ones
+        fetched with fetch-cache, are not compressed again.
+        """
+        chunks_dir = self.get_chunks_dir(config)
+        os.makedirs(chunks_dir, exist_ok=True)
+        suffix = shell.TAR_COMPRESSORS[codec].suffix
+        manifest = {'version': self.manifest_version, 'codec': codec, 'chunks': []}
+        reused = 0
+        for name, files in self.split_chunks(config, workdir, in_files, exclude):
+            key = self._chunk_key(workdir, files)
+            existing = glob.glob(os.path.join(chunks_dir, f'{key}-*.{suffix}'))
+            if existing:
+                chunk_path = existing[0]
+                reused += 1
+            else:
+                tmp_path = os.path.join(chunks_dir, f'{key}.tmp')
+                shell.write_tar(tmp_path, workdir, files, codec, level)
+                chunk_path = os.path.join(chunks_dir, f'{key}-{self.checksum(tmp_path)}.{suffix}')
+                os.replace(tmp_path, chunk_path)
+            filename = os.path.basename(chunk_path)
+            manifest['chunks'].append(
+                {
+                    'name': name,
+                    'key': key,
+                    'file': filename,
+                    'sha256': filename[len(key) + 1 : -len(suffix) - 1],
+                    'size': os.path.getsize(chunk_path),
+                }
+            )
+        m.message(f'Generated {len(manifest["chunks"]) - reused} cache chunks, {reused} unchanged')
+        return manifest
+
+    def gen_chunked_dep(self, config, args, workdir, in_files):
+        manifest_filepath = self.get_manifest_filepath(config)
+        m.action('Generating cache chunks')
+        if self.dry_run:
+            return manifest_filepath
+        manifest = self.gen_chunks(config, workdir, in_files, args.codec, args.level, ['var/tmp'])
+        with open(manifest_filepath, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return manifest_filepath
 
     def gen_dep(self, config, args, deps, sha):
-        deps_filepath = self.get_deps_filepath(config)
-        if not self.dry_run and os.path.exists(deps_filepath):
-            os.remove(deps_filepath)
+        # Remove the cache files of any codec, upload-cache uploads the one
+        # found
+        for codec in shell.TAR_COMPRESSORS:
+            deps_filepath = self.get_deps_filepath(config, codec)
+            if not self.dry_run and os.path.exists(deps_filepath):
+                os.remove(deps_filepath)
+        manifest_filepath = self.get_manifest_filepath(config)
+        if not self.dry_run and os.path.exists(manifest_filepath):
+            os.remove(manifest_filepath)
+        deps_filepath = self.get_deps_filepath(config, args.codec)
 
         log_filepath = self.get_log_filepath(config)
         if not self.dry_run and os.path.exists(log_filepath):
@@ -376,11 +533,13 @@ class GenCache(BaseCache):
         workdir = config.home_dir
         platform_arch = '_'.join(config._get_toolchain_target_platform_arch())
         distdir = f'dist/{platform_arch}'
+        in_files = ['build-tools', config.build_tools_cache, distdir, config.cache_file]
         try:
-            self.create_tarball(
-                config, workdir, deps_filepath, 'build-tools', config.build_tools_cache, distdir, config.cache_file
-            )
-            url = self.make_url(config, args, '%s-%s' % (sha, self.deps_filename))
+            if args.chunked:
+                deps_filepath = self.gen_chunked_dep(config, args, workdir, in_files)
+            else:
+                self.create_tarball(config, workdir, deps_filepath, *in_files, codec=args.codec, level=args.level)
+            url = self.make_url(config, args, '%s-%s' % (sha, os.path.basename(deps_filepath)))
             deps.insert(0, {'commit': sha, 'checksum': self.checksum(deps_filepath), 'url': url})
             deps = deps[0 : self.log_size]
             log_json = json.dumps(deps, indent=1)
@@ -419,6 +578,60 @@ class UploadCache(BaseCache):
             args = []
         BaseCache.__init__(self, args)
 
+    def list_remote_chunks(self, ssh_cmd, remote_chunks_dir):
+        out = shell.check_output(ssh_cmd + ['mkdir -p %s && ls %s' % (remote_chunks_dir, remote_chunks_dir)])
+        return set(out.split())
+
+    def reuse_remote_chunks(self, config, remote_chunks):
+        """
+        Points the chunks of the manifest that are already uploaded to the
+        remote files, and updates the manifest checksum in the deps log
+        """
+        manifest_filepath = self.get_manifest_filepath(config)
+        manifest = self.load_manifest(manifest_filepath)
+        missing = []
+        for chunk in manifest['chunks']:
+            uploaded = [f for f in remote_chunks if f.startswith(chunk['key'] + '-')]
+            if not uploaded:
+                missing.append(chunk['file'])
+            elif chunk['file'] not in uploaded:
+                suffix = shell.TAR_COMPRESSORS[manifest['codec']].suffix
+                chunk['file'] = uploaded[0]
+                chunk['sha256'] = uploaded[0][len(chunk['key']) + 1 : -len(suffix) - 1]
+        with open(manifest_filepath, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        log_filepath = self.get_log_filepath(config)
+        with open(log_filepath, 'r') as f:
+            log = json.load(f)
+        log[0]['checksum'] = self.checksum(manifest_filepath)
+        with open(log_filepath, 'w') as f:
+            f.write(json.dumps(log, indent=1))
+        return missing
+
+    def remove_unused_chunks(self, config, ssh_cmd, remote_chunks_dir, remote_chunks):
+        with open(self.get_log_filepath(config), 'r') as f:
+            log = json.load(f)
+        used = set()
+        for dep in log:
+            if not self.is_manifest(dep['url']):
+                continue
+            if dep is log[0]:
+                manifest = self.load_manifest(self.get_manifest_filepath(config))
+            else:
+                try:
+                    manifest = self.json_get(dep['url'])
+                except FatalError as e:
+                    m.warning('Could not get cache manifest, keeping all the chunks: %s' % e.msg)
+                    return
+            used.update(c['file'] for c in manifest['chunks'])
+        unused = sorted(remote_chunks - used)
+        if not unused:
+            return
+        rm_cmd = ['rm', '-f'] + [os.path.join(remote_chunks_dir, f) for f in unused]
+        m.message(f'Removing {len(unused)} obsolete cache chunks')
+        if not self.dry_run:
+            shell.new_call(ssh_cmd + rm_cmd, verbose=True)
+
     def upload_dep(self, config, args, deps):
         sha = self.get_git_sha(args.commit)
         for dep in deps:
@@ -431,6 +644,12 @@ class UploadCache(BaseCache):
         private_key_path = os.path.join(tmpdir, 'id_rsa')
 
         deps_filepath = self.get_deps_filepath(config)
+        for codec in shell.TAR_COMPRESSORS:
+            if os.path.exists(self.get_deps_filepath(config, codec)):
+                deps_filepath = self.get_deps_filepath(config, codec)
+        chunked = os.path.exists(self.get_manifest_filepath(config))
+        if chunked:
+            deps_filepath = self.get_manifest_filepath(config)
         log_filepath = self.get_log_filepath(config)
         if not self.dry_run:
             if not os.path.exists(deps_filepath) or not os.path.exists(log_filepath):
@@ -454,8 +673,21 @@ class UploadCache(BaseCache):
             if not self.dry_run:
                 shell.new_call(ssh_cmd + ['mkdir -p %s' % base_dir], verbose=True)
 
+            # Upload only the chunks that are not in the remote yet
+            remote_chunks_dir = os.path.join(base_dir, self.chunks_dirname)
+            remote_chunks = set()
+            if chunked and not self.dry_run:
+                remote_chunks = self.list_remote_chunks(ssh_cmd, remote_chunks_dir)
+                missing = self.reuse_remote_chunks(config, remote_chunks)
+                m.message(f'Uploading {len(missing)} new cache chunks')
+                if missing:
+                    chunks = [os.path.join(self.get_chunks_dir(config), f) for f in missing]
+                    upload_cmd = scp_cmd + chunks + [f'{self.ssh_address}:{remote_chunks_dir}/']
+                    shell.new_call(upload_cmd, verbose=True)
+                    remote_chunks.update(missing)
+
             # Upload the deps files first
-            remote_deps_filepath = os.path.join(base_dir, '%s-%s' % (sha, self.deps_filename))
+            remote_deps_filepath = os.path.join(base_dir, '%s-%s' % (sha, os.path.basename(deps_filepath)))
             upload_cmd = scp_cmd + [deps_filepath, f'{self.ssh_address}:{remote_deps_filepath}']
             m.message(f'Uploading deps file: {upload_cmd!r}')
             if not self.dry_run:
@@ -484,6 +716,8 @@ class UploadCache(BaseCache):
                 m.message(f'Removing obsolete dep file: {rm_cmd!r}')
                 if not self.dry_run:
                     shell.new_call(ssh_cmd + rm_cmd, verbose=True)
+            if chunked and remote_chunks:
+                self.remove_unused_chunks(config, ssh_cmd, remote_chunks_dir, remote_chunks)
         finally:
             shutil.rmtree(tmpdir)
 
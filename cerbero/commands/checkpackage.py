@@ -18,12 +18,15 @@
 # Boston, MA 02111-1307, USA.
 
 
+import os
+
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
 from cerbero.errors import CommandError
 from cerbero.utils import _, N_, ArgparseArgument
 from cerbero.utils import messages as m
 from cerbero.packages.packagesstore import PackagesStore
+from cerbero.tools.depstracker import DepsTracker
 
 
 class CheckPackage(Command):
@@ -66,8 +69,40 @@ class CheckPackage(Command):
                 except Exception as ex:
                     failed.append(recipe.name)
                     m.warning(_('%s checks failed: %s') % (recipe.name, ex))
+
+        m.message('Checking the libraries needed by the binaries of %s' % p_name)
+        if not self.check_libraries(config, store, p):
+            failed.append(_('libraries of %s') % p_name)
         if failed:
             raise CommandError(_('Error running %s checks on:\n    ' + '\n    '.join(failed)) % p_name)
 
+    def check_libraries(self, config, store, package):
+        """
+        Checks that the libraries of the prefix needed by the binaries of a
+        package are shipped with it or with the packages it depends on
+
+        @return: whether all of them are shipped
+        @rtype: bool
+        """
+        prefix = config.prefix
+        files = set(package.files_list())
+        for dep in store.get_package_deps(package, True):
+            files.update(dep.files_list())
+        shipped = set(os.path.realpath(os.path.join(prefix, f)) for f in files)
+        roots = [os.path.join(prefix, f) for f in package.files_list()]
+        tracker = DepsTracker.from_config(config)
+        closures = tracker.closure([f for f in roots if os.path.isfile(f)])
+        tracker.cache.save()
+        ok = True
+        for root, deps in sorted(closures.items()):
+            missing = [os.path.relpath(d, prefix) for d in deps if d not in shipped]
+            if missing:
+                ok = False
+                m.warning(
+                    _('%s needs libraries not shipped by the package nor its dependencies: %s')
+                    % (os.path.relpath(root, prefix), ', '.join(missing))
+                )
+        return ok
+
 
 register_command(CheckPackage)
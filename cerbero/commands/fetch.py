@@ -17,10 +17,13 @@
 # Boston, MA 02111-1307, USA.
 
 import asyncio
+import os
+import time
 
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
 from cerbero.enums import LibraryType
+from cerbero.errors import FatalError
 from cerbero.packages.packagesstore import PackagesStore
 from cerbero.utils import (
     _,
@@ -94,27 +97,16 @@ class Fetch(Command):
         to_rebuild = []
         printer = BuildStatusPrinter(('fetch',), cookbook.get_config().interactive)
         printer.total = len(fetch_recipes)
+        failures = {}
 
-        async def fetch_print_wrapper(recipe_name, stepfunc):
-            printer.update_recipe_step(printer.count, recipe_name, 'fetch')
-            await stepfunc()
-            printer.count += 1
-            printer.remove_recipe(recipe_name)
-
-        for recipe in fetch_recipes:
-            if print_only:
+        if print_only:
+            for recipe in fetch_recipes:
                 # For now just print tarball URLs
                 if isinstance(recipe, Tarball):
                     m.message('TARBALL: {} {}'.format(recipe.url, recipe.tarball_name))
-                continue
-            stepfunc = getattr(recipe, 'fetch')
-            if asyncio.iscoroutinefunction(stepfunc):
-                await fetch_print_wrapper(recipe.name, stepfunc)
-            else:
-                printer.update_recipe_step(printer.count, recipe.name, 'fetch')
-                stepfunc()
-                printer.count += 1
-                printer.remove_recipe(recipe.name)
+        else:
+            failures = await Fetch.fetch_recipes(fetch_recipes, jobs, printer)
+            fetch_recipes = [r for r in fetch_recipes if r.name not in failures]
 
         m.message('All async fetch jobs finished')
 
@@ -142,6 +134,61 @@ class Fetch(Command):
                 % '\n'.join([x.name for x in to_rebuild])
             )
 
+        if failures:
+            msg = '\n'.join(['{}: {}'.format(name, e) for name, e in sorted(failures.items())])
+            raise FatalError(_('Failed to fetch the following recipes:\n%s') % msg)
+
+    @staticmethod
+    async def fetch_recipes(recipes, jobs, printer):
+        """
+        Run the fetch step of @recipes concurrently with at most @jobs
+        fetches in flight. Recipes sharing the same git repository or tarball
+        are serialized by the source handlers' fetch locks.
+
+        @return: failed recipe names mapped to the error that was raised
+        @rtype: dict
+        """
+        semaphore = asyncio.Semaphore(jobs)
+        failures = {}
+        downloaded = []
+
+        def download_size(recipe):
+            if not isinstance(recipe, Tarball):
+                return 0
+            fname = recipe._get_download_path(recipe.tarball_name)
+            return os.path.getsize(fname) if os.path.isfile(fname) else 0
+
+        async def fetch_recipe(recipe):
+            async with semaphore:
+                printer.update_recipe_step(printer.count, recipe.name, 'fetch')
+                size_before = download_size(recipe)
+                try:
+                    ret = recipe.fetch()
+                    if asyncio.iscoroutine(ret):
+                        await ret
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    m.warning('Failed to fetch {}: {}'.format(recipe.name, e))
+                    failures[recipe.name] = e
+                else:
+                    size_after = download_size(recipe)
+                    if size_after != size_before:
+                        downloaded.append(size_after)
+                printer.count += 1
+                printer.remove_recipe(recipe.name)
+
+        start = time.monotonic()
+        await asyncio.gather(*[fetch_recipe(r) for r in recipes])
+        elapsed = max(time.monotonic() - start, 1e-6)
+        mib = sum(downloaded) / (1024 * 1024)
+        m.message(
+            'Fetched {} recipe(s) in {:.1f}s: {} tarball(s) downloaded, {:.1f} MiB at {:.2f} MiB/s'.format(
+                len(recipes) - len(failures), elapsed, len(downloaded), mib, mib / elapsed
+            )
+        )
+        return failures
+
 
 class FetchRecipes(Fetch):
     doc = N_('Fetch the recipes sources')
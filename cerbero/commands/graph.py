@@ -86,9 +86,9 @@ class Graph(Command):
             label = "package's recipes"
 
         if self.graph_type == GraphType.RECIPE or self.graph_type == GraphType.PACKAGE_RECIPES:
-            self.cookbook = CookBook(config)
+            self.cookbook = CookBook(config, lazy=True)
         if self.graph_type == GraphType.PACKAGE or self.graph_type == GraphType.PACKAGE_RECIPES:
-            self.package_store = PackagesStore(config)
+            self.package_store = PackagesStore(config, lazy=True)
 
         name = args.name[0]
         output = args.output[0] if args.output else name + '.svg'
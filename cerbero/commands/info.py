@@ -53,7 +53,7 @@ class PackageInfo(Command):
         )
 
     def run(self, config, args):
-        store = PackagesStore(config)
+        store = PackagesStore(config, lazy=True)
         p_name = args.package[0]
         if args.list_files:
             m.message('\n'.join(store.get_package_files_list(p_name)))
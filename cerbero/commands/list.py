@@ -28,7 +28,7 @@ class List(Command):
     name = 'list'
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, lazy=True)
         recipes = cookbook.get_recipes_list()
         if len(recipes) == 0:
             m.message(_('No recipes found'))
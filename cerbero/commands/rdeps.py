@@ -36,7 +36,7 @@ class RDeps(Command):
         )
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, lazy=True)
         recipe_name = args.recipe[0]
 
         recipes = cookbook.list_recipe_reverse_deps(recipe_name)
@@ -0,0 +1,75 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.build.sourcestore import SourceStore
+from cerbero.commands import Command, register_command
+from cerbero.errors import FatalError
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+MiB = 1024 * 1024
+
+
+class SourcesGC(Command):
+    doc = N_('Evicts the least recently used tarballs from the source store')
+    name = 'sources-gc'
+
+    def __init__(self):
+        Command.__init__(
+            self,
+            [
+                ArgparseArgument(
+                    '--max-size',
+                    type=int,
+                    default=None,
+                    help=_('maximum size of the store in MiB, source_store_max_size by default'),
+                ),
+                ArgparseArgument(
+                    '--max-age', type=int, default=None, help=_('remove the tarballs unused for this number of days')
+                ),
+                ArgparseArgument(
+                    '--dry-run', action='store_true', default=False, help=_('only report what would be removed')
+                ),
+            ],
+        )
+
+    def run(self, config, args):
+        store = SourceStore.from_config(config)
+        if store is None:
+            raise FatalError(_('The source store is not enabled, set source_store in the configuration'))
+        max_size = args.max_size * MiB if args.max_size is not None else store.max_size
+        max_age = args.max_age * 24 * 3600 if args.max_age is not None else None
+        if max_size is None and max_age is None:
+            raise FatalError(_('Set a maximum size or age for the source store'))
+        files = store.list_files()
+        total = sum(st.st_size for path, st in files)
+        removed, freed, reclaimed = store.gc(max_size, max_age, args.dry_run)
+        if args.dry_run:
+            msg = _('Would remove %d of %d tarballs (%.1f of %.1f MiB), reclaiming %.1f MiB')
+        else:
+            msg = _('Removed %d of %d tarballs (%.1f of %.1f MiB), reclaimed %.1f MiB')
+        m.message(msg % (removed, len(files), freed / MiB, total / MiB, reclaimed / MiB))
+        if freed != reclaimed:
+            m.message(
+                _('%.1f MiB are still used by tarballs linked from the download directories')
+                % ((freed - reclaimed) / MiB)
+            )
+
+
+register_command(SourcesGC)
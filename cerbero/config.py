@@ -19,6 +19,7 @@
 import os
 import sys
 import copy
+import hashlib
 import sysconfig
 from functools import lru_cache
 from pathlib import PurePath, Path
@@ -323,6 +324,50 @@ class Config(object):
         'tomllib_path',
         'qt6_qmake_path',
         'system_build_tools',
+        'parallel_recipes_loading',
+        'artifact_cache_dir',
+        'artifact_cache_url',
+        'process_accounting',
+        'jobserver',
+        'memory_budget',
+        'source_store',
+        'source_store_max_size',
+        'extract_cache',
+        'extract_git_init',
+        'cargo_vendor_store',
+    ]
+
+    # Properties that don't change the result of building the recipes,
+    # ignored by get_fingerprint()
+    _fingerprint_ignored_properties = [
+        'interactive',
+        'num_of_cpus',
+        'logs',
+        'build_tools_logs',
+        'cache_file',
+        'parallel_recipes_loading',
+        'artifact_cache_dir',
+        'artifact_cache_url',
+        'process_accounting',
+        'jobserver',
+        'memory_budget',
+        'source_store',
+        'source_store_max_size',
+        'extract_cache',
+        'extract_git_init',
+        'cargo_vendor_store',
+    ]
+    # Paths of the host that don't change the result of building the recipes
+    # either, but that recipes can store in their metadata, only ignored by
+    # get_fingerprint(host_independent=True)
+    _fingerprint_host_properties = [
+        'local_sources',
+        'cached_sources',
+        'recipes_dir',
+        'packages_dir',
+        'data_dir',
+        'environ_dir',
+        'home_dir',
     ]
 
     cookbook = None
@@ -698,6 +743,37 @@ class Config(object):
         self.set_property('build_tools_cache', None)
         # Build tools that are provided by the system (cmake, ninja, etc)
         self.set_property('system_build_tools', [])
+        # Parse the recipe files in worker processes for the commands that
+        # don't need to build the recipes
+        self.set_property('parallel_recipes_loading', False)
+        # Per-recipe cache of the installed files, see
+        # cerbero.build.artifactcache
+        self.set_property('artifact_cache_dir', None)
+        self.set_property('artifact_cache_url', None)
+        # Record the CPU time and peak memory of the commands run by each
+        # build step, in the step logs and the build telemetry
+        self.set_property('process_accounting', False)
+        # Share num_of_cpus jobs between all the recipes being compiled with
+        # a GNU make jobserver, see cerbero.utils.jobserver
+        self.set_property('jobserver', False)
+        # Memory in MiB shared by the recipes compiled at the same time, the
+        # RAM available when the build starts by default, or the total RAM
+        # where that is not known. Only recipes with a peak_memory, declared
+        # or learned with process_accounting, are limited.
+        self.set_property('memory_budget', None)
+        # Host-wide store of the tarballs shared by all the configurations,
+        # and its maximum size in MiB, see cerbero.build.sourcestore
+        self.set_property('source_store', None)
+        self.set_property('source_store_max_size', None)
+        # Host-wide cache of the extracted and patched tarballs, see
+        # cerbero.build.extractcache
+        self.set_property('extract_cache', None)
+        # Whether the extracted tarballs are committed to a git repository,
+        # patches are applied with 'patch' instead of 'git am' without it
+        self.set_property('extract_git_init', True)
+        # Host-wide store of the crates vendored by the cargo recipes, see
+        # cerbero.build.cratestore
+        self.set_property('cargo_vendor_store', None)
         self.set_property('recipes_commits', {})
         self.set_property('recipes_remotes', {})
         self.set_property('extra_build_tools', [])
@@ -741,6 +817,37 @@ class Config(object):
             return self.recipes_commits[recipe_name]
         return None
 
+    def get_fingerprint(self, host_independent=False):
+        """
+        Gets a fingerprint of the configuration, which changes when any of
+        the properties or the variants of this configuration or of the
+        architecture ones change
+
+        @param host_independent: ignore the paths of the host that don't
+                                 change the result of the build, for
+                                 fingerprints shared between hosts
+        @type host_independent: bool
+        @return: the fingerprint
+        @rtype: str
+        """
+        values = []
+        for name in self._properties:
+            if name in self._fingerprint_ignored_properties:
+                continue
+            if host_independent and name in self._fingerprint_host_properties:
+                continue
+            value = getattr(self, name)
+            if isinstance(value, set):
+                value = sorted(value)
+            values.append('%s=%r' % (name, value))
+        for name, value in sorted(self.variants.__dict__.items()):
+            if not name.startswith('_'):
+                values.append('variant %s=%r' % (name, value))
+        for arch, config in sorted(self.arch_config.items(), key=lambda x: str(x[0])):
+            if config is not self:
+                values.append('arch %s=%s' % (arch, config.get_fingerprint(host_independent)))
+        return hashlib.sha256('\n'.join(values).encode('utf-8')).hexdigest()
+
     def cross_compiling(self):
         "Are we building for the host platform or not?"
         # Building for UWP is always cross-compilation since we can't run the
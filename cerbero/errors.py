@@ -53,6 +53,14 @@ class CommandError(FatalError):
         FatalError.__init__(self, msg)
 
 
+class DownloadError(FatalError):
+    header = 'Download Error: '
+
+    def __init__(self, msg, retry=True):
+        self.retry = retry
+        FatalError.__init__(self, msg)
+
+
 class BuildStepError(CerberoException):
     recipe = ''
     step = ''
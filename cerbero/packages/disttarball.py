@@ -122,14 +122,22 @@ class DistTarball(PackagerBase):
         else:
             s = strip.Strip(self.config)
 
+        # Files are reflinked where supported, so that only the ones
+        # stripped use more space
+        tmp_files = []
         for f in files:
             orig_file = os.path.join(self.prefix, f)
             tmp_file = os.path.join(tmpdir, f)
             tmp_file_dir = os.path.dirname(tmp_file)
             if not os.path.exists(tmp_file_dir):
                 os.makedirs(tmp_file_dir)
-            shutil.copy(orig_file, tmp_file, follow_symlinks=False)
-            s.strip_file(tmp_file)
+            if os.path.islink(orig_file) or not os.path.isfile(orig_file):
+                shutil.copy(orig_file, tmp_file, follow_symlinks=False)
+            else:
+                shell.reflink_or_copy(orig_file, tmp_file)
+            tmp_files.append(tmp_file)
+        stats = s.strip_files(tmp_files)
+        m.message('%s: %s' % (self.package.name, stats))
 
         prefix_restore = self.prefix
         self.prefix = tmpdir
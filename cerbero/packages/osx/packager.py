@@ -430,7 +430,8 @@ class ApplicationPackage(PackagerBase):
             for f in self.package.strip_dirs:
                 s_dir = os.path.join(self.appdir, 'Contents', 'Home', f)
                 s = strip.Strip(self.config, self.package.strip_excludes)
-                s.strip_dir(s_dir)
+                stats = s.strip_dir(s_dir)
+                m.message('%s: %s' % (self.package.name, stats))
 
     def _add_applications_link(self):
         # Create link to /Applications
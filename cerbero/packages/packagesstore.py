@@ -35,12 +35,12 @@ class PackagesStore(object):
 
     PKG_EXT = '.package'
 
-    def __init__(self, config, load=True, offline=False):
+    def __init__(self, config, load=True, offline=False, lazy=False):
         self._config = config
 
         self._packages = {}  # package_name -> package
 
-        self.cookbook = CookBook(config, load=load, offline=offline)
+        self.cookbook = CookBook(config, load=load, offline=offline, lazy=lazy)
         # used in tests to skip loading a dir with packages definitions
         if not load:
             return
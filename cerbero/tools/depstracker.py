@@ -15,78 +15,440 @@
 # License along with this library; if not, write to the
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
+
+"""
+Lists the shared libraries a binary depends on, reading the dynamic section
+of ELF files, the import tables of PE files and the load commands of Mach-O
+files in-process, without running objdump, otool or ldd.
+
+Only the dependencies found in the prefix are tracked. The direct
+dependencies of each file are memoized by its path, size and modification
+time, and can be persisted in a cache file shared by all the commands.
+"""
+
+import json
 import os
-import re
+import struct
+import threading
 
 from cerbero.config import Platform
-from cerbero.utils import shell
+from cerbero.tools.macho import MachO, MachOError
+from cerbero.tools.strip import binary_format
 
 
-class RecursiveLister:
-    def list_file_deps(self, prefix, path):
-        raise NotImplementedError()
+CACHE_FILE = 'deps.cache'
+CACHE_VERSION = 1
 
-    def find_deps(self, prefix, lib, state=None, ordered=None):
-        if state is None:
-            state = {}
-        if ordered is None:
-            ordered = []
-        if state.get(lib, 'clean') == 'processed':
-            return
-        if state.get(lib, 'clean') == 'in-progress':
-            return
-        state[lib] = 'in-progress'
-        lib_deps = self.list_file_deps(prefix, lib)
-        for libdep in lib_deps:
-            self.find_deps(prefix, libdep, state, ordered)
-        state[lib] = 'processed'
-        ordered.append(lib)
-        return ordered
+# ELF
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# PE data directories
+IMAGE_DIRECTORY_ENTRY_IMPORT = 1
+IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT = 13
+
+
+class BinaryParseError(Exception):
+    pass
+
+
+def _read_c_string(f, offset):
+    f.seek(offset)
+    data = b''
+    while b'\0' not in data:
+        chunk = f.read(256)
+        if not chunk:
+            break
+        data += chunk
+    return data.split(b'\0', 1)[0].decode('utf-8', 'surrogateescape')
+
+
+def read_elf_deps(path):
+    """
+    Reads the DT_NEEDED and the DT_RUNPATH, or DT_RPATH, entries of an ELF
+    file
+
+    @param path: path of the ELF file
+    @type path: str
+    @return: the libraries needed and the search paths
+    @rtype: tuple
+    """
+    with open(path, 'rb') as f:
+        ident = f.read(16)
+        if ident[4] not in (1, 2):
+            raise BinaryParseError('Unknown ELF class')
+        is64 = ident[4] == 2
+        endian = '<' if ident[5] == 1 else '>'
+        if is64:
+            header = struct.unpack(endian + 'HHIQQQIHHH', f.read(42))
+        else:
+            header = struct.unpack(endian + 'HHIIIIIHHH', f.read(30))
+        phoff, phentsize, phnum = header[4], header[8], header[9]
+        f.seek(phoff)
+        table = f.read(phentsize * phnum)
+        loads = []
+        dynamic = None
+        for i in range(phnum):
+            if is64:
+                ptype, _, offset, vaddr, _, filesz, _, _ = struct.unpack_from(endian + 'IIQQQQQQ', table, i * phentsize)
+            else:
+                ptype, offset, vaddr, _, filesz, _, _, _ = struct.unpack_from(endian + 'IIIIIIII', table, i * phentsize)
+            if ptype == PT_LOAD:
+                loads.append((vaddr, offset, filesz))
+            elif ptype == PT_DYNAMIC:
+                dynamic = (offset, filesz)
+        if dynamic is None:
+            # Statically linked
+            return [], []
+        f.seek(dynamic[0])
+        data = f.read(dynamic[1])
+        fmt = endian + ('qQ' if is64 else 'iI')
+        entries = []
+        for tag, value in struct.iter_unpack(fmt, data[: len(data) - len(data) % struct.calcsize(fmt)]):
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+        strtab = [v for t, v in entries if t == DT_STRTAB]
+        if not strtab:
+            raise BinaryParseError('No string table in the dynamic section')
+        # The string table is given as a virtual address
+        for vaddr, offset, filesz in loads:
+            if vaddr <= strtab[0] < vaddr + filesz:
+                strtab_offset = strtab[0] - vaddr + offset
+                break
+        else:
+            raise BinaryParseError('String table outside of the loaded segments')
+        needed = [_read_c_string(f, strtab_offset + v) for t, v in entries if t == DT_NEEDED]
+        # DT_RPATH is ignored when there is a DT_RUNPATH
+        runpaths = [v for t, v in entries if t == DT_RUNPATH] or [v for t, v in entries if t == DT_RPATH]
+        rpaths = []
+        for v in runpaths:
+            rpaths += [p for p in _read_c_string(f, strtab_offset + v).split(':') if p]
+    return needed, rpaths
+
+
+def read_pe_deps(path):
+    """
+    Reads the names of the DLLs imported, and delay loaded, by a PE file
+
+    @param path: path of the PE file
+    @type path: str
+    @return: the DLLs imported
+    @rtype: list
+    """
+    with open(path, 'rb') as f:
+        f.seek(0x3C)
+        pe_offset = struct.unpack('<I', f.read(4))[0]
+        f.seek(pe_offset)
+        if f.read(4) != b'PE\0\0':
+            raise BinaryParseError('No PE signature')
+        _, nsections, _, _, _, opt_size, _ = struct.unpack('<HHIIIHH', f.read(20))
+        optional = f.read(opt_size)
+        magic = struct.unpack_from('<H', optional)[0]
+        if magic == 0x10B:
+            dirs_offset = 96
+        elif magic == 0x20B:
+            dirs_offset = 112
+        else:
+            raise BinaryParseError('Unknown optional header magic 0x%x' % magic)
+        ndirs = struct.unpack_from('<I', optional, dirs_offset - 4)[0]
+        directories = [struct.unpack_from('<II', optional, dirs_offset + i * 8) for i in range(min(ndirs, 16))]
+        sections = []
+        for _ in range(nsections):
+            _, vsize, vaddr, rawsize, rawptr = struct.unpack('<8sIIII', f.read(24))
+            f.read(16)
+            sections.append((vaddr, max(vsize, rawsize), rawptr))
+
+        def rva_to_offset(rva):
+            for vaddr, size, rawptr in sections:
+                if vaddr <= rva < vaddr + size:
+                    return rva - vaddr + rawptr
+            raise BinaryParseError('RVA 0x%x outside of the sections' % rva)
+
+        dlls = []
+        # Import descriptors have the RVA of the name at offset 12, delay
+        # load descriptors at offset 4
+        for index, size, name_offset in (
+            (IMAGE_DIRECTORY_ENTRY_IMPORT, 20, 12),
+            (IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT, 32, 4),
+        ):
+            if index >= len(directories) or directories[index][0] == 0:
+                continue
+            offset = rva_to_offset(directories[index][0])
+            while True:
+                f.seek(offset)
+                descriptor = f.read(size)
+                if len(descriptor) < size or not any(descriptor):
+                    break
+                name_rva = struct.unpack_from('<I', descriptor, name_offset)[0]
+                name = _read_c_string(f, rva_to_offset(name_rva))
+                if name not in dlls:
+                    dlls.append(name)
+                offset += size
+    return dlls
 
-    def list_deps(self, prefix, path):
-        return self.find_deps(prefix, os.path.realpath(path), {}, [])
 
+def read_mach_o_deps(path):
+    """
+    Reads the LC_LOAD_DYLIB and LC_RPATH load commands of a Mach-O file
 
-class ObjdumpLister(RecursiveLister):
-    def list_file_deps(self, prefix, path):
-        env = os.environ.copy()
-        env['LC_ALL'] = 'C'
-        files = shell.check_output(['objdump', '-xw', path], env=env).splitlines()
-        prog = re.compile(r'(?i)^.*DLL[^:]*: (\S+\.dll)$')
-        files = [prog.sub(r'\1', x) for x in files if prog.match(x) is not None]
-        files = [os.path.join(prefix, 'bin', x) for x in files if x.lower().endswith('dll')]
-        return [os.path.realpath(x) for x in files if os.path.exists(x)]
+    @param path: path of the Mach-O file
+    @type path: str
+    @return: the libraries loaded and the rpaths
+    @rtype: tuple
+    """
+    try:
+        with MachO(path) as macho:
+            return macho.shared_libraries(), macho.rpaths()
+    except MachOError as ex:
+        raise BinaryParseError(str(ex))
 
 
-class OtoolLister(RecursiveLister):
-    def list_file_deps(self, prefix, path):
-        files = shell.check_output(['otool', '-L', path]).splitlines()[1:]
-        # Shared libraries might be relocated, we look for files with the
-        # prefix or starting with @rpath
-        files = [x.strip().split(' ')[0] for x in files if prefix in x or '@rpath' in x]
-        return [x.replace('@rpath/', prefix) for x in files]
+READERS = {
+    'elf': read_elf_deps,
+    'pe': lambda path: (read_pe_deps(path), []),
+    'mach-o': read_mach_o_deps,
+}
 
 
-class LddLister:
-    def list_deps(self, prefix, path):
-        files = shell.check_output(['ldd', path]).splitlines()
-        return [x.split(' ')[2] for x in files if prefix in x]
+class DepsCache(object):
+    """
+    Memo of the libraries and search paths read from each binary, keyed by
+    its path, size and modification time
+
+    @ivar path: path of the cache file, if any
+    @type path: str
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}  # path -> [size, mtime_ns, libraries, search paths]
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(cache, dict) and cache.get('version') == CACHE_VERSION:
+            self._entries.update(cache.get('entries', {}))
+
+    def save(self):
+        """
+        Writes the entries to the cache file
+        """
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': entries}, f)
+        os.replace(tmp, self.path)
+
+    def read(self, path):
+        """
+        Reads the libraries a binary depends on, and the paths where they
+        are searched
+
+        @param path: path of the file
+        @type path: str
+        @return: the libraries and the search paths, both empty for files
+                 that are not binaries
+        @rtype: tuple
+        """
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            return entry[2], entry[3]
+        fmt = binary_format(path)
+        libs, search_paths = [], []
+        if fmt in READERS:
+            try:
+                libs, search_paths = READERS[fmt](path)
+            except (BinaryParseError, OSError, struct.error, IndexError):
+                pass
+        with self._lock:
+            self._entries[path] = [st.st_size, st.st_mtime_ns, libs, search_paths]
+            self._dirty = True
+        return libs, search_paths
 
 
 class DepsTracker:
-    BACKENDS = {Platform.WINDOWS: ObjdumpLister, Platform.LINUX: LddLister, Platform.DARWIN: OtoolLister}
+    """
+    Graph of the dependencies between the binaries of a prefix
+    """
 
-    def __init__(self, platform, prefix):
-        self.libs_deps = {}
+    def __init__(self, platform, prefix, cache=None):
+        """
+        @param platform: the target platform of the binaries
+        @type platform: L{cerbero.enums.Platform}
+        @param prefix: the prefix
+        @type prefix: str
+        @param cache: cache of the binaries read, only kept in memory by
+                      default
+        @type cache: L{DepsCache}
+        """
+        self.platform = platform
         self.prefix = prefix
-        if self.prefix[:-1] != '/':
+        if self.prefix[-1] != '/':
             self.prefix += '/'
-        self.lister = self.BACKENDS[platform]()
+        self.cache = cache or DepsCache()
+        self._deps = {}  # realpath -> direct dependencies
+        self._dlls = None
+
+    @staticmethod
+    def from_config(config):
+        """
+        Gets the tracker of the prefix of a configuration, with the cache
+        file shared by all the configurations
+
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @rtype: L{DepsTracker}
+        """
+        cache = DepsCache(os.path.join(config.home_dir, CACHE_FILE))
+        return DepsTracker(config.target_platform, config.prefix, cache)
+
+    def _find_dll(self, name):
+        # DLL names are case insensitive
+        if self._dlls is None:
+            bindir = os.path.join(self.prefix, 'bin')
+            self._dlls = {}
+            if os.path.isdir(bindir):
+                self._dlls = dict((f.lower(), os.path.join(bindir, f)) for f in os.listdir(bindir))
+        return self._dlls.get(name.lower())
+
+    def _find_elf(self, name, path, rpaths):
+        if '/' in name:
+            return name if os.path.isabs(name) and os.path.exists(name) else None
+        origin = os.path.dirname(path)
+        dirs = [p.replace('$ORIGIN', origin).replace('${ORIGIN}', origin) for p in rpaths]
+        dirs += [os.path.join(self.prefix, d) for d in ('lib', 'lib64')]
+        for d in dirs:
+            lib = os.path.join(d, name)
+            if os.path.exists(lib):
+                return lib
+        return None
+
+    def _find_mach_o(self, name, path, rpaths):
+        if name.startswith('@rpath/'):
+            loader = os.path.dirname(path)
+            candidates = [
+                os.path.join(p.replace('@loader_path', loader).replace('@executable_path', loader), name[7:])
+                for p in rpaths
+            ]
+            candidates.append(os.path.join(self.prefix, 'lib', name[7:]))
+        elif name.startswith('@loader_path/') or name.startswith('@executable_path/'):
+            candidates = [os.path.join(os.path.dirname(path), name.split('/', 1)[1])]
+        else:
+            candidates = [name]
+        for lib in candidates:
+            if os.path.exists(lib):
+                return lib
+        return None
+
+    def file_deps(self, path):
+        """
+        Finds the libraries of the prefix a binary depends on directly
+
+        @param path: path of the file
+        @type path: str
+        @return: the paths of the libraries, as found in the search paths
+        @rtype: list
+        """
+        path = os.path.realpath(path)
+        if path in self._deps:
+            return self._deps[path]
+        libs, rpaths = self.cache.read(path)
+        deps = []
+        for name in libs:
+            if self.platform == Platform.WINDOWS:
+                lib = self._find_dll(name)
+            elif self.platform == Platform.DARWIN or self.platform == Platform.IOS:
+                lib = self._find_mach_o(name, path, rpaths)
+            else:
+                lib = self._find_elf(name, path, rpaths)
+            if lib is not None:
+                lib = os.path.normpath(lib)
+                if lib.startswith(self.prefix) and lib not in deps:
+                    deps.append(lib)
+        self._deps[path] = deps
+        return deps
+
+    def closure(self, roots):
+        """
+        Computes the dependencies of several binaries at once, reading each
+        binary only once
+
+        @param roots: paths of the binaries
+        @type roots: list
+        @return: for the real path of each root, the paths of all the libraries of the prefix
+                 it depends on, directly or not, in the order they must be
+                 loaded
+        @rtype: dict
+        """
+        closures = {}
+        for root in roots:
+            root = os.path.realpath(root)
+            if root in closures:
+                continue
+            ordered = []
+            state = {}
+            # Depth first, in post order, without recursion
+            stack = [(root, iter(self.file_deps(root)))]
+            state[root] = 'in-progress'
+            while stack:
+                lib, deps = stack[-1]
+                for dep in deps:
+                    real = os.path.realpath(dep)
+                    if real in state:
+                        continue
+                    state[real] = 'in-progress'
+                    if real in closures:
+                        # Already computed for another root
+                        for d in closures[real] + [real]:
+                            if d not in state or d == real:
+                                state[d] = 'processed'
+                                ordered.append(d)
+                        continue
+                    stack.append((real, iter(self.file_deps(real))))
+                    break
+                else:
+                    stack.pop()
+                    state[lib] = 'processed'
+                    if lib != root:
+                        ordered.append(lib)
+            closures[root] = ordered
+        return closures
 
     def list_deps(self, path):
-        deps = self.lister.list_deps(self.prefix, path)
+        """
+        Lists all the dependencies of a binary in the prefix
+
+        @param path: path of the binary
+        @type path: str
+        @return: paths relative to the prefix of the binary and all the
+                 libraries it depends on, and of the files they link to
+        @rtype: list
+        """
+        path = os.path.realpath(path)
+        deps = self.closure([path])[path] + [path]
         rdeps = []
         for d in deps:
-            if os.path.islink(d):
-                rdeps.append(os.path.realpath(d))
+            for lib in self.file_deps(d):
+                if os.path.islink(lib) and lib not in rdeps:
+                    rdeps.append(lib)
         return [x.replace(self.prefix, '') for x in deps + rdeps]
@@ -0,0 +1,395 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Reads and patches the load commands of Mach-O files, thin or fat, without
+the Xcode tools, so that it can be used on any platform.
+"""
+
+import mmap
+import struct
+
+
+MH_MAGIC = 0xFEEDFACE
+MH_CIGAM = 0xCEFAEDFE
+MH_MAGIC_64 = 0xFEEDFACF
+MH_CIGAM_64 = 0xCFFAEDFE
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+# Java class files share the fat magic, but their version is always higher
+# than any sane number of architectures
+FAT_MAX_ARCHS = 30
+
+LC_SEGMENT = 0x1
+LC_LOAD_DYLIB = 0xC
+LC_ID_DYLIB = 0xD
+LC_SEGMENT_64 = 0x19
+LC_LAZY_LOAD_DYLIB = 0x20
+LC_LOAD_WEAK_DYLIB = 0x80000018
+LC_RPATH = 0x8000001C
+LC_CODE_SIGNATURE = 0x1D
+LC_REEXPORT_DYLIB = 0x8000001F
+LC_LOAD_UPWARD_DYLIB = 0x80000023
+
+DYLIB_LOAD_COMMANDS = (LC_LOAD_DYLIB, LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB, LC_LAZY_LOAD_DYLIB, LC_LOAD_UPWARD_DYLIB)
+PATH_COMMANDS = DYLIB_LOAD_COMMANDS + (LC_ID_DYLIB, LC_RPATH)
+
+
+class MachOError(Exception):
+    pass
+
+
+def is_mach_o(path):
+    """
+    Checks the magic of a file to find out if it's a Mach-O file
+
+    @param path: path of the file
+    @type path: str
+    @rtype: bool
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+    except OSError:
+        return False
+    return _is_mach_o_header(header)
+
+
+def _is_mach_o_header(header):
+    if len(header) < 8:
+        return False
+    magic = struct.unpack('>I', header[:4])[0]
+    if magic in (FAT_MAGIC, FAT_MAGIC_64):
+        return 0 < struct.unpack('>I', header[4:8])[0] <= FAT_MAX_ARCHS
+    return magic in (MH_MAGIC, MH_CIGAM, MH_MAGIC_64, MH_CIGAM_64)
+
+
+class LoadCommand(object):
+    """
+    A load command of a Mach-O slice
+
+    @ivar cmd: type of the load command
+    @type cmd: int
+    @ivar offset: offset of the load command in the file
+    @type offset: int
+    @ivar size: size of the load command
+    @type size: int
+    @ivar path_offset: offset of the path in the load command, for the
+                       commands with a path
+    @type path_offset: int
+    @ivar path: path of the dylib or rpath, None for other commands
+    @type path: str
+    """
+
+    __slots__ = ['cmd', 'offset', 'size', 'path_offset', 'path']
+
+    def __init__(self, cmd, offset, size, path_offset=None, path=None):
+        self.cmd = cmd
+        self.offset = offset
+        self.size = size
+        self.path_offset = path_offset
+        self.path = path
+
+
+class MachOSlice(object):
+    """
+    A Mach-O image, the whole file for thin files or one of the
+    architectures of a fat file
+
+    @ivar offset: offset of the image in the file
+    @type offset: int
+    @ivar endian: struct byte order of the image
+    @type endian: str
+    @ivar is64: whether it's a 64 bits image
+    @type is64: bool
+    @ivar commands: the load commands
+    @type commands: list
+    @ivar max_cmds_size: space available for the load commands before the
+                         first section
+    @type max_cmds_size: int
+    """
+
+    def __init__(self, data, offset):
+        self.offset = offset
+        magic = struct.unpack_from('<I', data, offset)[0]
+        if magic in (MH_MAGIC, MH_MAGIC_64):
+            self.endian = '<'
+        elif magic in (MH_CIGAM, MH_CIGAM_64):
+            self.endian = '>'
+        else:
+            raise MachOError('Invalid Mach-O magic 0x%x at offset %d' % (magic, offset))
+        self.is64 = magic in (MH_MAGIC_64, MH_CIGAM_64)
+        self.header_size = 32 if self.is64 else 28
+        self.ncmds, self.sizeofcmds = struct.unpack_from(self.endian + 'II', data, offset + 16)
+        self.commands = []
+        first_data = len(data) - offset
+        pos = offset + self.header_size
+        for _ in range(self.ncmds):
+            cmd, size = struct.unpack_from(self.endian + 'II', data, pos)
+            if size < 8 or pos + size > offset + self.header_size + self.sizeofcmds:
+                raise MachOError('Invalid load command at offset %d' % pos)
+            command = LoadCommand(cmd, pos, size)
+            if cmd in PATH_COMMANDS:
+                command.path_offset = struct.unpack_from(self.endian + 'I', data, pos + 8)[0]
+                raw = data[pos + command.path_offset : pos + size]
+                command.path = raw.split(b'\0', 1)[0].decode('utf-8', 'surrogateescape')
+            elif cmd in (LC_SEGMENT, LC_SEGMENT_64):
+                first_data = min(first_data, self._first_data_offset(data, pos, cmd == LC_SEGMENT_64))
+            self.commands.append(command)
+            pos += size
+        self.max_cmds_size = first_data - self.header_size
+
+    def _first_data_offset(self, data, pos, is64):
+        # Offset of the first section or segment data, the load commands
+        # can't grow beyond it
+        if is64:
+            fileoff, filesize = struct.unpack_from(self.endian + 'QQ', data, pos + 40)
+            nsects = struct.unpack_from(self.endian + 'I', data, pos + 64)[0]
+            sects, sect_size, offset_pos = pos + 72, 80, 48
+        else:
+            fileoff, filesize = struct.unpack_from(self.endian + 'II', data, pos + 32)
+            nsects = struct.unpack_from(self.endian + 'I', data, pos + 48)[0]
+            sects, sect_size, offset_pos = pos + 56, 68, 40
+        first = len(data)
+        if fileoff > 0 and filesize > 0:
+            first = fileoff
+        for i in range(nsects):
+            offset = struct.unpack_from(self.endian + 'I', data, sects + i * sect_size + offset_pos)[0]
+            # Zero fill sections have no data in the file
+            if offset > 0:
+                first = min(first, offset)
+        return first
+
+    def build_commands(self, data, paths, removed=(), added=()):
+        """
+        Builds the load commands area with new paths
+
+        @param data: contents of the file
+        @type data: bytes
+        @param paths: the new path for each of the changed load commands
+        @type paths: dict
+        @param removed: the load commands removed
+        @type removed: list
+        @param added: the LC_RPATH paths appended
+        @type added: list
+        @return: the load commands and their number
+        @rtype: tuple
+        """
+        align = 8 if self.is64 else 4
+        out = bytearray()
+        ncmds = 0
+        for command in self.commands:
+            if command in removed:
+                continue
+            ncmds += 1
+            raw = data[command.offset : command.offset + command.size]
+            if command not in paths:
+                out += raw
+                continue
+            path = paths[command].encode('utf-8', 'surrogateescape') + b'\0'
+            size = command.path_offset + len(path)
+            size = max(command.size, size + (-size % align))
+            new = bytearray(raw[: command.path_offset]) + path
+            new += b'\0' * (size - len(new))
+            struct.pack_into(self.endian + 'I', new, 4, size)
+            out += new
+        for rpath in added:
+            # rpath_command is the command, its size and the path offset
+            path = rpath.encode('utf-8', 'surrogateescape') + b'\0'
+            size = 12 + len(path)
+            size += -size % align
+            out += struct.pack(self.endian + 'III', LC_RPATH, size, 12) + path + b'\0' * (size - 12 - len(path))
+            ncmds += 1
+        if len(out) > self.max_cmds_size:
+            raise MachOError('Not enough space to grow the load commands')
+        return bytes(out), ncmds
+
+
+class MachO(object):
+    """
+    A Mach-O file, mapped in memory
+
+    Load commands are patched in place, growing them when needed within the
+    padding left by the linker after them, like install_name_tool does.
+    """
+
+    def __init__(self, path, writable=False):
+        """
+        @param path: path of the file
+        @type path: str
+        @param writable: whether the file will be modified
+        @type writable: bool
+        """
+        self.path = path
+        self._file = open(path, 'r+b' if writable else 'rb')
+        try:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+        except ValueError:
+            self._file.close()
+            raise MachOError('%s is empty' % path)
+        try:
+            self.slices = [MachOSlice(self._map, offset) for offset in self._slice_offsets()]
+        except (MachOError, struct.error) as ex:
+            self.close()
+            raise MachOError('%s is not a valid Mach-O file: %s' % (path, ex))
+
+    def _slice_offsets(self):
+        if not _is_mach_o_header(self._map[:8]):
+            raise MachOError('Unknown magic')
+        magic, nfat = struct.unpack_from('>II', self._map, 0)
+        if magic == FAT_MAGIC:
+            return [struct.unpack_from('>I', self._map, 8 + i * 20 + 8)[0] for i in range(nfat)]
+        if magic == FAT_MAGIC_64:
+            return [struct.unpack_from('>Q', self._map, 8 + i * 32 + 8)[0] for i in range(nfat)]
+        return [0]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _paths(self, cmds, all_archs=False):
+        # Like otool, only the first architecture is listed by default
+        paths = []
+        for s in self.slices if all_archs else self.slices[:1]:
+            for command in s.commands:
+                if command.cmd in cmds and command.path not in paths:
+                    paths.append(command.path)
+        return paths
+
+    def dylib_id(self):
+        """
+        @return: the LC_ID_DYLIB of the file or None if it's not a dylib
+        @rtype: str
+        """
+        ids = self._paths((LC_ID_DYLIB,))
+        return ids[0] if ids else None
+
+    def shared_libraries(self, all_archs=False):
+        """
+        @param all_archs: list the ones of all the architectures, instead
+                          of only the first one
+        @type all_archs: bool
+        @return: the libraries loaded by the file
+        @rtype: list
+        """
+        return self._paths(DYLIB_LOAD_COMMANDS, all_archs)
+
+    def rpaths(self, all_archs=False):
+        """
+        @param all_archs: list the ones of all the architectures, instead
+                          of only the first one
+        @type all_archs: bool
+        @return: the LC_RPATH entries of the file
+        @rtype: list
+        """
+        return self._paths((LC_RPATH,), all_archs)
+
+    def has_code_signature(self):
+        """
+        @return: whether any of the architectures is signed, changing the
+                 load commands invalidates the signature
+        @rtype: bool
+        """
+        return any(c.cmd == LC_CODE_SIGNATURE for s in self.slices for c in s.commands)
+
+    def change_paths(self, func):
+        """
+        Changes the paths of the dylib and rpath load commands of all the
+        architectures. Nothing is written if any of them can't be changed.
+
+        @param func: function called with the load command type and its path
+                     returning the new path
+        @type func: function
+        @return: the number of load commands changed
+        @rtype: int
+        """
+        return self.edit(func)
+
+    def edit(self, func=None, delete_rpaths=(), add_rpaths=()):
+        """
+        Changes the paths of the dylib and rpath load commands, and removes
+        and adds LC_RPATH commands, in all the architectures at once, like a
+        single install_name_tool call. Nothing is written if any of them
+        can't be changed.
+
+        @param func: function called with the load command type and its path
+                     returning the new path
+        @type func: function
+        @param delete_rpaths: the LC_RPATH entries removed
+        @type delete_rpaths: list
+        @param add_rpaths: the LC_RPATH entries added, unless they exist
+        @type add_rpaths: list
+        @return: the number of load commands changed, removed or added
+        @rtype: int
+        """
+        changes = []
+        count = 0
+        for s in self.slices:
+            paths = {}
+            removed = []
+            rpaths = []
+            for command in s.commands:
+                if command.path is None:
+                    continue
+                if command.cmd == LC_RPATH and command.path in delete_rpaths:
+                    removed.append(command)
+                    continue
+                if command.cmd == LC_RPATH:
+                    rpaths.append(command.path)
+                new = func(command.cmd, command.path) if func else command.path
+                if new != command.path:
+                    paths[command] = new
+            added = []
+            for rpath in add_rpaths:
+                if rpath not in rpaths and rpath not in added:
+                    added.append(rpath)
+            if paths or removed or added:
+                changes.append((s, s.build_commands(self._map, paths, removed, added)))
+                count += len(paths) + len(removed) + len(added)
+        for s, (data, ncmds) in changes:
+            start = s.offset + s.header_size
+            end = start + max(len(data), s.sizeofcmds)
+            self._map[start:end] = data + b'\0' * (end - start - len(data))
+            struct.pack_into(s.endian + 'II', self._map, s.offset + 16, ncmds, len(data))
+        if changes:
+            self._map.flush()
+            # Offsets of the following commands might have changed
+            self.slices = [MachOSlice(self._map, offset) for offset in self._slice_offsets()]
+        return count
+
+    def replace_prefix(self, old, new):
+        """
+        Replaces a prefix in the paths of the dylib and rpath load commands
+
+        @param old: the old prefix
+        @type old: str
+        @param new: the new prefix
+        @type new: str
+        @return: the number of load commands changed
+        @rtype: int
+        """
+        return self.change_paths(lambda cmd, path: path.replace(old, new) if old in path else path)
@@ -18,9 +18,12 @@
 # Boston, MA 02111-1307, USA.
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from cerbero.errors import FatalError
+from cerbero.tools.macho import DYLIB_LOAD_COMMANDS, LC_ID_DYLIB, MachO, MachOError, is_mach_o
 from cerbero.utils import shell
+from cerbero.utils import messages as m
 
 
 INT_CMD = 'install_name_tool'
@@ -35,14 +38,32 @@ class OSXRelocator(object):
     It parses lib/ /libexec and bin/ directories, changes the prefix path of
     the shared libraries that an object file uses and changes it's library
     ID if the file is a shared library.
+
+    The load commands of each file are read once, and all the changes are
+    written at once, in-process when the file isn't signed and the linker
+    left enough room for them, or with a single install_name_tool call.
     """
 
-    def __init__(self, root, install_prefix, recursive, logfile=None):
+    def __init__(self, root, install_prefix, recursive, logfile=None, other_prefixes=None):
+        """
+        @param root: directory relocated by L{relocate}
+        @type root: str
+        @param install_prefix: prefix replaced with @rpath in the paths of
+                               the libraries
+        @type install_prefix: str
+        @param recursive: whether directories are relocated recursively
+        @type recursive: bool
+        @param other_prefixes: prefixes also replaced in the paths of the
+                               libraries, like the ones of the other
+                               architectures of a universal file
+        @type other_prefixes: list
+        """
         self.root = root
         self.install_prefix = self._fix_path(install_prefix)
+        self.other_prefixes = [self._fix_path(p) for p in other_prefixes or []]
         self.recursive = recursive
         self.use_relative_paths = True
-        self.logfile = None
+        self.logfile = logfile
 
     def relocate(self):
         self.parse_dir(self.root)
@@ -53,6 +74,19 @@ class OSXRelocator(object):
     def relocate_file(self, object_file, original_file=None):
         self.change_libs_path(object_file, original_file)
 
+    def relocate_files(self, object_files, jobs=None):
+        """
+        Relocates files concurrently
+
+        @param object_files: the files to relocate
+        @type object_files: list
+        @param jobs: number of worker threads, one per CPU by default
+        @type jobs: int
+        """
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+            # Consume the results to raise the errors
+            list(executor.map(self.change_libs_path, object_files))
+
     def change_id(self, object_file, id=None):
         """
         Changes the `LC_ID_DYLIB` of the given object file.
@@ -62,8 +96,7 @@ class OSXRelocator(object):
         id = id or object_file.replace(self.install_prefix, '@rpath')
         if not self._is_mach_o_file(object_file):
             return
-        cmd = [INT_CMD, '-id', id, object_file]
-        shell.new_call(cmd, fail=False, logfile=self.logfile)
+        self._apply(object_file, new_id=id)
 
     def change_libs_path(self, object_file, original_file=None):
         """
@@ -81,18 +114,19 @@ class OSXRelocator(object):
             return
         if original_file is None:
             original_file = object_file
+        dylib_id, existing_rpaths, libs = self._read_load_commands(object_file)
         # First things first: ensure the load command of future consumers
         # points to the real ID of this library
         # This used to be done only at Universal lipo time, but by then
         # it's too late -- unless one wants to run through all load commands
         # If the library isn't a dylib, it's a framework, in which case
         # assert that it's already rpath'd
-        dylib_id = self.get_dylib_id(object_file)
         is_dylib = dylib_id is not None
         is_framework = is_dylib and not any([object_file.endswith(i) for i in ('.dylib', '.so')])
-        if not is_framework:
-            self.change_id(object_file, id='@rpath/{}'.format(os.path.basename(original_file)))
-        elif '@rpath' not in dylib_id:
+        new_id = None
+        if is_dylib and not is_framework:
+            new_id = '@rpath/{}'.format(os.path.basename(original_file))
+        elif is_framework and '@rpath' not in dylib_id:
             raise FatalError(f'Cannot relocate a fixed location framework: {dylib_id}')
         # With that out of the way, we need to sort out how many parents
         # need to be navigated to reach the root of the GStreamer prefix
@@ -122,33 +156,116 @@ class OSXRelocator(object):
                 '@loader_path/lib',
             ] + rpaths
         # Make them unique
-        rpaths = list(set(rpaths))
+        rpaths = list(dict.fromkeys(rpaths))
         # Remove absolute RPATHs, we don't want or need these
-        existing_rpaths = list(set(self.list_rpaths(object_file)))
-        for p in filter(
-            lambda p: p.startswith('/') and not p.startswith('/Applications/Xcode.app'), self.list_rpaths(object_file)
-        ):
-            cmd = [INT_CMD, '-delete_rpath', p, object_file]
-            shell.new_call(cmd, fail=False)
+        delete_rpaths = [
+            p for p in existing_rpaths if p.startswith('/') and not p.startswith('/Applications/Xcode.app')
+        ]
         # Add relative RPATHs
-        for p in filter(lambda p: p not in existing_rpaths, rpaths):
-            cmd = [INT_CMD, '-add_rpath', p, object_file]
-            shell.new_call(cmd, fail=False)
+        add_rpaths = [p for p in rpaths if p not in existing_rpaths]
         # Change dependencies' paths from absolute to @rpath/
-        for lib in self.list_shared_libraries(object_file):
-            new_lib = lib.replace(self.install_prefix, '@rpath').replace('@rpath/lib/', '@rpath/')
+        changes = {}
+        for lib in libs:
+            new_lib = lib
+            for prefix in [self.install_prefix] + self.other_prefixes:
+                new_lib = new_lib.replace(prefix, '@rpath')
+            new_lib = new_lib.replace('@rpath/lib/', '@rpath/')
             # These are leftovers from meson thinking RPATH == prefix
             if new_lib == lib:
                 continue
-            cmd = [INT_CMD, '-change', lib, new_lib, object_file]
-            shell.new_call(cmd, fail=False, logfile=self.logfile)
+            changes[lib] = new_lib
+        self._apply(object_file, new_id, changes, delete_rpaths, add_rpaths)
 
     def change_lib_path(self, object_file, old_path, new_path):
+        changes = {}
         for lib in self.list_shared_libraries(object_file):
             if old_path in lib:
-                new_path = lib.replace(old_path, new_path)
-                cmd = [INT_CMD, '-change', lib, new_path, object_file]
-                shell.new_call(cmd, fail=True, logfile=self.logfile)
+                changes[lib] = lib.replace(old_path, new_path)
+        if changes:
+            self._install_name_tool(object_file, changes=changes, fail=True)
+
+    def replace_prefixes(self, object_file, old_paths, new_path):
+        """
+        Replaces prefixes in the ID, the libraries and the rpaths of a file
+        with a single install_name_tool call, which also signs it again
+
+        @param old_paths: the prefixes to replace
+        @type old_paths: list
+        @param new_path: the new prefix
+        @type new_path: str
+        @return: whether the file was changed
+        @rtype: bool
+        """
+
+        def replace(path):
+            for old in old_paths:
+                path = path.replace(old, new_path)
+            return path
+
+        dylib_id, rpaths, libs = self._read_load_commands(object_file)
+        new_id = replace(dylib_id) if dylib_id and replace(dylib_id) != dylib_id else None
+        changes = {lib: replace(lib) for lib in libs if replace(lib) != lib}
+        rpath_changes = {p: replace(p) for p in rpaths if replace(p) != p}
+        if not new_id and not changes and not rpath_changes:
+            return False
+        self._install_name_tool(object_file, new_id, changes, rpath_changes=rpath_changes, fail=True)
+        return True
+
+    def _read_load_commands(self, object_file):
+        try:
+            with MachO(object_file) as macho:
+                return macho.dylib_id(), macho.rpaths(True), macho.shared_libraries(True)
+        except MachOError as ex:
+            m.log('Falling back to otool for %s: %s' % (object_file, ex), self.logfile)
+        # otool lists the ID of dylibs with the libraries they load
+        dylib_id = self.get_dylib_id(object_file)
+        libs = [lib for lib in self.list_shared_libraries(object_file) if lib != dylib_id]
+        return dylib_id, list(dict.fromkeys(self.list_rpaths(object_file))), libs
+
+    def _apply(self, object_file, new_id=None, changes=None, delete_rpaths=(), add_rpaths=()):
+        changes = changes or {}
+        if not new_id and not changes and not delete_rpaths and not add_rpaths:
+            return
+
+        def change_path(cmd, path):
+            if cmd == LC_ID_DYLIB and new_id:
+                return new_id
+            if cmd in DYLIB_LOAD_COMMANDS:
+                return changes.get(path, path)
+            return path
+
+        try:
+            with MachO(object_file, writable=True) as macho:
+                # install_name_tool signs them again
+                if not macho.has_code_signature():
+                    macho.edit(change_path, delete_rpaths, add_rpaths)
+                    return
+        except (MachOError, OSError) as ex:
+            m.log('Falling back to install_name_tool for %s: %s' % (object_file, ex), self.logfile)
+        self._install_name_tool(object_file, new_id, changes, delete_rpaths, add_rpaths)
+
+    def _install_name_tool(
+        self, object_file, new_id=None, changes=None, delete_rpaths=(), add_rpaths=(), rpath_changes=None, fail=False
+    ):
+        edits = []
+        if new_id:
+            edits.append(['-id', new_id])
+        for lib, new_lib in (changes or {}).items():
+            edits.append(['-change', lib, new_lib])
+        for p, new_p in (rpath_changes or {}).items():
+            edits.append(['-rpath', p, new_p])
+        for p in delete_rpaths:
+            edits.append(['-delete_rpath', p])
+        for p in add_rpaths:
+            edits.append(['-add_rpath', p])
+        cmd = [INT_CMD] + [arg for edit in edits for arg in edit]
+        if shell.new_call(cmd + [object_file], fail=fail, logfile=self.logfile) == 0 or len(edits) == 1:
+            return
+        # install_name_tool applies nothing when one of the edits fails, like
+        # deleting an rpath that isn't there, so apply them one by one
+        m.log('Applying the install_name_tool edits of %s one by one' % object_file, self.logfile)
+        for edit in edits:
+            shell.new_call([INT_CMD] + edit + [object_file], fail=False, logfile=self.logfile)
 
     def parse_dir(self, dir_path, filters=None):
         for dirpath, dirnames, filenames in os.walk(dir_path):
@@ -197,17 +314,8 @@ class OSXRelocator(object):
         return path
 
     def _is_mach_o_file(self, filename):
-        fileext = os.path.splitext(filename)[1]
-
-        if '.dylib' in fileext:
-            return True
-
-        filedesc = shell.check_output(['file', '-bh', filename])
-
-        if fileext == '.a' and 'ar archive' in filedesc:
-            return False
-
-        return filedesc.startswith('Mach-O')
+        # Static libraries are ar archives, not Mach-O files
+        return is_mach_o(filename)
 
 
 class Main(object):
@@ -33,6 +33,7 @@ if __name__ == '__main__':
     sys.path.append(parent)
 
 from cerbero.utils import shell, run_tasks, run_until_complete
+from cerbero.tools.macho import MachO, MachOError, is_mach_o
 from cerbero.tools.osxrelocator import OSXRelocator
 
 
@@ -44,31 +45,33 @@ def get_parent_prefix(f, dirs):
             yield (dir_)
 
 
-file_types = [
-    ('Mach-O', 'merge'),
-    ('ar archive', 'merge'),
-    ('libtool archive', 'skip'),
-    ('libtool library', 'copy-la'),
-    ('symbolic link', 'link'),
-    ('data', 'copy'),
-    ('text', 'copy'),
-    ('document', 'copy'),
-    ('catalog', 'copy'),
-    ('python', 'copy'),
-    ('image', 'copy'),
-    ('icon', 'copy'),
-    ('FORTRAN', 'copy'),
-    ('LaTeX', 'copy'),
-    ('Zip', 'copy'),
-    ('empty', 'copy'),
-    ('PEM certificate', 'copy'),
-    ('data', 'copy'),
-    ('GVariant Database', 'copy'),
-    ('Font', 'copy'),
-    ('OpenType', 'copy'),
-    ('TrueType', 'copy'),
-    ('directory', 'recurse'),
-]
+AR_MAGIC = b'!<arch>\n'
+
+
+def get_merge_action(path):
+    """
+    Finds out how a file is merged from its type, detected from its magic
+    bytes
+
+    @param path: path of the file
+    @type path: str
+    @return: one of 'merge', 'copy', 'copy-la', 'copy-pc', 'link',
+             'recurse' or 'skip'
+    @rtype: str
+    """
+    if os.path.islink(path):
+        return 'link'
+    if os.path.isdir(path):
+        return 'recurse'
+    with open(path, 'rb') as f:
+        header = f.read(512)
+    if is_mach_o(path) or header.startswith(AR_MAGIC):
+        return 'merge'
+    if path.endswith('.la') and b'libtool' in header:
+        return 'copy-la'
+    if path.endswith('.pc'):
+        return 'copy-pc'
+    return 'copy'
 
 
 class OSXUniversalGenerator(object):
@@ -90,11 +93,11 @@ class OSXUniversalGenerator(object):
     """
 
     LIPO_CMD = 'lipo'
-    FILE_CMD = 'file'
 
-    def __init__(self, output_root, logfile=None):
+    def __init__(self, output_root, logfile=None, jobs=None):
         """
         @output_root: the output directory where the result will be generated
+        @jobs: number of files merged at the same time, one per CPU by default
 
         """
         self.output_root = output_root
@@ -102,12 +105,18 @@ class OSXUniversalGenerator(object):
             self.output_root = self.output_root[:-1]
         self.missing = []
         self.logfile = logfile
+        self.jobs = jobs or os.cpu_count() or 1
 
     async def merge_files(self, filelist, dirs):
         if len(filelist) == 0:
             return
-        for f in filelist:
-            await self.do_merge(f, dirs)
+        semaphore = asyncio.Semaphore(self.jobs)
+
+        async def merge(f):
+            async with semaphore:
+                await self.do_merge(f, dirs)
+
+        await asyncio.gather(*[merge(f) for f in filelist])
 
     def merge_dirs(self, input_roots, output_root=None):
         if output_root is None:
@@ -117,53 +126,65 @@ class OSXUniversalGenerator(object):
         self.parse_dirs(input_roots)
 
     async def create_universal_file(self, output, inputlist, dirs):
-        tmp_inputs = []
-        # relocate all files with the prefix of the merged file.
-        # which must be done before merging them.
+        loop = asyncio.get_event_loop()
+        prefixes = [[d for d in dirs if d in f][0] for f in inputlist]
+        if await loop.run_in_executor(None, self._any_signed, inputlist):
+            await self._create_universal_file_from_copies(output, inputlist, prefixes)
+            return
+        # Relocate the universal file once, replacing the prefix of every
+        # architecture
+        await self._lipo(inputlist, output)
+        relocator = OSXRelocator(
+            self.output_root, prefixes[0], False, logfile=self.logfile, other_prefixes=prefixes[1:]
+        )
+        await loop.run_in_executor(None, relocator.relocate_file, output, inputlist[0])
+
+    async def _create_universal_file_from_copies(self, output, inputlist, prefixes):
+        # install_name_tool signs the files again, which might not work for
+        # a universal file, so relocate all files with the prefix of the
+        # merged file before merging them.
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_inputs = []
+            for i, (f, prefix) in enumerate(zip(inputlist, prefixes)):
+                # keep the filename to preserve the filename extension
+                tmp = os.path.join(tmpdir, str(i), os.path.basename(f))
+                os.makedirs(os.path.dirname(tmp))
+                shell.reflink_or_copy(f, tmp)
+                tmp_inputs.append(tmp)
+                relocator = OSXRelocator(self.output_root, prefix, False, logfile=self.logfile)
+                await loop.run_in_executor(None, relocator.relocate_file, tmp, f)
+            await self._lipo(tmp_inputs, output)
+
+    async def _lipo(self, inputlist, output):
+        cmd = [self.LIPO_CMD, '-create'] + inputlist + ['-output', output]
+        await shell.async_call(cmd, logfile=self.logfile, cpu_bound=False)
+
+    @staticmethod
+    def _any_signed(inputlist):
         for f in inputlist:
-            # keep the filename in the suffix to preserve the filename extension
-            tmp = tempfile.NamedTemporaryFile(suffix=os.path.basename(f))
-            tmp_inputs.append(tmp)
-            shutil.copy(f, tmp.name)
-            prefix_to_replace = [d for d in dirs if d in f][0]
-            relocator = OSXRelocator(self.output_root, prefix_to_replace, False, logfile=self.logfile)
-            relocator.relocate_file(tmp.name, f)
-        cmd = [self.LIPO_CMD, '-create'] + [f.name for f in tmp_inputs] + ['-output', output]
-        shell.new_call(cmd)
-        for tmp in tmp_inputs:
-            tmp.close()
-
-    def get_file_type(self, filepath):
-        return shell.check_output([self.FILE_CMD, '-bh', filepath])[:-1]  # remove trailing \n
+            if not is_mach_o(f):
+                continue
+            try:
+                with MachO(f) as macho:
+                    if macho.has_code_signature():
+                        return True
+            except MachOError:
+                return True
+        return False
 
     async def _detect_merge_action(self, files_list):
-        actions = []
+        actions = {}
         for f in files_list:
-            if not os.path.exists(f):
+            if not os.path.lexists(f):
                 continue  # TODO what can we do here? fontconfig has
                 # some random generated filenames it seems
-            ftype = self.get_file_type(f)
-            action = ''
-            for ft in file_types:
-                if ft[0] in ftype:
-                    if ft[0] == 'text' and f.endswith('.pc'):
-                        action = 'copy-pc'
-                    else:
-                        action = ft[1]
-                    break
-            if not action:
-                # Sometimes `file` barfs on header files, so fallback to a copy
-                if f.endswith('.h'):
-                    action = 'copy'
-                else:
-                    raise Exception('Unexpected file type %s %s' % (str(ftype), f))
-            actions.append(action)
+            actions[f] = get_merge_action(f)
         if len(actions) == 0:
             return 'skip'  # we should skip this one, the file doesn't exist
-        all_same = all(x == actions[0] for x in actions)
-        if not all_same:
-            raise Exception('Different file types found: %s : %s' % (str(ftype), str(files_list)))
-        return actions[0]
+        if len(set(actions.values())) != 1:
+            raise Exception('Different file types found: %s' % str(actions))
+        return list(actions.values())[0]
 
     async def do_merge(self, filepath, dirs):
         full_filepaths = [os.path.join(d, filepath) for d in dirs]
@@ -181,8 +202,7 @@ class OSXUniversalGenerator(object):
         elif action == 'link':
             self._link(current_file, output_file, filepath)
         elif action == 'merge':
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
+            os.makedirs(output_dir, exist_ok=True)
             await self.create_universal_file(output_file, full_filepaths, dirs)
         elif action == 'skip':
             pass  # just pass
@@ -236,8 +256,7 @@ class OSXUniversalGenerator(object):
         run_until_complete(parse_dirs_main())
 
     def _copy(self, src, dest):
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
         shutil.copy(src, dest)
 
     def _copy_and_replace_paths(self, src, dest, dirs):
@@ -248,8 +267,7 @@ class OSXUniversalGenerator(object):
         shell.replace(dest, replacements)
 
     def _link(self, src, dest, filepath):
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
         if os.path.lexists(dest):
             return  # link exists, skip it
 
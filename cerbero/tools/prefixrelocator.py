@@ -0,0 +1,167 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import mmap
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cerbero.tools.macho import MachO, MachOError, is_mach_o
+from cerbero.tools.osxrelocator import OSXRelocator
+from cerbero.utils import messages as m
+
+
+# Like grep -I, files with a NUL byte at the beginning are binary files
+BINARY_CHECK_SIZE = 32 * 1024
+# Smaller files are read at once, bigger ones are mapped in memory
+MMAP_MIN_SIZE = 1024 * 1024
+
+
+class PrefixRelocator(object):
+    """
+    Relocates a prefix moved from other paths, rewriting in-process the
+    text files and the load commands of the Mach-O files that reference
+    them, using a pool of worker threads.
+    """
+
+    def __init__(self, old_paths, new_path, jobs=None, logfile=None):
+        """
+        @param old_paths: paths the prefix was in, replaced in order
+        @type old_paths: list
+        @param new_path: the new path of the prefix
+        @type new_path: str
+        @param jobs: number of worker threads
+        @type jobs: int
+        """
+        self.old_paths = old_paths
+        self.new_path = new_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.logfile = logfile
+        self._replacements = [(p.encode('utf-8'), new_path.encode('utf-8')) for p in old_paths]
+
+    @staticmethod
+    def list_files(dirs):
+        # Regular files, without following symlinks
+        files = []
+        pending = list(dirs)
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+        return files
+
+    def _needs_relocation(self, data):
+        if not any(data.find(old) != -1 for old, _ in self._replacements):
+            return False
+        return data.find(b'\0', 0, BINARY_CHECK_SIZE) == -1
+
+    def relocate_text_file(self, path):
+        """
+        Replaces the old paths in a text file
+
+        @return: whether the file was changed
+        @rtype: bool
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return False
+            if size < MMAP_MIN_SIZE:
+                data = f.read()
+                if not self._needs_relocation(data):
+                    return False
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if not self._needs_relocation(mm):
+                        return False
+                    data = mm[:]
+        for old, new in self._replacements:
+            data = data.replace(old, new)
+        tmp = path + '.cerbero-relocate'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+        return True
+
+    def relocate_mach_o_file(self, path):
+        """
+        Replaces the old paths in the dylib and rpath load commands of a
+        Mach-O file
+
+        @return: whether the file was changed
+        @rtype: bool
+        """
+        if not is_mach_o(path):
+            return False
+        try:
+            with MachO(path, writable=True) as macho:
+                # Editing the load commands invalidates the signature, while
+                # install_name_tool signs the file again
+                if not macho.has_code_signature():
+                    count = 0
+                    for old in self.old_paths:
+                        count += macho.replace_prefix(old, self.new_path)
+                    return count > 0
+        except MachOError as ex:
+            # No room to grow the load commands, which install_name_tool
+            # might still manage by rewriting the file
+            m.log('Falling back to install_name_tool for %s: %s' % (path, ex), self.logfile)
+        relocator = OSXRelocator(os.path.dirname(path), self.new_path, False, logfile=self.logfile)
+        return relocator.replace_prefixes(path, self.old_paths, self.new_path)
+
+    def _run(self, func, files, what):
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            changed = sum(executor.map(func, files))
+        elapsed = time.monotonic() - start
+        rate = len(files) / elapsed if elapsed > 0 else len(files)
+        m.message(
+            'Relocated %d of %d %s in %.2fs (%.0f files/s, %d workers)'
+            % (changed, len(files), what, elapsed, rate, self.jobs)
+        )
+        return changed
+
+    def relocate_text_files(self, dirs):
+        """
+        Relocates all the text files in the given directories
+
+        @param dirs: directories scanned recursively
+        @type dirs: list
+        @return: the number of files changed
+        @rtype: int
+        """
+        return self._run(self.relocate_text_file, self.list_files(dirs), 'files')
+
+    def relocate_mach_o_files(self, dirs):
+        """
+        Relocates all the Mach-O files in the given directories
+
+        @param dirs: directories scanned recursively
+        @type dirs: list
+        @return: the number of files changed
+        @rtype: int
+        """
+        return self._run(self.relocate_mach_o_file, self.list_files(dirs), 'Mach-O files')
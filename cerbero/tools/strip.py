@@ -17,9 +17,121 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import asyncio
 import os
+import struct
+
 from cerbero.config import Platform
-from cerbero.utils import shell, run_until_complete, messages as m
+from cerbero.tools.macho import _is_mach_o_header
+from cerbero.utils import shell, run_until_complete, determine_num_of_cpus, messages as m
+
+
+ELF_MAGIC = b'\x7fELF'
+AR_MAGIC = b'!<arch>\n'
+PE_MAGIC = b'MZ'
+
+STRIP = 'strip'
+STRIPPED = 'stripped'
+
+
+def binary_format(path):
+    """
+    Finds out the format of a binary from its magic bytes
+
+    @param path: path of the file
+    @type path: str
+    @return: 'elf', 'mach-o', 'pe' or 'ar', or None if it's not a binary
+    @rtype: str
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+    except OSError:
+        return None
+    if header.startswith(ELF_MAGIC):
+        return 'elf'
+    if header.startswith(AR_MAGIC):
+        return 'ar'
+    if header.startswith(PE_MAGIC):
+        return 'pe'
+    if _is_mach_o_header(header):
+        return 'mach-o'
+    return None
+
+
+def elf_is_stripped(path):
+    """
+    Checks if an ELF file has no symbol table nor debug sections left to
+    strip, reading its section headers
+
+    @param path: path of the ELF file
+    @type path: str
+    @return: whether the file is stripped, False if unknown
+    @rtype: bool
+    """
+    try:
+        with open(path, 'rb') as f:
+            ident = f.read(16)
+            if len(ident) < 16 or not ident.startswith(ELF_MAGIC) or ident[4] not in (1, 2):
+                return False
+            endian = '<' if ident[5] == 1 else '>'
+            if ident[4] == 2:
+                header = f.read(48)
+                shoff, shentsize, shnum, shstrndx = struct.unpack(endian + '24xQ10xHHH', header)
+            else:
+                header = f.read(36)
+                shoff, shentsize, shnum, shstrndx = struct.unpack(endian + '16xI10xHHH', header)
+            if shnum == 0 or shstrndx >= shnum:
+                # Extended numbering or no sections
+                return False
+            f.seek(shoff)
+            table = f.read(shnum * shentsize)
+            sections = []
+            for i in range(shnum):
+                entry = table[i * shentsize : (i + 1) * shentsize]
+                if ident[4] == 2:
+                    name, stype, _, _, offset, size = struct.unpack_from(endian + 'IIQQQQ', entry)
+                else:
+                    name, stype, _, _, offset, size = struct.unpack_from(endian + 'IIIIII', entry)
+                sections.append((name, stype, offset, size))
+            _, _, strtab_offset, strtab_size = sections[shstrndx]
+            f.seek(strtab_offset)
+            strtab = f.read(strtab_size)
+    except (OSError, struct.error):
+        return False
+    for name, stype, _, _ in sections:
+        # SHT_SYMTAB
+        if stype == 2:
+            return False
+        sname = strtab[name : strtab.find(b'\0', name)]
+        if sname.startswith((b'.debug', b'.zdebug')):
+            return False
+    return True
+
+
+class StripStats(object):
+    """
+    Files stripped and the bytes saved
+
+    @ivar files: number of files stripped
+    @type files: int
+    @ivar skipped: number of binaries that were already stripped
+    @type skipped: int
+    @ivar saved: bytes saved
+    @type saved: int
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.saved = 0
+
+    def __str__(self):
+        return '%d files stripped (%d already stripped), %.1f MiB saved' % (
+            self.files,
+            self.skipped,
+            self.saved / (1024 * 1024),
+        )
 
 
 class Strip(object):
@@ -27,15 +139,43 @@ class Strip(object):
     Wrapper for the strip tool.
     Warning: This wrapper should never be used for msvc-built binaries since it usually corrupts them.
     Please, check using_msvc == False.
+
+    Only binaries are stripped, found by their magic bytes, skipping the
+    ELF files already stripped. Files are stripped in parallel by a bounded
+    number of workers.
     """
 
-    def __init__(self, config, excludes=None, keep_symbols=None):
+    def __init__(self, config, excludes=None, keep_symbols=None, jobs=None):
         self.config = config
         self.excludes = excludes or []
         self.keep_symbols = keep_symbols or []
+        self.jobs = jobs or determine_num_of_cpus()
         self.build_env = self.config.get_build_env()
         self.strip_cmd = self.build_env.get('STRIP', 'strip')
 
+    def _classify(self, path):
+        for f in self.excludes:
+            if f in path:
+                return None
+        if os.path.islink(path):
+            return None
+        fmt = binary_format(path)
+        if fmt is None:
+            return None
+        if fmt == 'elf' and elf_is_stripped(path):
+            return STRIPPED
+        return STRIP
+
+    def needs_strip(self, path):
+        """
+        Whether a file is a binary that can be stripped
+
+        @param path: path of the file
+        @type path: str
+        @rtype: bool
+        """
+        return self._classify(path) == STRIP
+
     async def async_strip_file(self, path):
         if not self.strip_cmd:
             m.warning('Strip command is not defined')
@@ -62,13 +202,52 @@ class Strip(object):
     def strip_file(self, path):
         run_until_complete(self.async_strip_file(path))
 
-    def strip_dir(self, dir_path):
+    async def async_strip_files(self, paths):
+        """
+        Strips the binaries among the given files
+
+        @param paths: paths of the files
+        @type paths: list
+        @return: the files stripped and the bytes saved
+        @rtype: L{StripStats}
+        """
+        stats = StripStats()
         if not self.strip_cmd:
             m.warning('Strip command is not defined')
-            return
+            return stats
+        # Only the first bytes of the files are read, in a thread to not
+        # block the event loop
+        loop = asyncio.get_event_loop()
+        classes = await loop.run_in_executor(None, lambda: [self._classify(p) for p in paths])
+        pending = [p for p, c in zip(paths, classes) if c == STRIP]
+        stats.skipped = classes.count(STRIPPED)
+        pending.reverse()
+
+        async def worker():
+            while pending:
+                path = pending.pop()
+                size = os.path.getsize(path)
+                await self.async_strip_file(path)
+                stats.files += 1
+                stats.saved += size - os.path.getsize(path)
+
+        await asyncio.gather(*[worker() for _ in range(min(self.jobs, len(pending)))])
+        return stats
+
+    def strip_files(self, paths):
+        return run_until_complete(self.async_strip_files(paths))
+
+    def strip_dir(self, dir_path):
+        """
+        Strips the binaries in a directory and its subdirectories
 
-        tasks = []
+        @param dir_path: the directory
+        @type dir_path: str
+        @return: the files stripped and the bytes saved
+        @rtype: L{StripStats}
+        """
+        paths = []
         for dirpath, dirnames, filenames in os.walk(dir_path):
             for f in filenames:
-                tasks.append(self.async_strip_file(os.path.join(dirpath, f)))
-        run_until_complete(tasks)
+                paths.append(os.path.join(dirpath, f))
+        return self.strip_files(paths)
@@ -155,6 +155,19 @@ def determine_total_ram() -> int:
     return 4 << 30  # Assume 4GB
 
 
+def determine_available_ram() -> int:
+    """Amount of RAM available for new processes without swapping, in bytes.
+    Only known on Linux, the total RAM is returned elsewhere"""
+
+    proc_meminfo = Path('/proc/meminfo')
+    if system_info()[0] == Platform.LINUX and proc_meminfo.exists():
+        with proc_meminfo.open() as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    return determine_total_ram()
+
+
 def to_winpath(path):
     if path.startswith('/'):
         ppath = pathlib.PurePath(path)
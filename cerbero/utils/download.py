@@ -0,0 +1,528 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+Downloads files over HTTP(S) in-process, reusing keep-alive connections to
+the same host, resuming interrupted downloads and splitting big files in
+ranges downloaded in parallel. The SHA-256 of the file is computed while it
+is written.
+
+An interrupted download is kept in C{<dest>.partial}, with the ranges
+already downloaded in C{<dest>.partial.json}.
+"""
+
+import asyncio
+import collections
+import hashlib
+import http.client
+import json
+import os
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from cerbero.enums import CERBERO_VERSION
+from cerbero.errors import DownloadError, FatalError
+from cerbero.utils import shell
+from cerbero.utils import messages as m
+
+
+PARTIAL_EXT = '.partial'
+STATE_EXT = '.partial.json'
+# Maximum number of ranges downloaded in parallel for a file
+DEFAULT_JOBS = 4
+# Files are only split in ranges of at least this size
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+# The progress of the ranges is saved each time this is downloaded
+CHECKPOINT_SIZE = 8 * 1024 * 1024
+TIMEOUT = 20
+RETRIES = 2
+MAX_REDIRECTS = 10
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+USER_AGENT = 'GStreamerCerbero/' + CERBERO_VERSION
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class UnsupportedURL(Exception):
+    """
+    Raised for the URLs that must be downloaded with L{shell.download}
+    """
+
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Idle keep-alive connections for each host, shared by all the downloads
+    """
+
+    def __init__(self, max_idle=DEFAULT_JOBS, timeout=TIMEOUT):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, parts, check_cert=True):
+        """
+        Gets a connection to the host of a URL
+
+        @param parts: the split URL
+        @type parts: L{urllib.parse.SplitResult}
+        @param check_cert: whether to check the certificate of the host
+        @type check_cert: bool
+        @return: the key of the connection in the pool, the connection and
+                 whether it was reused
+        @rtype: tuple
+        """
+        key = (parts.scheme, parts.hostname, parts.port, check_cert)
+        with self._lock:
+            if self._idle[key]:
+                return key, self._idle[key].pop(), True
+        if parts.scheme == 'https':
+            context = ssl.create_default_context()
+            if not check_cert:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=self.timeout, context=context)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self.timeout)
+        return key, conn, False
+
+    def put(self, key, conn):
+        """
+        Gives back a connection whose last response was read completely
+        """
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+class Segment(object):
+    """
+    A range of the file, from start to end (excluded), downloaded up to pos
+    """
+
+    __slots__ = ['start', 'pos', 'end']
+
+    def __init__(self, start, pos, end):
+        self.start = start
+        self.pos = pos
+        self.end = end
+
+    def done(self):
+        return self.pos >= self.end
+
+
+class FileDownload(object):
+    """
+    Download of a URL to a file
+    """
+
+    def __init__(self, downloader, url, dest, logfile=None):
+        self.downloader = downloader
+        self.url = url
+        self.dest = dest
+        self.partial = dest + PARTIAL_EXT
+        self.state_path = dest + STATE_EXT
+        self.logfile = logfile
+        self.size = None
+        self.validator = None
+        self.segments = []
+        self._lock = threading.Lock()
+        self._hash_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+
+    def _headers(self, first=None, last=None):
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+        if first is not None:
+            headers['Range'] = 'bytes=%d-%s' % (first, '' if last is None else last)
+            if self.validator:
+                headers['If-Range'] = self.validator
+        return headers
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            # The fallback URLs share the partial download of the first one
+            if state['url'] != self.url or os.path.getsize(self.partial) != state['size']:
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        self.size = state['size']
+        self.validator = state.get('validator')
+        self.segments = [Segment(*s) for s in state['segments']]
+        return True
+
+    def _save_state(self):
+        with self._lock:
+            state = {
+                'url': self.url,
+                'size': self.size,
+                'validator': self.validator,
+                'segments': [[s.start, s.pos, s.end] for s in self.segments],
+            }
+        with self._state_lock:
+            with open(self.state_path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _remove_state(self):
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def _plan_segments(self, jobs):
+        count = max(1, min(jobs, self.size // MIN_RANGE_SIZE))
+        step = -(-self.size // count)
+        self.segments = [Segment(start, start, min(start + step, self.size)) for start in range(0, self.size, step)]
+
+    def _frontier(self):
+        # End of the data written contiguously from the beginning of the file
+        for s in self.segments:
+            if not s.done():
+                return s.pos
+        return self.size
+
+    def _advance_hash(self, offset=None, data=None, wait=False):
+        # Only one thread hashes at a time, the others just write
+        if not self._hash_lock.acquire(blocking=wait):
+            return
+        try:
+            if data is not None and offset == self._hashed:
+                self._hasher.update(data)
+                self._hashed += len(data)
+            with self._lock:
+                frontier = self._frontier()
+            if frontier <= self._hashed:
+                return
+            with open(self.partial, 'rb') as f:
+                f.seek(self._hashed)
+                while self._hashed < frontier:
+                    block = f.read(min(CHUNK_SIZE, frontier - self._hashed))
+                    if not block:
+                        break
+                    self._hasher.update(block)
+                    self._hashed += len(block)
+        finally:
+            self._hash_lock.release()
+
+    def _request(self, headers):
+        # Sends a GET request following the redirects
+        url = self.url
+        for _ in range(MAX_REDIRECTS):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            while True:
+                key, conn, reused = self.downloader.pool.get(parts, self.downloader.check_cert)
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    # The server might have closed an idle connection
+                    if not reused:
+                        raise
+            if response.status not in REDIRECT_STATUS:
+                return key, conn, response
+            location = response.getheader('Location')
+            self._release(key, conn, response, drain=True)
+            if not location:
+                raise DownloadError('Redirect without location for %s' % url, retry=False)
+            url = urllib.parse.urljoin(url, location)
+        raise DownloadError('Too many redirects for %s' % self.url, retry=False)
+
+    def _release(self, key, conn, response, drain=False):
+        if drain:
+            response.read()
+        if response.isclosed() and not response.will_close:
+            self.downloader.pool.put(key, conn)
+        else:
+            conn.close()
+
+    def _check_status(self, response):
+        if response.status >= 400:
+            retry = response.status >= 500 or response.status in (408, 429)
+            raise DownloadError('%s returned %d %s' % (self.url, response.status, response.reason), retry=retry)
+
+    def _read_segment(self, segment, response):
+        # Unbuffered, so that the data written is visible to the thread
+        # hashing from the file
+        with open(self.partial, 'r+b', buffering=0) as f:
+            f.seek(segment.pos)
+            checkpoint = segment.pos + CHECKPOINT_SIZE
+            while segment.pos < segment.end:
+                data = response.read(min(CHUNK_SIZE, segment.end - segment.pos))
+                if not data:
+                    raise DownloadError('Connection closed downloading %s' % self.url)
+                view = memoryview(data)
+                while view:
+                    view = view[f.write(view) :]
+                offset = segment.pos
+                with self._lock:
+                    segment.pos += len(data)
+                self._advance_hash(offset, data)
+                if segment.pos >= checkpoint:
+                    self._save_state()
+                    checkpoint = segment.pos + CHECKPOINT_SIZE
+
+    def _fetch_segment(self, segment, key=None, conn=None, response=None):
+        retries = self.downloader.retries
+        while not segment.done():
+            try:
+                if response is None:
+                    key, conn, response = self._request(self._headers(segment.pos, segment.end - 1))
+                    self._check_status(response)
+                    if response.status != 206:
+                        raise DownloadError('%s changed while downloading it' % self.url, retry=False)
+                self._read_segment(segment, response)
+            except (OSError, http.client.HTTPException, DownloadError) as ex:
+                if conn is not None:
+                    conn.close()
+                if retries == 0 or (isinstance(ex, DownloadError) and not ex.retry):
+                    raise
+                retries -= 1
+                m.log('Retrying the download of %s from byte %d: %s' % (self.url, segment.pos, ex), self.logfile)
+                key = conn = response = None
+                continue
+        if response is not None:
+            # Responses to open ranges have more data that won't be read
+            self._release(key, conn, response, drain=False)
+
+    def _stream(self, key, conn, response):
+        # Downloads a response without ranges
+        length = response.getheader('Content-Length')
+        with open(self.partial, 'wb') as f:
+            while True:
+                data = response.read(CHUNK_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                self._hasher.update(data)
+                self._hashed += len(data)
+        if length is not None and self._hashed != int(length):
+            conn.close()
+            raise DownloadError('Connection closed downloading %s' % self.url)
+        self._release(key, conn, response)
+
+    def run(self):
+        """
+        Downloads the file
+
+        @return: the SHA-256 of the file
+        @rtype: str
+        """
+        start_time = time.monotonic()
+        resumed = os.path.exists(self.partial) and self._load_state()
+        first_pending = next((s for s in self.segments if not s.done()), None) if resumed else None
+        try:
+            key, conn, response = self._request(self._headers(first_pending.pos if first_pending else 0))
+            if response.status == 416:
+                # The partial download doesn't match the file anymore
+                self._release(key, conn, response, drain=True)
+                self._remove_state()
+                key, conn, response = self._request(self._headers())
+        except ssl.SSLCertVerificationError:
+            raise
+        except (OSError, http.client.HTTPException) as ex:
+            raise DownloadError('Could not download %s: %s' % (self.url, ex))
+        self._check_status(response)
+        match = _CONTENT_RANGE.match(response.getheader('Content-Range', ''))
+        if response.status != 206 or not match:
+            # No ranges, or the file changed since the partial download
+            self._remove_state()
+            self.segments = []
+            try:
+                self._stream(key, conn, response)
+            except (OSError, http.client.HTTPException) as ex:
+                conn.close()
+                raise DownloadError('Could not download %s: %s' % (self.url, ex))
+        else:
+            self._download_ranges(key, conn, response, int(match.group(1)), int(match.group(3)), resumed)
+        os.replace(self.partial, self.dest)
+        self._remove_state()
+        elapsed = time.monotonic() - start_time
+        m.log(
+            'Downloaded %s (%.1f MiB) in %.1fs with %d ranges'
+            % (self.url, self._hashed / (1024 * 1024), elapsed, max(1, len(self.segments))),
+            self.logfile,
+        )
+        return self._hasher.hexdigest()
+
+    def _download_ranges(self, key, conn, response, first, size, resumed):
+        if resumed and size != self.size:
+            resumed = False
+        if resumed:
+            done = sum(s.pos - s.start for s in self.segments)
+            m.log('Resuming the download of %s from %d of %d bytes' % (self.url, done, size), self.logfile)
+        else:
+            self.size = size
+            self.validator = response.getheader('ETag') or response.getheader('Last-Modified')
+            self._plan_segments(self.downloader.jobs)
+            with open(self.partial, 'wb') as f:
+                f.truncate(self.size)
+        self._save_state()
+        # The first response is used for the segment it starts
+        pending = [s for s in self.segments if not s.done()]
+        first_segment = next((s for s in pending if s.pos == first), None)
+        if first_segment is None:
+            conn.close()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+                futures = []
+                for segment in pending:
+                    if segment is first_segment:
+                        futures.append(executor.submit(self._fetch_segment, segment, key, conn, response))
+                    else:
+                        futures.append(executor.submit(self._fetch_segment, segment))
+                for future in futures:
+                    future.result()
+        except (OSError, http.client.HTTPException) as ex:
+            raise DownloadError('Could not download %s: %s' % (self.url, ex))
+        finally:
+            self._save_state()
+        self._advance_hash(wait=True)
+
+
+class Downloader(object):
+    """
+    Downloads files with a pool of keep-alive connections
+
+    @ivar jobs: maximum number of ranges downloaded in parallel for a file
+    @type jobs: int
+    @ivar retries: number of times an interrupted range is resumed
+    @type retries: int
+    """
+
+    def __init__(self, jobs=DEFAULT_JOBS, retries=RETRIES, check_cert=True, pool=None):
+        self.jobs = jobs
+        self.retries = retries
+        self.check_cert = check_cert
+        self.pool = pool or ConnectionPool(max_idle=jobs)
+
+    @staticmethod
+    def check_url(url):
+        """
+        Checks if a URL can be downloaded in-process
+
+        @raise UnsupportedURL: if it must be downloaded with L{shell.download}
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise UnsupportedURL(url)
+        # http.client can't use proxies
+        if parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname):
+            raise UnsupportedURL(url)
+
+    def download(self, url, dest, logfile=None):
+        """
+        Downloads a URL to a file, resuming a previous partial download
+
+        @param url: the URL
+        @type url: str
+        @param dest: path of the file
+        @type dest: str
+        @return: the SHA-256 of the file
+        @rtype: str
+        """
+        self.check_url(url)
+        return FileDownload(self, url, dest, logfile).run()
+
+
+_downloaders = {}
+
+
+def get_downloader(check_cert=True):
+    """
+    @return: the downloader shared by all the downloads of the process
+    @rtype: L{Downloader}
+    """
+    if check_cert not in _downloaders:
+        _downloaders[check_cert] = Downloader(check_cert=check_cert)
+    return _downloaders[check_cert]
+
+
+async def download(url, dest, check_cert=True, overwrite=False, logfile=None, fallback_urls=None):
+    """
+    Downloads a file, trying the fallback URLs if it fails. URLs that can't be
+    downloaded in-process, because of their protocol or a proxy, are
+    downloaded with L{shell.download}.
+
+    @param url: url to download
+    @type url: str
+    @param dest: dest where the file will be saved
+    @type dest: str
+    @param check_cert: whether to check certificates or not
+    @type check_cert: bool
+    @param overwrite: whether to overwrite the dest or not
+    @type overwrite: bool
+    @param fallback_urls: URLs tried if the download fails
+    @type fallback_urls: list
+    @return: the SHA-256 of the file, or None if it wasn't computed
+    @rtype: str
+    """
+    if not overwrite and os.path.exists(dest):
+        m.log('File %s already downloaded.' % dest, logfile)
+        return None
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    downloader = get_downloader(check_cert)
+    loop = asyncio.get_event_loop()
+    errors = []
+    for murl in [url] + (fallback_urls or []):
+        m.log('Downloading {}'.format(murl), logfile)
+        try:
+            async with shell.NON_CPU_BOUND_SEMAPHORE:
+                return await loop.run_in_executor(None, downloader.download, murl, dest, logfile)
+        except UnsupportedURL:
+            pass
+        except ssl.SSLCertVerificationError:
+            # The Python certificate store might differ from the system's one
+            m.log('Could not verify the certificate of %s, using an external tool' % murl, logfile)
+        except DownloadError as ex:
+            m.log(str(ex), logfile)
+            errors.append((murl, ex))
+            continue
+        try:
+            await shell.download(murl, dest, check_cert, True, logfile)
+            return None
+        except FatalError as ex:
+            m.log(str(ex), logfile)
+            errors.append((murl, ex))
+    if len(errors) == 1:
+        errors = errors[0]
+    raise DownloadError('Failed to download {!r}: {!r}'.format(url, errors))
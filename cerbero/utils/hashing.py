@@ -0,0 +1,215 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+Hashes files in fixed-size chunks, memoizing the digests by the path, size,
+modification time and inode of the files, so that unchanged files are only
+read once. The memo can be persisted in a sidecar index file.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 1024 * 1024
+# Files modified less than this number of seconds before being hashed could
+# be modified again without changing their mtime, so their digest is not
+# memoized
+RACY_INTERVAL = 2
+INDEX_VERSION = 1
+
+_hasher = None
+
+
+def get_hasher():
+    """
+    @return: the hasher shared by the whole process
+    @rtype: L{FileHasher}
+    """
+    global _hasher
+    if _hasher is None:
+        _hasher = FileHasher()
+    return _hasher
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def _is_racy(stat_key, now):
+    return now - stat_key[1] / 1e9 < RACY_INTERVAL
+
+
+class FileHasher(object):
+    """
+    Computes digests of files, reading them in chunks of L{CHUNK_SIZE}.
+    hashlib releases the GIL while hashing, so files can be hashed in
+    parallel threads.
+
+    @ivar index_path: path of the sidecar index file, if any
+    @type index_path: str
+    """
+
+    def __init__(self, index_path=None):
+        """
+        @param index_path: path of the sidecar index file
+        @type index_path: str
+        """
+        self.index_path = None
+        self._memo = {}  # (algorithm, paths) -> (stat keys, hexdigest)
+        self._dirty = False
+        self._lock = threading.Lock()
+        if index_path is not None:
+            self.load_index(index_path)
+
+    def load_index(self, path):
+        """
+        Loads the digests memoized in a sidecar index file, which is also
+        where L{save_index} will write them
+
+        @param path: path of the index file
+        @type path: str
+        """
+        self.index_path = path
+        try:
+            with open(path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+            return
+        with self._lock:
+            for algorithm, paths, stat_keys, digest in index.get('entries', []):
+                self._memo.setdefault((algorithm, tuple(paths)), (stat_keys, digest))
+
+    def save_index(self):
+        """
+        Writes the memoized digests of the files that still exist to the
+        sidecar index file
+        """
+        if self.index_path is None or not self._dirty:
+            return
+        with self._lock:
+            memo = list(self._memo.items())
+            self._dirty = False
+        entries = []
+        for (algorithm, paths), (stat_keys, digest) in memo:
+            try:
+                if [_stat_key(p) for p in paths] != stat_keys:
+                    continue
+            except OSError:
+                continue
+            entries.append([algorithm, list(paths), stat_keys, digest])
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp = '%s.%d.tmp' % (self.index_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': entries}, f)
+        os.replace(tmp, self.index_path)
+
+    def _digest(self, algorithm, paths):
+        paths = tuple(os.path.abspath(p) for p in paths)
+        stat_keys = [_stat_key(p) for p in paths]
+        key = (algorithm, paths)
+        with self._lock:
+            cached = self._memo.get(key)
+        if cached is not None and cached[0] == stat_keys:
+            return cached[1]
+        h = hashlib.new(algorithm)
+        for path in paths:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    h.update(chunk)
+        digest = h.hexdigest()
+        # A file modified while being read would be hashed with the new
+        # stat, don't memoize it then
+        if [_stat_key(p) for p in paths] == stat_keys:
+            now = time.time()
+            with self._lock:
+                if any(_is_racy(k, now) for k in stat_keys):
+                    self._memo.pop(key, None)
+                else:
+                    self._memo[key] = (stat_keys, digest)
+                    self._dirty = True
+        return digest
+
+    def file_digest(self, path, algorithm='sha256'):
+        """
+        Gets the digest of a file
+
+        @param path: path of the file
+        @type path: str
+        @param algorithm: name of the hashlib algorithm
+        @type algorithm: str
+        @return: the hex digest
+        @rtype: str
+        """
+        return self._digest(algorithm, [path])
+
+    def files_digest(self, paths, algorithm='sha256'):
+        """
+        Gets the digest of the concatenated contents of several files
+
+        @param paths: paths of the files
+        @type paths: list
+        @param algorithm: name of the hashlib algorithm
+        @type algorithm: str
+        @return: the hex digest
+        @rtype: str
+        """
+        return self._digest(algorithm, paths)
+
+    def map(self, func, items, jobs=None):
+        """
+        Runs a function that hashes files for each item in a pool of threads
+
+        @param func: the function
+        @type func: function
+        @param items: items passed to the function
+        @type items: list
+        @param jobs: number of threads
+        @type jobs: int
+        @return: the results in the order of the items
+        @rtype: list
+        """
+        items = list(items)
+        jobs = min(jobs or os.cpu_count() or 1, len(items))
+        if jobs <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(func, items))
+
+    def file_digests(self, paths, algorithm='sha256', jobs=None):
+        """
+        Gets the digests of several files, hashed in parallel
+
+        @param paths: paths of the files
+        @type paths: list
+        @param algorithm: name of the hashlib algorithm
+        @type algorithm: str
+        @param jobs: number of threads
+        @type jobs: int
+        @return: the hex digest of each file
+        @rtype: list
+        """
+        return self.map(lambda p: self.file_digest(p, algorithm), paths, jobs)
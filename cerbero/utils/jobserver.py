@@ -0,0 +1,205 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+A GNU make jobserver shared by all the recipes being built, so that the
+number of jobs run by make, ninja and cargo is bounded for the whole build
+instead of for each recipe.
+
+Only the named pipe protocol is implemented, which is understood by
+GNU make >= 4.4, ninja >= 1.13 and cargo.
+"""
+
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+
+from cerbero.errors import FatalError
+from cerbero.utils import _, shell
+
+
+TOKEN = b'+'
+# First version of ninja that takes its jobs from a jobserver
+NINJA_CLIENT_VERSION = '1.13'
+# Command line arguments setting the number of jobs
+_JOBS_ARG = re.compile(r'^(-j\d*|--jobs(=\d+)?)$')
+
+_jobserver = None
+# Whether each ninja found is a client, keyed by its path
+_ninja_clients = {}
+
+
+def get_jobserver():
+    """
+    @return: the jobserver of the current build, if any
+    @rtype: L{Jobserver}
+    """
+    return _jobserver
+
+
+def set_jobserver(jobserver):
+    """
+    Sets the jobserver of the current build
+
+    @param jobserver: the jobserver or None
+    @type jobserver: L{Jobserver}
+    """
+    global _jobserver
+    _jobserver = jobserver
+
+
+def is_client(cmd, env):
+    """
+    Checks whether a command takes its jobs from the jobserver. ninja only
+    does since version 1.13, older ones must keep their number of jobs.
+
+    @param cmd: the command
+    @type cmd: list
+    @param env: the environment the command runs with
+    @type env: dict
+    @return: whether it's a client of the jobserver
+    @rtype: bool
+    """
+    args = cmd.split() if isinstance(cmd, str) else cmd
+    if not args or os.path.splitext(os.path.basename(args[0]))[0] != 'ninja':
+        return True
+    tool = shutil.which(args[0], path=env.get('PATH'))
+    if tool not in _ninja_clients:
+        _, _, newer = shell.check_tool_version(args[0], NINJA_CLIENT_VERSION, env)
+        _ninja_clients[tool] = newer
+    return _ninja_clients[tool]
+
+
+def strip_jobs(cmd):
+    """
+    Removes the arguments setting the number of jobs of a command, with
+    which clients would ignore the jobserver
+
+    @param cmd: the command
+    @type cmd: list
+    @return: the command without the arguments
+    @rtype: list
+    """
+    if isinstance(cmd, str):
+        return cmd
+    stripped = []
+    skip = False
+    for arg in cmd:
+        if skip:
+            skip = False
+            if arg.isdigit():
+                continue
+        if _JOBS_ARG.match(arg):
+            # '-j 4' or '--jobs 4'
+            skip = arg in ('-j', '--jobs')
+            continue
+        stripped.append(arg)
+    return stripped
+
+
+class Jobserver(object):
+    """
+    Hosts a jobserver with a number of slots. Each client running is entitled
+    to a job without a token, so the Oven takes a slot before starting each
+    client and the client takes one more for each extra job it runs.
+
+    @ivar slots: number of slots
+    @type slots: int
+    @ivar path: path of the named pipe with the tokens
+    @type path: str
+    """
+
+    def __init__(self, slots):
+        """
+        @param slots: number of slots
+        @type slots: int
+        """
+        if not self.supported():
+            raise FatalError(_('A jobserver is not supported on this platform'))
+        self.slots = max(slots, 1)
+        self._tmpdir = tempfile.mkdtemp(prefix='cerbero-jobserver-')
+        self.path = os.path.join(self._tmpdir, 'fifo')
+        os.mkfifo(self.path, 0o600)
+        # Opening the reading end first doesn't block, and keeping both open
+        # ensures clients never see the pipe closed
+        self._rfd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self._wfd = os.open(self.path, os.O_WRONLY)
+        os.write(self._wfd, TOKEN * self.slots)
+
+    @staticmethod
+    def supported():
+        return hasattr(os, 'mkfifo')
+
+    def makeflags(self):
+        """
+        @return: the MAKEFLAGS advertising the jobserver to the clients
+        @rtype: str
+        """
+        return '-j%d --jobserver-auth=fifo:%s' % (self.slots, self.path)
+
+    def client_env(self, env):
+        """
+        Gets the environment for a client of the jobserver
+
+        @param env: the environment of the client
+        @type env: dict
+        @return: a copy of the environment with the jobserver
+        @rtype: dict
+        """
+        env = env.copy()
+        env['MAKEFLAGS'] = self.makeflags()
+        env['CARGO_MAKEFLAGS'] = env['MAKEFLAGS']
+        return env
+
+    async def acquire(self):
+        """
+        Takes a slot, waiting until there's a free one
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                if os.read(self._rfd, 1):
+                    return
+            except BlockingIOError:
+                pass
+            readable = loop.create_future()
+            loop.add_reader(self._rfd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(self._rfd)
+
+    def release(self):
+        """
+        Gives back a slot taken with L{acquire}
+        """
+        os.write(self._wfd, TOKEN)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *args):
+        self.release()
+
+    def close(self):
+        for fd in (self._rfd, self._wfd):
+            os.close(fd)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
@@ -28,29 +28,56 @@ import tempfile
 import time
 import glob
 import shutil
-import hashlib
 import collections
+import contextlib
+import contextvars
+import signal
+import concurrent.futures
 from pathlib import Path, PurePath
 
 from cerbero.enums import CERBERO_VERSION, Platform, Distro
 from cerbero.utils import _, system_info, split_version, CerberoSemaphore
 from cerbero.utils import messages as m
 from cerbero.utils import to_winpath
+from cerbero.utils import hashing
 from cerbero.errors import CommandError, FatalError
 
 
 PATCH = 'patch'
 TAR = 'tar'
 HOMEBREW_TAR = 'gtar'
-TARBALL_SUFFIXES = ('tar.gz', 'tgz', 'tar.bz2', 'tbz2', 'tar.xz')
+TARBALL_SUFFIXES = ('tar.gz', 'tgz', 'tar.bz2', 'tbz2', 'tar.xz', 'tar.zst')
+# Buffer size used to stream tarballs to and from the compressors
+TAR_STREAM_BUFSIZE = 1024 * 1024
+
+TarCompressor = collections.namedtuple('TarCompressor', ['suffix', 'compress', 'decompress', 'levels'])
+# Compressors that can be used to stream tarballs using all the CPU cores.
+# They read from stdin and write to stdout.
+TAR_COMPRESSORS = {
+    'xz': TarCompressor('tar.xz', ['xz', '--threads=0', '-c'], ['xz', '--threads=0', '-d', '-c'], range(0, 10)),
+    'zstd': TarCompressor('tar.zst', ['zstd', '-T0', '-q', '-c'], ['zstd', '-d', '-q', '-c'], range(1, 20)),
+}
+# ioctl cloning a file on Linux
+FICLONE = 0x40049409
 SUBPROCESS_EXCEPTIONS = (FileNotFoundError, PermissionError, subprocess.CalledProcessError)
 
 info = system_info()
 PLATFORM = info[0]
 DISTRO = info[2]
-CPU_BOUND_SEMAPHORE = CerberoSemaphore(info[4])
-NON_CPU_BOUND_SEMAPHORE = CerberoSemaphore(2)
+MAX_CPU_BOUND_CALLS = info[4]
+MAX_NON_CPU_BOUND_CALLS = 2
+CPU_BOUND_SEMAPHORE = CerberoSemaphore(MAX_CPU_BOUND_CALLS)
+NON_CPU_BOUND_SEMAPHORE = CerberoSemaphore(MAX_NON_CPU_BOUND_CALLS)
 DRY_RUN = False
+# Record the resources used by the commands run with async_call() and
+# async_call_output(), see account_processes()
+PROCESS_ACCOUNTING = False
+
+# ProcessUsage objects the commands run in the current context are
+# accounted to
+_process_usage = contextvars.ContextVar('cerbero_process_usage', default=())
+# Threads waiting for the accounted commands, one per concurrent call
+_wait4_executor = None
 
 
 def _fix_mingw_cmd(path):
@@ -94,14 +121,158 @@ def _cmd_string_to_array(cmd, env):
     return ['sh', '-c', cmd]
 
 
+class ProcessUsage(object):
+    """
+    Resources used by child processes
+
+    @ivar count: number of processes
+    @type count: int
+    @ivar wall: wall time in seconds
+    @type wall: float
+    @ivar utime: user CPU time in seconds
+    @type utime: float
+    @ivar stime: system CPU time in seconds
+    @type stime: float
+    @ivar maxrss: peak resident set size in bytes of the biggest process,
+                  0 if unknown
+    @type maxrss: int
+    """
+
+    __slots__ = ['count', 'wall', 'utime', 'stime', 'maxrss']
+
+    def __init__(self, count=0, wall=0.0, utime=0.0, stime=0.0, maxrss=0):
+        self.count = count
+        self.wall = wall
+        self.utime = utime
+        self.stime = stime
+        self.maxrss = maxrss
+
+    @classmethod
+    def from_rusage(cls, wall, rusage):
+        """
+        @param wall: wall time of the process
+        @type wall: float
+        @param rusage: resource usage returned by os.wait4(), None if unknown
+        @type rusage: L{resource.struct_rusage}
+        """
+        if rusage is None:
+            return cls(1, wall)
+        # Linux reports the RSS in kilobytes and macOS in bytes
+        maxrss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        return cls(1, wall, rusage.ru_utime, rusage.ru_stime, maxrss)
+
+    def add(self, other):
+        self.count += other.count
+        self.wall += other.wall
+        self.utime += other.utime
+        self.stime += other.stime
+        self.maxrss = max(self.maxrss, other.maxrss)
+
+    def __str__(self):
+        return '%d processes, wall %.1fs, user %.1fs, sys %.1fs, peak RSS %.1f MiB' % (
+            self.count,
+            self.wall,
+            self.utime,
+            self.stime,
+            self.maxrss / (1024 * 1024),
+        )
+
+
+@contextlib.contextmanager
+def account_processes(usage):
+    """
+    Accounts the resources used by the commands run with async_call() and
+    async_call_output() in the context, and in the tasks created from it, to
+    a L{ProcessUsage}. Contexts can be nested. Nothing is recorded unless
+    PROCESS_ACCOUNTING is enabled.
+
+    @param usage: the usage to add the resources to
+    @type usage: L{ProcessUsage}
+    """
+    token = _process_usage.set(_process_usage.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        _process_usage.reset(token)
+
+
+def _get_wait4_executor():
+    global _wait4_executor
+    if _wait4_executor is None:
+        _wait4_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MAX_CPU_BOUND_CALLS + MAX_NON_CPU_BOUND_CALLS, thread_name_prefix='cerbero-wait4'
+        )
+    return _wait4_executor
+
+
+def _reset_wait4_executor():
+    global _wait4_executor
+    if _wait4_executor is not None:
+        _wait4_executor.shutdown(wait=False)
+        _wait4_executor = None
+
+
+def _wait4(proc):
+    # asyncio reaps its children with waitpid(), which discards their
+    # resource usage, so they are spawned with Popen and waited with wait4()
+    output = None
+    if proc.stdout is not None:
+        with proc.stdout:
+            output = proc.stdout.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, output, rusage
+
+
+async def _run_process(cmd, cmd_dir, env, stdout, stderr):
+    # Runs a command and returns its exit code and output, accounting the
+    # resources it used
+    sinks = _process_usage.get() if PROCESS_ACCOUNTING else ()
+    start = time.monotonic()
+    if sinks and hasattr(os, 'wait4'):
+        loop = asyncio.get_event_loop()
+        proc = subprocess.Popen(cmd, cwd=cmd_dir, stdout=stdout, stderr=stderr, stdin=subprocess.DEVNULL, env=env)
+        future = loop.run_in_executor(_get_wait4_executor(), _wait4, proc)
+        try:
+            returncode, output, rusage = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Don't leave the command running. It's killed with os.kill()
+            # because Popen.kill() could reap it before wait4() does.
+            if not future.done():
+                try:
+                    os.kill(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            await future
+            raise
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=cmd_dir, stdout=stdout, stderr=stderr, stdin=subprocess.DEVNULL, env=env
+        )
+        output, _ = await proc.communicate()
+        returncode, rusage = proc.returncode, None
+    if sinks:
+        usage = ProcessUsage.from_rusage(time.monotonic() - start, rusage)
+        for sink in sinks:
+            sink.add(usage)
+    return returncode, output
+
+
 def set_max_cpu_bound_calls(number):
-    global CPU_BOUND_SEMAPHORE
+    global CPU_BOUND_SEMAPHORE, MAX_CPU_BOUND_CALLS
+    MAX_CPU_BOUND_CALLS = number
     CPU_BOUND_SEMAPHORE = CerberoSemaphore(number)
+    _reset_wait4_executor()
 
 
 def set_max_non_cpu_bound_calls(number):
-    global NON_CPU_BOUND_SEMAPHORE
+    global NON_CPU_BOUND_SEMAPHORE, MAX_NON_CPU_BOUND_CALLS
+    MAX_NON_CPU_BOUND_CALLS = number
     NON_CPU_BOUND_SEMAPHORE = CerberoSemaphore(number)
+    _reset_wait4_executor()
 
 
 def call(cmd, cmd_dir='.', fail=True, verbose=False, logfile=None, env=None):
@@ -276,17 +447,14 @@ async def async_call(cmd, cmd_dir='.', fail=True, logfile=None, cpu_bound=True,
         # Force python scripts to print their output on newlines instead
         # of on exit. Ensures that we get continuous output in log files.
         env['PYTHONUNBUFFERED'] = '1'
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, cwd=cmd_dir, stderr=subprocess.STDOUT, stdout=stream, stdin=subprocess.DEVNULL, env=env
-        )
-        await proc.wait()
-        if proc.returncode != 0 and fail:
+        returncode, _ = await _run_process(cmd, cmd_dir, env, stream, subprocess.STDOUT)
+        if returncode != 0 and fail:
             msg = ''
             if stream:
                 msg = 'Output in logfile {}'.format(logfile.name)
-            raise CommandError(msg, cmd, proc.returncode)
+            raise CommandError(msg, cmd, returncode)
 
-        return proc.returncode
+        return returncode
 
 
 async def async_call_output(cmd, cmd_dir=None, logfile=None, cpu_bound=True, env=None):
@@ -322,10 +490,7 @@ async def async_call_output(cmd, cmd_dir=None, logfile=None, cpu_bound=True, env
             # used instead.
             tempfile.tempdir = str(PurePath(tempfile.gettempdir()))
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, cwd=cmd_dir, stdout=subprocess.PIPE, stderr=logfile, stdin=subprocess.DEVNULL, env=env
-        )
-        (output, unused_err) = await proc.communicate()
+        returncode, output = await _run_process(cmd, cmd_dir, env, subprocess.PIPE, logfile)
 
         if PLATFORM == Platform.WINDOWS:
             os.path.join = cerbero.hacks.join
@@ -335,8 +500,8 @@ async def async_call_output(cmd, cmd_dir=None, logfile=None, cpu_bound=True, env
         elif isinstance(output, bytes):
             output = output.decode()
 
-        if proc.returncode != 0:
-            raise CommandError(output, cmd, proc.returncode)
+        if returncode != 0:
+            raise CommandError(output, cmd, returncode)
 
         return output
 
@@ -356,6 +521,138 @@ def apply_patch(patch, directory, strip=1, logfile=None):
     new_call([PATCH, f'-p{strip}', '-f', '-i', patch], cmd_dir=directory, logfile=logfile)
 
 
+def tar_compressor_for(filepath):
+    """
+    Gets the name of the compressor of a tarball from its extension
+
+    @param filepath: path of the tarball
+    @type filepath: str
+    @return: the compressor name or None if it's not known
+    @rtype: str
+    """
+    for name, compressor in TAR_COMPRESSORS.items():
+        if filepath.endswith(compressor.suffix):
+            return name
+    return None
+
+
+def compress_cmd(codec, level=None):
+    """
+    Gets the command used to compress from stdin to stdout
+
+    @param codec: the compressor, one of L{TAR_COMPRESSORS}
+    @type codec: str
+    @param level: compression level, the compressor default if None
+    @type level: int
+    @return: the command
+    @rtype: list
+    """
+    if codec not in TAR_COMPRESSORS:
+        raise FatalError(_('Unknown compressor %s') % codec)
+    compressor = TAR_COMPRESSORS[codec]
+    cmd = list(compressor.compress)
+    if level is not None:
+        if level not in compressor.levels:
+            raise FatalError(
+                _('Invalid compression level %s for %s, must be between %s and %s')
+                % (level, codec, compressor.levels[0], compressor.levels[-1])
+            )
+        cmd.append('-%d' % level)
+    return cmd
+
+
+def write_tar(out_file, workdir, files, codec='xz', level=None, exclude=None):
+    """
+    Creates a compressed tarball streaming the tar members straight to the
+    compressor, without writing the uncompressed tarball to disk
+
+    @param out_file: path of the tarball
+    @type out_file: str
+    @param workdir: directory the files are relative to
+    @type workdir: str
+    @param files: files and directories to add
+    @type files: list
+    @param codec: the compressor, one of L{TAR_COMPRESSORS}
+    @type codec: str
+    @param level: compression level, the compressor default if None
+    @type level: int
+    @param exclude: members containing any of these strings are skipped
+    @type exclude: list
+    """
+    cmd = compress_cmd(codec, level)
+    exclude = exclude or []
+
+    def exclude_filter(tarinfo):
+        for each in exclude:
+            if each in tarinfo.name:
+                return None
+        return tarinfo
+
+    with open(out_file, 'wb') as out:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+        except SUBPROCESS_EXCEPTIONS as e:
+            raise FatalError(_('Could not run {}: {}').format(cmd[0], e))
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode='w|', bufsize=TAR_STREAM_BUFSIZE) as tf:
+                for f in files:
+                    tf.add(os.path.join(workdir, f), arcname=f, filter=exclude_filter)
+        finally:
+            proc.stdin.close()
+            ret = proc.wait()
+    if ret != 0:
+        raise FatalError(_('Failed to compress {} with {}').format(out_file, cmd[0]))
+
+
+def _unpack_tar_stream(filepath, output_dir, codec, force_tarfile):
+    cmd = TAR_COMPRESSORS[codec].decompress + [filepath]
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    except SUBPROCESS_EXCEPTIONS as e:
+        raise FatalError(_('Could not run {}: {}').format(cmd[0], e))
+    try:
+        if DISTRO in (Distro.MSYS, Distro.MSYS2) or force_tarfile:
+            with tarfile.open(fileobj=proc.stdout, mode='r|', bufsize=TAR_STREAM_BUFSIZE) as tf:
+                tf.extractall(path=output_dir)
+            tar_ret = 0
+        else:
+            tar_cmd = [get_tar_cmd(), '-C', output_dir, '-xf', '-', '--no-same-owner']
+            tar = subprocess.Popen(tar_cmd, stdin=proc.stdout)
+            # Only tar keeps the pipe open, so the decompressor gets SIGPIPE
+            # if tar exits
+            proc.stdout.close()
+            tar_ret = tar.wait()
+    finally:
+        proc.stdout.close()
+        ret = proc.wait()
+    if ret != 0 or tar_ret != 0:
+        raise FatalError(_('Failed to unpack {}').format(filepath))
+
+
+async def unpack_tar_stream(filepath, output_dir, logfile=None, force_tarfile=False):
+    """
+    Extracts a tarball decompressing it with a multithreaded compressor and
+    streaming its output to tar, without writing the uncompressed tarball to
+    disk
+
+    @param filepath: path of the tarball, compressed with one of
+                     L{TAR_COMPRESSORS}
+    @type filepath: str
+    @param output_dir: output directory
+    @type output_dir: str
+    @param force_tarfile: forces use of tarfile
+    @type force_tarfile: bool
+    """
+    codec = tar_compressor_for(filepath)
+    if codec is None:
+        raise FatalError('Unknown tarball format %s' % filepath)
+    m.log('Unpacking {} in {}'.format(filepath, output_dir), logfile)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, _unpack_tar_stream, filepath, output_dir, codec, force_tarfile)
+
+
 async def unpack(filepath, output_dir, logfile=None, force_tarfile=False):
     """
     Extracts a tarball
@@ -367,6 +664,11 @@ async def unpack(filepath, output_dir, logfile=None, force_tarfile=False):
     @param force_tarfile: forces use of tarfile
     @type force_tarfile: bool
     """
+    if filepath.endswith('tar.zst'):
+        # Neither tarfile nor old versions of tar support zstd
+        await unpack_tar_stream(filepath, output_dir, logfile=logfile, force_tarfile=force_tarfile)
+        return
+
     m.log('Unpacking {} in {}'.format(filepath, output_dir), logfile)
 
     if filepath.endswith(TARBALL_SUFFIXES):
@@ -573,6 +875,81 @@ def copy_dir(src, dest):
             copy_dir(s, d)
 
 
+def reflink_or_copy(src, dest):
+    """
+    Copies a file sharing its blocks with the source on filesystems with
+    copy-on-write support, like Btrfs or XFS, and with a regular copy on the
+    others. Permissions are copied too.
+
+    @param src: the file to copy
+    @type src: str
+    @param dest: the copy
+    @type dest: str
+    @return: whether the blocks are shared
+    @rtype: bool
+    """
+    if PLATFORM == Platform.LINUX:
+        import fcntl
+
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                reflinked = True
+            except OSError:
+                reflinked = False
+        if reflinked:
+            shutil.copymode(src, dest)
+            return True
+    shutil.copy2(src, dest)
+    return False
+
+
+def link_or_copy(src, dest):
+    """
+    Hard links a file, or reflinks or copies it when they are in different
+    filesystems or hard links are not supported
+
+    @param src: the file to link
+    @type src: str
+    @param dest: the link
+    @type dest: str
+    """
+    try:
+        os.link(src, dest)
+    except OSError:
+        reflink_or_copy(src, dest)
+
+
+def publish_tree(src, dest, copy_function=shutil.copy2):
+    """
+    Copies a directory tree to a path of a host-wide cache, where other
+    processes might be publishing the same tree. The tree is copied next to
+    its destination and renamed in place, so that it is never seen partially
+    copied, and the first copy renamed wins.
+
+    @param src: the tree to copy
+    @type src: str
+    @param dest: the destination, left as is if it exists
+    @type dest: str
+    @param copy_function: function copying each file
+    @type copy_function: function
+    """
+    if os.path.isdir(dest):
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(dest), prefix='.tmp-')
+    try:
+        tree = os.path.join(tmp, 'tree')
+        shutil.copytree(src, tree, symlinks=True, copy_function=copy_function)
+        try:
+            os.rename(tree, dest)
+        except OSError:
+            if not os.path.isdir(dest):
+                raise
+    finally:
+        shutil.rmtree(tmp)
+
+
 def touch(path, create_if_not_exists=False, offset=0):
     if not os.path.exists(path):
         if create_if_not_exists:
@@ -587,7 +964,7 @@ def file_hash(path):
     """
     Get the file md5 hash
     """
-    return hashlib.md5(open(path, 'rb').read()).digest()
+    return bytes.fromhex(hashing.get_hasher().file_digest(path, 'md5'))
 
 
 def files_checksum(paths):
@@ -599,10 +976,7 @@ def files_checksum(paths):
     @return: the md5 checksum
     @rtype: str
     """
-    m = hashlib.md5()
-    for f in paths:
-        m.update(open(f, 'rb').read())
-    return m.digest()
+    return bytes.fromhex(hashing.get_hasher().files_digest(paths, 'md5'))
 
 
 def enter_build_environment(platform, arch, distro, sourcedir=None, bash_completions=None, env=None):
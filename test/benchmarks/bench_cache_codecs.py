@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Measures the generation and restore time of the build cache tarball with
+each codec, compared to writing a plain tar and compressing it afterwards.
+
+Usage: CERBERO_UNINSTALLED=1 PYTHONPATH=. python3 test/benchmarks/bench_cache_codecs.py [--prefix DIR]
+
+Without --prefix, a prefix is synthesized from the shared libraries,
+headers and text files of the system, which compress like a real cerbero
+prefix.
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from cerbero.utils import shell, run_until_complete
+
+
+def synthesize_prefix(path, size_mb):
+    sources = [('lib', '/usr/lib/x86_64-linux-gnu/*.so*'), ('lib', '/usr/lib/*.so*'), ('include', '/usr/include/*.h')]
+    sources += [('share/doc', '/usr/share/doc/*/copyright')]
+    total = 0
+    limit = size_mb * 1024 * 1024
+    for dest, pattern in sources:
+        for i, src in enumerate(sorted(glob.glob(pattern))):
+            if total >= limit:
+                return total
+            if not os.path.isfile(src) or os.path.islink(src):
+                continue
+            dst = os.path.join(path, dest, '%d-%s' % (i, os.path.basename(src)))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(src, dst)
+            total += os.path.getsize(dst)
+    return total
+
+
+def legacy_gen(workdir, out_file, files):
+    # What gen-cache did before: plain tar on disk, then xz
+    out_tar = os.path.splitext(out_file)[0]
+    with tarfile.open(out_tar, 'w') as tf:
+        for f in files:
+            tf.add(os.path.join(workdir, f), arcname=f)
+    subprocess.check_call(['xz', '--threads=0', '-f', out_tar])
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--prefix', help='Prefix to compress, synthesized if not set')
+    parser.add_argument('--size', type=int, default=300, help='Size in MB of the synthesized prefix')
+    parser.add_argument('--levels', default='xz:6,zstd:3,zstd:9,zstd:19', help='Comma separated codec:level list')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        if args.prefix:
+            workdir, files = os.path.dirname(os.path.abspath(args.prefix)), [os.path.basename(args.prefix)]
+        else:
+            workdir, files = tmp, ['dist']
+            size = synthesize_prefix(os.path.join(tmp, 'dist'), args.size)
+            print('Synthesized prefix of %.1fMB' % (size / (1024 * 1024)))
+
+        out_file = os.path.join(tmp, 'legacy.tar.xz')
+        gen = measure(legacy_gen, workdir, out_file, files)
+        print('%-10s gen %7.2fs, size %7.1fMB' % ('tar + xz:', gen, os.path.getsize(out_file) / (1024 * 1024)))
+        os.remove(out_file)
+
+        for spec in args.levels.split(','):
+            codec, level = spec.split(':')
+            level = int(level)
+            out_file = os.path.join(tmp, 'cache.' + shell.TAR_COMPRESSORS[codec].suffix)
+            out_dir = os.path.join(tmp, 'restore')
+            gen = measure(shell.write_tar, out_file, workdir, files, codec, level)
+            restore = measure(run_until_complete, shell.unpack_tar_stream(out_file, out_dir))
+            size = os.path.getsize(out_file) / (1024 * 1024)
+            print('%-10s gen %7.2fs, restore %7.2fs, size %7.1fMB' % (spec + ':', gen, restore, size))
+            os.remove(out_file)
+            shutil.rmtree(out_dir)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
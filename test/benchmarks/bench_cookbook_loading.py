@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Compares the startup time of the CookBook loading the recipes serially,
+in parallel worker processes and from the recipes metadata cache.
+
+Usage: CERBERO_UNINSTALLED=1 PYTHONPATH=. python3 test/benchmarks/bench_cookbook_loading.py [-c config.cbc]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from cerbero.build.cookbook import CookBook
+from cerbero.build.recipecache import LazyRecipe
+from cerbero.config import Config
+
+
+def load_config(filenames, home_dir, parallel):
+    config = Config()
+    config.load(filenames)
+    config.home_dir = home_dir
+    config.cache_file = '/dev/null'
+    config.parallel_recipes_loading = parallel
+    return config
+
+
+def measure(filenames, home_dir, lazy, parallel):
+    config = load_config(filenames, home_dir, parallel)
+    start = time.perf_counter()
+    cookbook = CookBook(config, lazy=lazy)
+    elapsed = time.perf_counter() - start
+    recipes = cookbook.get_recipes_list()
+    lazy_recipes = len([r for r in recipes if isinstance(r, LazyRecipe)])
+    return elapsed, len(recipes), lazy_recipes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-c', '--config', action='append', default=[], help='Configuration file used')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each mode')
+    args = parser.parse_args()
+    filenames = [os.path.abspath(f) for f in args.config] or None
+
+    modes = [
+        ('serial', False, False, False),
+        ('lazy, no cache', True, False, False),
+        ('lazy, no cache, parallel', True, True, False),
+        ('lazy, cached', True, False, True),
+    ]
+    for name, lazy, parallel, warm in modes:
+        times = []
+        for i in range(args.repeat):
+            home_dir = tempfile.mkdtemp()
+            try:
+                if warm:
+                    measure(filenames, home_dir, False, False)
+                elapsed, total, lazy_recipes = measure(filenames, home_dir, lazy, parallel)
+                times.append(elapsed)
+            finally:
+                shutil.rmtree(home_dir)
+        print(
+            '%-26s %7.3fs (best of %d), %d recipes, %d not loaded'
+            % (name + ':', min(times), args.repeat, total, lazy_recipes)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+Compares the time needed to list the files of a package, like
+`cerbero package` does, resolving the files of the recipes in the
+filesystem and with the prefix index, and reusing the lists of files
+memoized by the recipes while the prefix doesn't change.
+
+Usage: CERBERO_UNINSTALLED=1 PYTHONPATH=. python3 test/benchmarks/bench_files_listing.py [-c config.cbc] [gstreamer-1.0]
+
+The prefix of the configuration must contain a build of the package.
+"""
+
+import argparse
+import os
+import time
+
+from cerbero.build import prefixindex
+from cerbero.config import Config
+from cerbero.packages.packagesstore import PackagesStore
+from cerbero.utils import messages as m
+
+
+def list_files(package):
+    return len(set(package.files_list()) | set(package.devel_files_list()))
+
+
+def reset_files_lists(cookbook):
+    # Forget the lists of files memoized by the recipes and the cookbook
+    for name in list(cookbook.recipes):
+        cookbook.reset_recipe_files_lists(name)
+
+
+def measure(cookbook, package, enabled, warm, memoized):
+    prefixindex.ENABLED = enabled
+    prefixindex.clear_indexes()
+    reset_files_lists(cookbook)
+    if warm:
+        list_files(package)
+        if not memoized:
+            reset_files_lists(cookbook)
+    start = time.perf_counter()
+    count = list_files(package)
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('package', nargs='?', default='gstreamer-1.0', help='Package listed')
+    parser.add_argument('-c', '--config', action='append', default=[], help='Configuration file used')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each mode')
+    args = parser.parse_args()
+    filenames = [os.path.abspath(f) for f in args.config] or None
+
+    config = Config()
+    config.load(filenames)
+    config.cache_file = '/dev/null'
+    if not os.path.isdir(config.prefix):
+        m.warning('Prefix %s not found, all the files will be missing' % config.prefix)
+    # Missing files are only interesting for the recipes, not here
+    m.warning = lambda *args, **kwargs: None
+    store = PackagesStore(config)
+    package = store.get_package(args.package)
+
+    modes = [
+        ('filesystem', False, False, False),
+        ('index, first scan', True, False, False),
+        ('index, scanned', True, True, False),
+        ('index, memoized', True, True, True),
+    ]
+    for name, enabled, warm, memoized in modes:
+        times = []
+        for i in range(args.repeat):
+            elapsed, count = measure(store.cookbook, package, enabled, warm, memoized)
+            times.append(elapsed)
+        print('%-20s %7.3fs (best of %d), %d files' % (name + ':', min(times), args.repeat, count))
+
+
+if __name__ == '__main__':
+    main()
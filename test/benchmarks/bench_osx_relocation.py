@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+"""
+Measures the time needed to relocate a synthetic prefix of Mach-O dylibs
+with the OSXRelocator, like the relocate_osx_libraries step does, with one
+worker and with one worker per CPU.
+
+Usage: PYTHONPATH=. python3 test/benchmarks/bench_osx_relocation.py [-n 1000]
+
+The dylibs are created in-process, so it runs on any platform.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from cerbero.tools import macho
+from cerbero.tools.osxrelocator import OSXRelocator
+from test.test_cerbero_tools_macho import mach_o
+
+
+def create_prefix(prefix, count):
+    libdir = os.path.join(prefix, 'lib')
+    if os.path.exists(prefix):
+        shutil.rmtree(prefix)
+    os.makedirs(libdir)
+    files = []
+    for i in range(count):
+        path = os.path.join(libdir, 'libfoo%d.dylib' % i)
+        paths = [(macho.LC_ID_DYLIB, path)]
+        paths += [(macho.LC_LOAD_DYLIB, os.path.join(libdir, 'libfoo%d.dylib' % (i // 2**k))) for k in range(1, 4)]
+        paths += [(macho.LC_LOAD_DYLIB, '/usr/lib/libSystem.B.dylib'), (macho.LC_RPATH, libdir)]
+        with open(path, 'wb') as f:
+            f.write(mach_o(paths))
+        files.append(path)
+    return files
+
+
+def measure(prefix, count, jobs):
+    files = create_prefix(prefix, count)
+    relocator = OSXRelocator(prefix, prefix, True)
+    start = time.perf_counter()
+    relocator.relocate_files(files, jobs=jobs)
+    elapsed = time.perf_counter() - start
+    with macho.MachO(files[-1]) as m:
+        assert m.dylib_id() == '@rpath/' + os.path.basename(files[-1]), m.dylib_id()
+        assert prefix not in ''.join(m.rpaths() + m.shared_libraries())
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=1000, help='Number of dylibs')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each mode')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    prefix = os.path.join(tmp, 'prefix')
+    try:
+        for jobs in sorted(set([1, os.cpu_count() or 1])):
+            times = [measure(prefix, args.count, jobs) for i in range(args.repeat)]
+            best = min(times)
+            print(
+                '%2d workers: %7.3fs (best of %d), %.0f dylibs/s'
+                % (jobs, best, args.repeat, args.count / best if best > 0 else args.count)
+            )
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Measures the scheduling overhead of the Oven on synthetic recipe graphs:
+building the dependency graph and creating the priority of every step
+pushed to the build queues.
+
+Usage: PYTHONPATH=. python3 test/benchmarks/bench_oven_scheduling.py [--legacy]
+"""
+
+import argparse
+import heapq
+import random
+import time
+
+from cerbero.build.oven import RecipeGraph, RecipeStepPriority
+
+STEPS = ['init', 'fetch', 'extract', 'configure', 'compile', 'install', 'post_install']
+
+
+class DummyRecipe(object):
+    allow_parallel_build = True
+
+    def __init__(self, name):
+        self.name = name
+
+
+def create_graph(size, max_deps=6, window=50, seed=0):
+    rand = random.Random(seed)
+    names = ['recipe%d' % i for i in range(size)]
+    deps = {}
+    for i, name in enumerate(names):
+        candidates = names[max(0, i - window) : i]
+        deps[name] = set(rand.sample(candidates, min(len(candidates), rand.randint(0, max_deps))))
+    return deps
+
+
+def legacy_priorities(recipe_deps):
+    # The per-step computation done by the Oven before the graph was
+    # precomputed, kept for comparison
+    def rdeps(recipe):
+        return [r for r, deps in recipe_deps.items() if recipe in deps]
+
+    recipe_rdeps = {r: rdeps(r) for r in recipe_deps}
+    targets = set(r for r, v in recipe_rdeps.items() if not v)
+
+    def find_recipe_dep_path(from_name, to_name):
+        if from_name == to_name:
+            return [to_name]
+        for dep in recipe_deps[from_name]:
+            val = find_recipe_dep_path(dep, to_name)
+            if val:
+                return [from_name] + val
+
+    def priority(name):
+        lengths = [len(p) for p in (find_recipe_dep_path(t, name) for t in targets) if p]
+        return max(lengths) * (len(recipe_rdeps[name]) + 1)
+
+    queue = []
+    for step in STEPS:
+        for name in recipe_deps:
+            heapq.heappush(queue, (-priority(name), name, step))
+    while queue:
+        heapq.heappop(queue)
+
+
+def graph_priorities(recipe_deps):
+    graph = RecipeGraph(recipe_deps)
+    recipes = [DummyRecipe(name) for name in graph.order]
+    queue = []
+    for step in STEPS:
+        for count, recipe in enumerate(recipes):
+            heapq.heappush(queue, RecipeStepPriority(graph, recipe, count, step))
+    while queue:
+        heapq.heappop(queue)
+
+
+def measure(func, recipe_deps):
+    start = time.perf_counter()
+    func(recipe_deps)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--legacy', action='store_true', help='Also time the legacy per-step computation')
+    parser.add_argument('--legacy-max-size', type=int, default=300, help='Largest graph timed with --legacy')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        recipe_deps = create_graph(size)
+        edges = sum(len(v) for v in recipe_deps.values())
+        elapsed = measure(graph_priorities, recipe_deps)
+        print('%6d recipes, %6d deps: %8.3fs precomputed graph' % (size, edges, elapsed))
+        if args.legacy and size <= args.legacy_max_size:
+            elapsed = measure(legacy_priorities, recipe_deps)
+            print('%6d recipes, %6d deps: %8.3fs legacy' % (size, edges, elapsed))
+
+
+if __name__ == '__main__':
+    main()
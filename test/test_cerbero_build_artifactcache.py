@@ -0,0 +1,145 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import functools
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cerbero.build.artifactcache import ArtifactCache
+from cerbero.build.cookbook import CookBook
+from cerbero.utils import run_until_complete
+from test.test_common import DummyConfig
+
+
+RECIPE = """
+class Recipe(recipe.Recipe):
+    name = 'test-recipe'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    deps = ['test-dep']
+    files_misc = ['share/test/README']
+    files_devel = ['include/test.h']
+"""
+
+DEP_RECIPE = """
+class Recipe(recipe.Recipe):
+    name = 'test-dep'
+    version = '%(version)s'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+"""
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'prefix')
+        self.recipes_dir = os.path.join(self.tmp, 'recipes')
+        os.makedirs(self.recipes_dir)
+        self.config = DummyConfig()
+        self.config.recipes_dir = self.recipes_dir
+        self.config.home_dir = self.tmp
+        self.config.prefix = self.prefix
+        self.config.cache_file = '/dev/null'
+        self.config.artifact_cache_dir = os.path.join(self.tmp, 'artifacts')
+        with open(os.path.join(self.recipes_dir, 'test-recipe.recipe'), 'w') as f:
+            f.write(RECIPE)
+        self._write_dep('1.0')
+        for name, content in (('share/test/README', 'readme'), ('include/test.h', 'header')):
+            path = os.path.join(self.prefix, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write_dep(self, version):
+        with open(os.path.join(self.recipes_dir, 'test-dep.recipe'), 'w') as f:
+            f.write(DEP_RECIPE % {'version': version})
+
+    def _cache(self):
+        cookbook = CookBook(self.config)
+        return ArtifactCache(self.config, cookbook), cookbook.get_recipe('test-recipe')
+
+    def testKey(self):
+        cache, recipe = self._cache()
+        key = cache.recipe_key(recipe)
+        self.assertEqual(key, self._cache()[0].recipe_key(recipe))
+        self._write_dep('2.0')
+        cache, recipe = self._cache()
+        self.assertNotEqual(key, cache.recipe_key(recipe))
+        self._write_dep('1.0')
+        self.config.variants.override(['nogi'])
+        cache, recipe = self._cache()
+        self.assertNotEqual(key, cache.recipe_key(recipe))
+
+    def testKeyHostPaths(self):
+        cache, recipe = self._cache()
+        key = cache.recipe_key(recipe)
+        # Another host with the same prefix
+        self.config.home_dir = os.path.join(self.tmp, 'other-home')
+        self.config.local_sources = os.path.join(self.tmp, 'other-home', 'sources')
+        self.config.recipes_dir = os.path.join(self.tmp, 'other-recipes')
+        shutil.copytree(self.recipes_dir, self.config.recipes_dir)
+        cache, recipe = self._cache()
+        self.assertEqual(key, cache.recipe_key(recipe))
+        self.config.prefix = os.path.join(self.tmp, 'other-prefix')
+        cache, recipe = self._cache()
+        self.assertNotEqual(key, cache.recipe_key(recipe))
+
+    def testStoreRestore(self):
+        cache, recipe = self._cache()
+        self.assertFalse(run_until_complete(cache.restore(recipe)))
+        key = run_until_complete(cache.store(recipe))
+        self.assertTrue(os.path.exists(os.path.join(cache.cache_dir, cache.artifact_path(key))))
+        shutil.rmtree(self.prefix)
+        self.assertTrue(run_until_complete(cache.restore(recipe)))
+        with open(os.path.join(self.prefix, 'include/test.h')) as f:
+            self.assertEqual(f.read(), 'header')
+        self.assertTrue(os.path.exists(os.path.join(self.prefix, 'share/test/README')))
+
+    def testRemoteRestore(self):
+        cache, recipe = self._cache()
+        run_until_complete(cache.store(recipe))
+        remote_dir = os.path.join(self.tmp, 'remote')
+        shutil.move(cache.cache_dir, remote_dir)
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=remote_dir)
+        handler.log_message = lambda *args: None
+        server = http.server.HTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self.config.artifact_cache_url = 'http://127.0.0.1:%d/' % server.server_port
+            self.config.artifact_cache_dir = None
+            shutil.rmtree(self.prefix)
+            cache, recipe = self._cache()
+            self.assertEqual(cache.cache_dir, os.path.join(self.tmp, 'artifacts'))
+            self.assertTrue(run_until_complete(cache.restore(recipe)))
+            self.assertTrue(os.path.exists(os.path.join(self.prefix, 'include/test.h')))
+            # Remote caches are read-only
+            self.assertIsNone(run_until_complete(cache.store(recipe)))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
@@ -16,11 +16,13 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
 import unittest
 import tempfile
 import pickle
 
 from cerbero.build.cookbook import CookBook
+from cerbero.build.statusstore import StatusStore
 from cerbero.errors import RecipeNotFoundError
 from test.test_common import DummyConfig as Config
 from test.test_build_common import Recipe1
@@ -47,9 +49,8 @@ class PackageTest(unittest.TestCase):
         self.cookbook.set_status(status)
         self.cookbook.get_config().cache_file = tmp.name
         self.cookbook.save()
-        with open(self.cookbook._cache_file(self.config), 'rb') as f:
-            loaded_status = pickle.load(f)
-            self.assertEqual(status, loaded_status)
+        loaded_status = StatusStore(self.cookbook._cache_file(self.config)).load()
+        self.assertEqual(status, loaded_status)
 
     def testLoad(self):
         tmp = tempfile.NamedTemporaryFile()
@@ -59,6 +60,39 @@ class PackageTest(unittest.TestCase):
             pickle.dump(status, f)
         self.cookbook._restore_cache()
         self.assertEqual(status, self.cookbook.status)
+        # The pickled status is migrated, keeping a copy of the old file
+        with open(tmp.name, 'rb') as f:
+            self.assertTrue(f.read().startswith(b'SQLite format 3'))
+        with open(tmp.name + '.old', 'rb') as f:
+            self.assertEqual(pickle.load(f), status)
+        os.remove(tmp.name + '.old')
+        self.cookbook._restore_cache()
+        self.assertEqual(status, self.cookbook.status)
+
+    def testLoadCorrupted(self):
+        tmp = tempfile.NamedTemporaryFile()
+        self.cookbook.get_config().cache_file = tmp.name
+        with open(tmp.name, 'wb') as f:
+            f.write(b'SQLite format 3\x00' + b'\xff' * 1024)
+        self.cookbook._restore_cache()
+        self.assertEqual(self.cookbook.status, {})
+        self.assertTrue(os.path.exists(tmp.name + '.old'))
+        os.remove(tmp.name + '.old')
+
+    def testSaveRecipeStatus(self):
+        tmp = tempfile.NamedTemporaryFile()
+        self.cookbook.get_config().cache_file = tmp.name
+        self.cookbook._restore_cache()
+        self.cookbook.add_recipe(Recipe1(self.config, {}))
+        self.cookbook.update_step_status('recipe1', 'fetch')
+        self.cookbook.update_step_status('recipe1', 'extract')
+        status = StatusStore(tmp.name).load()
+        self.assertEqual(status['recipe1'].steps, ['fetch', 'extract'])
+        self.cookbook.update_build_status('recipe1', '1.0')
+        status = StatusStore(tmp.name).load()
+        self.assertEqual(status['recipe1'].built_version, '1.0')
+        self.cookbook.reset_recipe_status('recipe1')
+        self.assertEqual(StatusStore(tmp.name).load(), {})
 
     def testAddGetRecipe(self):
         recipe = Recipe1(self.config, {})
@@ -117,3 +151,38 @@ class PackageTest(unittest.TestCase):
         status = self.cookbook._recipe_status(recipe.name)
         self.assertEqual(status.steps, [])
         self.assertTrue(self.cookbook.status[recipe.name].needs_build)
+
+    def testRecipePeakMemory(self):
+        tmp = tempfile.NamedTemporaryFile()
+        self.cookbook.get_config().cache_file = tmp.name
+        recipe = Recipe1(self.config, {})
+        self.cookbook.add_recipe(recipe)
+        self.cookbook._restore_cache()
+        self.cookbook.update_step_status(recipe.name, 'fetch')
+        self.assertIsNone(self.cookbook.get_recipe_peak_memory(recipe.name))
+        self.cookbook.update_recipe_peak_memory(recipe.name, 2 << 30)
+        # Survives the reset of the status of the recipe
+        self.cookbook.reset_recipe_status(recipe.name)
+        store = StatusStore(self.cookbook._cache_file(self.config))
+        store.load()
+        self.assertEqual(store.get_peak_memory(recipe.name), 2 << 30)
+        store.close()
+
+    def testRecipeFilesLists(self):
+        tmp = tempfile.NamedTemporaryFile()
+        self.cookbook.get_config().cache_file = tmp.name
+        recipe = Recipe1(self.config, {})
+        self.cookbook.add_recipe(recipe)
+        self.cookbook._restore_cache()
+        self.cookbook.update_recipe_files_list(recipe.name, 'key', 'sig1', ['bin/foo'])
+        self.assertEqual(self.cookbook.get_recipe_files_list(recipe.name, 'key', 'sig1'), ['bin/foo'])
+        # Only valid for the same prefix
+        self.assertIsNone(self.cookbook.get_recipe_files_list(recipe.name, 'key', 'sig2'))
+        # Persisted for other processes
+        store = StatusStore(self.cookbook._cache_file(self.config))
+        store.load()
+        self.assertEqual(store.get_files_list(recipe.name, 'key', 'sig1'), ['bin/foo'])
+        store.close()
+        # Forgotten when the recipe installs files
+        self.cookbook.update_step_status(recipe.name, 'install')
+        self.assertIsNone(self.cookbook.get_recipe_files_list(recipe.name, 'key', 'sig1'))
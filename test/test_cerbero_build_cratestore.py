@@ -0,0 +1,98 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.cratestore import CRATES_IO, CrateStore, parse_cargo_lock
+from test.test_common import DummyConfig
+
+
+CARGO_LOCK = """# This file is automatically @generated by Cargo.
+# It is not intended for manual editing.
+version = 3
+
+[[package]]
+name = "foo"
+version = "0.1.0"
+dependencies = [
+ "libc",
+]
+
+[[package]]
+name = "libc"
+version = "0.2.150"
+source = "registry+https://github.com/rust-lang/crates.io-index"
+checksum = "%s"
+"""
+
+CHECKSUM = '89d92a4743f9a61002fae18374ed11e7973f530cb3a3255fb354818118b2203c'
+
+
+class CrateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tomllib = DummyConfig().find_toml_module()
+        if self.tomllib is None:
+            self.skipTest('toml module not found')
+        self.tmp = tempfile.mkdtemp()
+        self.store = CrateStore(os.path.join(self.tmp, 'store'))
+        self.lock = os.path.join(self.tmp, 'Cargo.lock')
+        with open(self.lock, 'w') as f:
+            f.write(CARGO_LOCK % CHECKSUM)
+        self.vendor_dir = os.path.join(self.tmp, 'vendor')
+        crate = os.path.join(self.vendor_dir, 'libc')
+        os.makedirs(os.path.join(crate, 'src'))
+        with open(os.path.join(crate, 'Cargo.toml'), 'w') as f:
+            f.write('[package]\nname = "libc"\n')
+        with open(os.path.join(crate, 'src', 'lib.rs'), 'w') as f:
+            f.write('\n')
+        with open(os.path.join(crate, '.cargo-checksum.json'), 'w') as f:
+            json.dump({'files': {}, 'package': CHECKSUM}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testParseCargoLock(self):
+        packages = parse_cargo_lock(self.lock, self.tomllib)
+        self.assertEqual(len(packages), 2)
+        self.assertEqual(packages[0], {'name': 'foo', 'version': '0.1.0', 'dependencies': ['libc']})
+        self.assertEqual(packages[1]['source'], CRATES_IO)
+        self.assertEqual(packages[1]['checksum'], CHECKSUM)
+
+    def testVendor(self):
+        packages = parse_cargo_lock(self.lock, self.tomllib)
+        dest = os.path.join(self.tmp, 'other-vendor')
+        self.assertFalse(self.store.vendor(packages, dest))
+        self.assertFalse(os.path.exists(dest))
+        self.assertEqual(self.store.add_vendor_dir(packages, self.vendor_dir), 1)
+        self.assertEqual(self.store.add_vendor_dir(packages, self.vendor_dir), 0)
+        self.assertTrue(self.store.vendor(packages, dest))
+        self.assertEqual(os.listdir(dest), ['libc-0.2.150'])
+        for name in ('Cargo.toml', '.cargo-checksum.json', os.path.join('src', 'lib.rs')):
+            self.assertTrue(os.path.isfile(os.path.join(dest, 'libc-0.2.150', name)))
+        self.assertIn('directory = "%s"' % dest, CrateStore.config_toml(dest))
+
+    def testVendorGitSource(self):
+        packages = parse_cargo_lock(self.lock, self.tomllib)
+        self.store.add_vendor_dir(packages, self.vendor_dir)
+        packages.append({'name': 'bar', 'version': '1.0.0', 'source': 'git+https://example.com/bar#abcdef'})
+        self.assertFalse(self.store.vendor(packages, os.path.join(self.tmp, 'other-vendor')))
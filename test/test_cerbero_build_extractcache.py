@@ -0,0 +1,67 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.extractcache import ExtractCache
+
+
+class ExtractCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ExtractCache(os.path.join(self.tmp, 'cache'))
+        self.src = os.path.join(self.tmp, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        with open(os.path.join(self.src, 'sub', 'file.c'), 'w') as f:
+            f.write('int main() { return 0; }\n')
+        os.chmod(os.path.join(self.src, 'sub', 'file.c'), 0o755)
+        os.symlink('sub/file.c', os.path.join(self.src, 'link.c'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testKey(self):
+        key = ExtractCache.key('abc', 'foo-1.0', False, 1, '0001.patch:123')
+        self.assertEqual(key, ExtractCache.key('abc', 'foo-1.0', False, 1, '0001.patch:123'))
+        self.assertNotEqual(key, ExtractCache.key('abc', 'foo-1.0', False, 1, '0001.patch:124'))
+        # Parts are delimited
+        self.assertNotEqual(ExtractCache.key('ab', 'c'), ExtractCache.key('a', 'bc'))
+
+    def testStoreRestore(self):
+        key = ExtractCache.key('abc')
+        dest = os.path.join(self.tmp, 'dest')
+        self.assertFalse(self.cache.restore(key, dest))
+        self.assertFalse(os.path.exists(dest))
+        self.cache.store(key, self.src)
+        # Storing it again is a no-op
+        self.cache.store(key, self.src)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache.tree_path(key))), [key])
+        self.assertTrue(self.cache.restore(key, dest))
+        with open(os.path.join(dest, 'sub', 'file.c')) as f:
+            self.assertEqual(f.read(), 'int main() { return 0; }\n')
+        self.assertTrue(os.access(os.path.join(dest, 'sub', 'file.c'), os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(dest, 'link.c')), 'sub/file.c')
+        # The restored tree is a copy
+        with open(os.path.join(dest, 'sub', 'file.c'), 'w') as f:
+            f.write('changed')
+        with open(os.path.join(self.cache.tree_path(key), 'sub', 'file.c')) as f:
+            self.assertEqual(f.read(), 'int main() { return 0; }\n')
@@ -16,11 +16,13 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
 import shutil
 import unittest
 import tempfile
+from unittest import mock
 
-from cerbero.build import recipe
+from cerbero.build import prefixindex, recipe
 from cerbero.config import Platform, License
 from test.test_common import DummyConfig
 
@@ -102,6 +104,7 @@ class PackageTest(unittest.TestCase):
 
     def tearDown(self):
         shutil.rmtree(self.tmp)
+        prefixindex.clear_indexes()
 
     def testFilesCategories(self):
         self.assertEqual(sorted(['bins', 'libs', 'misc', 'devel']), self.win32recipe._files_categories())
@@ -139,3 +142,15 @@ class PackageTest(unittest.TestCase):
         self.assertEqual(self.linuxrecipe.files_list(False), sorted(linuxfiles))
         self.assertEqual(self.win32recipe.files_list(), [])
         self.assertEqual(self.linuxrecipe.files_list(), [])
+
+    def testMemoizedFilesList(self):
+        for f in ['bin/gst-launch', 'README']:
+            os.makedirs(os.path.dirname(os.path.join(self.tmp, f)), exist_ok=True)
+            open(os.path.join(self.tmp, f), 'w').close()
+        self.assertEqual(self.linuxrecipe.files_list_by_category('bins'), ['bin/gst-launch'])
+        with mock.patch.object(self.linuxrecipe, '_search_existing', side_effect=AssertionError('searched again')):
+            self.assertEqual(self.linuxrecipe.files_list_by_category('bins'), ['bin/gst-launch'])
+        # Searched again when the prefix changes
+        open(os.path.join(self.tmp, 'bin/linux'), 'w').close()
+        prefixindex.mark_stale()
+        self.assertEqual(self.linuxrecipe.files_list_by_category('bins'), self.linuxbin)
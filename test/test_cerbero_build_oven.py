@@ -0,0 +1,204 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import asyncio
+import unittest
+
+from cerbero.build.cookbook import CookBook
+from cerbero.build.oven import MemoryBudget, RecipeGraph, RecipeReadyTracker, RecipeStepPriority
+from cerbero.errors import FatalError
+from test.test_common import DummyConfig
+
+
+class DummyRecipe(object):
+    allow_parallel_build = True
+
+    def __init__(self, name):
+        self.name = name
+
+
+class RecipeGraphTest(unittest.TestCase):
+    def setUp(self):
+        # a <- b <- d <- e
+        # a <- c <- e
+        # f
+        self.deps = {
+            'a': set(),
+            'b': {'a'},
+            'c': {'a'},
+            'd': {'b', 'a'},
+            'e': {'d', 'c', 'b', 'a'},
+            'f': set(),
+        }
+        self.graph = RecipeGraph(self.deps)
+
+    def _longest_path(self, from_name, to_name):
+        if from_name == to_name:
+            return 1
+        lengths = [self._longest_path(dep, to_name) for dep in self.deps[from_name]]
+        lengths = [x for x in lengths if x]
+        return 1 + max(lengths) if lengths else 0
+
+    def testOrder(self):
+        order = self.graph.order
+        self.assertEqual(sorted(order), sorted(self.deps.keys()))
+        for r, deps in self.deps.items():
+            for dep in deps:
+                self.assertLess(order.index(dep), order.index(r))
+
+    def testReverseDeps(self):
+        self.assertEqual(sorted(self.graph.rdeps['a']), ['b', 'c', 'd', 'e'])
+        self.assertEqual(sorted(self.graph.rdeps['d']), ['e'])
+        self.assertEqual(self.graph.fan_out['b'], 2)
+        self.assertEqual(self.graph.fan_out['e'], 0)
+        self.assertEqual(self.graph.targets(), {'e', 'f'})
+
+    def testCriticalPath(self):
+        targets = self.graph.targets()
+        for r in self.deps:
+            expected = max(self._longest_path(t, r) for t in targets)
+            self.assertEqual(self.graph.critical_path[r], expected)
+        self.assertEqual(self.graph.critical_path['a'], 4)
+        self.assertEqual(self.graph.critical_path['f'], 1)
+
+    def testCycle(self):
+        self.assertRaises(FatalError, RecipeGraph, {'a': {'b'}, 'b': {'a'}, 'c': set()})
+
+    def testPriority(self):
+        a = RecipeStepPriority(self.graph, DummyRecipe('a'), 0, 'init')
+        e = RecipeStepPriority(self.graph, DummyRecipe('e'), 0, 'init')
+        f = RecipeStepPriority(self.graph, DummyRecipe('f'), 0, 'init')
+        self.assertLess(a, e)
+        self.assertLess(a, f)
+        self.assertEqual(e.inverse_priority, f.inverse_priority)
+
+
+class RecipeReadyTrackerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        config = DummyConfig()
+        config.cache_file = '/dev/null'
+        cls.cookbook = CookBook(config)
+
+    def _recipe_deps(self, recipes):
+        # same as Oven._cook_recipes
+        def all_deps_without_recipe(recipe_name):
+            return set((dep.name for dep in self.cookbook.list_recipe_deps(recipe_name) if recipe_name != dep.name))
+
+        all_deps = set()
+        for recipe in recipes:
+            all_deps.update(all_deps_without_recipe(recipe))
+        return dict((r, all_deps_without_recipe(r)) for r in set(recipes) | all_deps), all_deps
+
+    def _find_buildable_recipes(self, recipes, recipe_deps, built_recipes, building_recipes):
+        # the algorithm used by the Oven before the ready recipes were tracked
+        for recipe in recipes:
+            if recipe in built_recipes:
+                continue
+            if recipe in building_recipes:
+                continue
+            if len(recipe_deps[recipe]) == 0:
+                yield recipe
+                continue
+            built_deps = set((dep for dep in recipe_deps[recipe] if dep in built_recipes))
+            if len(built_deps) > 0 and built_deps == set(recipe_deps[recipe]):
+                yield recipe
+
+    def _check_build(self, recipes, no_deps=False):
+        recipe_deps, all_deps = self._recipe_deps(recipes)
+        built_recipes = set()
+        if no_deps:
+            built_recipes.update(all_deps - set(recipes))
+        else:
+            recipes = set(recipes) | all_deps
+        graph = RecipeGraph(recipe_deps)
+        tracker = RecipeReadyTracker(graph, built_recipes)
+
+        building_recipes = set(self._find_buildable_recipes(recipes, recipe_deps, built_recipes, set()))
+        ready = tracker.ready()
+        self.assertEqual(set(ready), building_recipes)
+        self.assertTrue(len(ready) > 0)
+        built_order = []
+        while ready:
+            # build the recipes in the order they become ready
+            recipe = ready.pop(0)
+            built_recipes.add(recipe)
+            building_recipes.remove(recipe)
+            built_order.append(recipe)
+            expected = set(self._find_buildable_recipes(recipes, recipe_deps, built_recipes, building_recipes))
+            new_ready = tracker.mark_built(recipe)
+            self.assertEqual(set(new_ready), expected)
+            building_recipes.update(expected)
+            ready.extend(new_ready)
+        self.assertEqual(set(built_order), set(recipes))
+        for recipe in built_order:
+            for dep in recipe_deps[recipe]:
+                if dep in recipes:
+                    self.assertLess(built_order.index(dep), built_order.index(recipe))
+
+    def testAllRecipes(self):
+        self._check_build([r.name for r in self.cookbook.get_recipes_list()])
+
+    def testTargetRecipe(self):
+        self._check_build(['gstreamer-1.0'])
+
+    def testNoDeps(self):
+        self._check_build(['glib', 'gstreamer-1.0'], no_deps=True)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def _run(self, budget, jobs):
+        events = []
+
+        async def compile(name, size, duration):
+            async with budget.reserve(size):
+                events.append(('start', name))
+                await asyncio.sleep(duration)
+                events.append(('end', name))
+
+        async def run():
+            await asyncio.gather(*[compile(*job) for job in jobs])
+
+        asyncio.get_event_loop().run_until_complete(run())
+        return events
+
+    def testAdmission(self):
+        budget = MemoryBudget(10)
+        events = self._run(budget, [('a', 6, 0.05), ('b', 4, 0.1), ('c', 6, 0)])
+        # 'c' doesn't fit until 'a' finishes
+        self.assertEqual(events[:2], [('start', 'a'), ('start', 'b')])
+        self.assertEqual(events.index(('start', 'c')), events.index(('end', 'a')) + 1)
+        self.assertEqual(budget.used, 0)
+
+    def testOversized(self):
+        # Recipes bigger than the budget are compiled alone
+        budget = MemoryBudget(10)
+        events = self._run(budget, [('a', 20, 0.01), ('b', 1, 0)])
+        self.assertEqual(events, [('start', 'a'), ('end', 'a'), ('start', 'b'), ('end', 'b')])
+        self.assertEqual(budget.reservations, 0)
+
+    def testReleaseOnce(self):
+        budget = MemoryBudget(10)
+        reservation = budget.reserve(4)
+        reservation.release()
+        self.assertEqual(budget.reservations, 0)
+        asyncio.get_event_loop().run_until_complete(reservation.acquire())
+        self.assertEqual(budget.used, 4)
+        reservation.release()
+        reservation.release()
+        self.assertEqual((budget.used, budget.reservations), (0, 0))
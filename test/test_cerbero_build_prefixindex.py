@@ -0,0 +1,158 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from cerbero.build import prefixindex
+from cerbero.utils import shell
+
+
+FILES = [
+    'README',
+    '.hidden',
+    'bin/gst-launch-1.0',
+    'include/gstreamer-1.0/gst/gst.h',
+    'include/gstreamer-1.0/gst/base/base.h',
+    'lib/libgstreamer-1.0.so.0.2400.0',
+    'lib/libgstreamer-1.0.a',
+    'lib/gstreamer-1.0/libgstcoreelements.so',
+    'lib/gstreamer-1.0/include/gst/gl/gstglconfig.h',
+    'lib/python3.11/site-packages/gi/__init__.py',
+    'lib/python3.11/site-packages/gi/.cache/x.pyc',
+    'share/locale/es/LC_MESSAGES/gstreamer-1.0.mo',
+    'share/locale/fr/LC_MESSAGES/gstreamer-1.0.mo',
+    'share/[x]/bracket',
+]
+
+PATTERNS = [
+    'README',
+    'missing',
+    '*',
+    '.*',
+    'lib/libgstreamer-1.0.so*',
+    'lib/*gstreamer*.so*',
+    'lib/libgstreamer-?.?.a',
+    'lib/*',
+    'lib/gstreamer-1.0',
+    'share/locale/*/LC_MESSAGES/gstreamer-1.0.mo',
+    'include/**/*.h',
+    'lib/**',
+    'lib/python3.11/**/*.py*',
+    'share/[[]x]/*',
+    'share/[!l]*/*',
+    'lib/libgstreamer-1.0.so',
+    'lib/libgstreamer-1.0.so.0',
+]
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        for f in FILES:
+            path = os.path.join(self.prefix, f)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('')
+        os.symlink('libgstreamer-1.0.so.0.2400.0', os.path.join(self.prefix, 'lib/libgstreamer-1.0.so.0'))
+        os.symlink('missing', os.path.join(self.prefix, 'lib/libgstreamer-1.0.so'))
+        os.symlink('gstreamer-1.0', os.path.join(self.prefix, 'lib/plugins'))
+        self.index = prefixindex.PrefixIndex(self.prefix)
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+        prefixindex.clear_indexes()
+
+    def testGlob(self):
+        prefix = Path(self.prefix)
+        for pattern in PATTERNS:
+            expected = sorted(p.relative_to(prefix).as_posix() for p in prefix.glob(pattern))
+            self.assertEqual(sorted(p for p in self.index.glob(pattern) if p), [p for p in expected if p != '.'])
+            expected = glob.glob(os.path.join(self.prefix, pattern), recursive=True)
+            expected = sorted(os.path.relpath(p, self.prefix).rstrip('/') for p in expected)
+            self.assertEqual(sorted(prefixindex.glob(pattern, self.prefix)), expected, pattern)
+
+    def testLookups(self):
+        self.assertTrue(self.index.exists('lib/libgstreamer-1.0.so.0'))
+        self.assertFalse(self.index.exists('lib/libgstreamer-1.0.so'))
+        self.assertTrue(self.index.isdir('lib/plugins'))
+        self.assertFalse(self.index.isdir('README'))
+        self.assertEqual(
+            sorted(self.index.ls_dir('include')),
+            sorted(shell.ls_dir(os.path.join(self.prefix, 'include'), self.prefix)),
+        )
+        self.assertEqual(
+            sorted(self.index.ls_dir('lib')), sorted(shell.ls_dir(os.path.join(self.prefix, 'lib'), self.prefix))
+        )
+
+    def testSymlinkedDirs(self):
+        # Paths inside symlinked directories are looked up in the filesystem
+        self.assertRaises(prefixindex.NotIndexed, self.index.exists, 'lib/plugins/libgstcoreelements.so')
+        self.assertTrue(prefixindex.exists('lib/plugins/libgstcoreelements.so', self.prefix))
+        self.assertEqual(prefixindex.ls_files(['lib/plugins/*.so'], self.prefix), ['lib/plugins/libgstcoreelements.so'])
+
+    def testRefresh(self):
+        index = prefixindex.get_prefix_index(self.prefix)
+        self.assertEqual(prefixindex.ls_files(['bin/*'], self.prefix), ['bin/gst-launch-1.0'])
+        os.makedirs(os.path.join(self.prefix, 'bin/sub'))
+        with open(os.path.join(self.prefix, 'bin/sub/gst-inspect-1.0'), 'w'):
+            pass
+        os.remove(os.path.join(self.prefix, 'bin/gst-launch-1.0'))
+        # Not seen until the index is marked as stale
+        self.assertEqual(prefixindex.ls_files(['bin/*'], self.prefix), ['bin/gst-launch-1.0'])
+        prefixindex.mark_stale()
+        self.assertTrue(index.stale)
+        self.assertEqual(prefixindex.ls_dir('bin', self.prefix), ['bin/sub/gst-inspect-1.0'])
+        shutil.rmtree(os.path.join(self.prefix, 'include'))
+        prefixindex.mark_stale(self.prefix)
+        self.assertFalse(prefixindex.isdir('include', self.prefix))
+        self.assertNotIn('include/gstreamer-1.0', index._dirs)
+
+    def testRacyRefresh(self):
+        bin_dir = os.path.join(self.prefix, 'bin')
+        st = os.stat(bin_dir)
+        signature = self.index.signature()
+        # Added in the same mtime tick as the last scan
+        with open(os.path.join(bin_dir, 'gst-inspect-1.0'), 'w'):
+            pass
+        os.utime(bin_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.index.stale = True
+        self.assertTrue(self.index.exists('bin/gst-inspect-1.0'))
+        self.assertNotEqual(self.index.signature(), signature)
+        # Directories scanned long after they changed are trusted
+        os.utime(bin_dir, (1000, 1000))
+        self.index.stale = True
+        self.index.refresh()
+        with open(os.path.join(bin_dir, 'gst-stats-1.0'), 'w'):
+            pass
+        os.utime(bin_dir, (1000, 1000))
+        self.index.stale = True
+        self.assertFalse(self.index.exists('bin/gst-stats-1.0'))
+
+    def testDisabled(self):
+        prefixindex.ENABLED = False
+        try:
+            self.assertIsNone(prefixindex.get_prefix_index(self.prefix))
+            self.assertEqual(prefixindex.ls_files(['bin/*'], self.prefix), ['bin/gst-launch-1.0'])
+        finally:
+            prefixindex.ENABLED = True
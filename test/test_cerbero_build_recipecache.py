@@ -0,0 +1,128 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.cookbook import CookBook
+from cerbero.build.recipecache import LazyRecipe, RecipesCache
+from cerbero.enums import License
+from cerbero.build.source import SourceType
+from test.test_common import DummyConfig
+
+
+RECIPE = """
+class Recipe(recipe.Recipe):
+    name = 'test-recipe'
+    version = '%(version)s'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    deps = ['test-dep']
+    licenses = [License.LGPLv2Plus]
+    licenses_bins = [License.GPLv2Plus]
+    files_libs = ['libtest']
+    files_bins = ['test']
+"""
+
+DEP_RECIPE = """
+class Recipe(recipe.Recipe):
+    name = 'test-dep'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    licenses = [License.BSD]
+"""
+
+
+class RecipesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.recipes_dir = self.tmp
+        self.config.home_dir = self.tmp
+        self.config.cache_file = '/dev/null'
+        self._write_recipe('1.0')
+        with open(os.path.join(self.tmp, 'test-dep.recipe'), 'w') as f:
+            f.write(DEP_RECIPE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write_recipe(self, version):
+        with open(os.path.join(self.tmp, 'test-recipe.recipe'), 'w') as f:
+            f.write(RECIPE % {'version': version})
+
+    def testLazyWithoutCache(self):
+        cookbook = CookBook(self.config, lazy=True)
+        recipe = cookbook.get_recipe('test-recipe')
+        self.assertNotIsInstance(recipe, LazyRecipe)
+        self.assertTrue(os.path.exists(RecipesCache(self.config).path))
+
+    def testNotLazyWithoutCache(self):
+        CookBook(self.config)
+        self.assertFalse(os.path.exists(RecipesCache(self.config).path))
+
+    def testLazyFromCache(self):
+        CookBook(self.config, lazy=True)
+        loaded = CookBook(self.config).get_recipe('test-recipe')
+        cookbook = CookBook(self.config, lazy=True)
+        recipe = cookbook.get_recipe('test-recipe')
+        self.assertIsInstance(recipe, LazyRecipe)
+        self.assertEqual(recipe.name, loaded.name)
+        self.assertEqual(recipe.version, loaded.version)
+        self.assertEqual(recipe.built_version(), loaded.built_version())
+        self.assertEqual(recipe.list_deps(), loaded.list_deps())
+        self.assertEqual(recipe.stype, SourceType.CUSTOM)
+        self.assertEqual(recipe.categories, loaded.categories)
+        self.assertEqual(recipe.__file__, loaded.__file__)
+        licenses = recipe.list_licenses_by_categories(['libs', 'bins', None])
+        self.assertEqual(
+            licenses, {'libs': [License.LGPLv2Plus], 'bins': [License.GPLv2Plus], None: [License.LGPLv2Plus]}
+        )
+        self.assertEqual([r.name for r in cookbook.list_recipe_deps('test-recipe')], ['test-dep', 'test-recipe'])
+        self.assertFalse(recipe.is_loaded())
+        # Any other attribute loads the recipe
+        self.assertEqual(recipe.files_libs, ['libtest'])
+        self.assertTrue(recipe.is_loaded())
+        self.assertEqual(recipe.config, self.config)
+
+    def testRecipeChanged(self):
+        CookBook(self.config, lazy=True)
+        self._write_recipe('2.0')
+        cookbook = CookBook(self.config, lazy=True)
+        recipe = cookbook.get_recipe('test-recipe')
+        self.assertNotIsInstance(recipe, LazyRecipe)
+        self.assertEqual(recipe.version, '2.0')
+        self.assertIsInstance(cookbook.get_recipe('test-dep'), LazyRecipe)
+
+    def testConfigChanged(self):
+        path = RecipesCache(self.config).path
+        self.config.variants.override(['nogi'])
+        self.assertNotEqual(path, RecipesCache(self.config).path)
+
+    def testParallelLoading(self):
+        self.config.parallel_recipes_loading = True
+        self.config.num_of_cpus = 2
+        cookbook = CookBook(self.config, lazy=True)
+        recipe = cookbook.get_recipe('test-recipe')
+        self.assertIsInstance(recipe, LazyRecipe)
+        self.assertIsInstance(cookbook.get_recipe('test-dep'), LazyRecipe)
+        self.assertEqual(recipe.list_deps(), ['test-dep'])
+        self.assertEqual(recipe.load().version, '1.0')
@@ -0,0 +1,108 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from cerbero.build import source
+from cerbero.build.cookbook import CookBook
+from cerbero.build.sourcestore import SourceStore
+from cerbero.errors import CommandError
+from cerbero.utils import run_until_complete
+from test.test_common import DummyConfig
+
+
+RECIPE = """
+class Recipe(recipe.Recipe):
+    name = 'test-tarball'
+    version = '1.0'
+    url = 'https://example.invalid/%(name)s-%(version)s.tar.gz'
+    tarball_checksum = '%(checksum)s'
+    stype = SourceType.TARBALL
+    btype = BuildType.MESON
+    meson_subprojects = ['subproj']
+    licenses = [License.LGPLv2Plus]
+
+    async def meson_subprojects_extract(self, offline):
+        pass
+"""
+
+
+class TarballFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.recipes_dir = os.path.join(self.tmp, 'recipes')
+        self.config.home_dir = self.tmp
+        self.config.cache_file = '/dev/null'
+        self.config.local_sources = os.path.join(self.tmp, 'local')
+        self.config.sources = os.path.join(self.tmp, 'sources')
+        self.config.cached_sources = os.path.join(self.tmp, 'cached')
+        self.config.logs = os.path.join(self.tmp, 'logs')
+        self.config.source_store = os.path.join(self.tmp, 'store')
+        self.config.extract_cache = None
+        self.config.extract_git_init = False
+        os.makedirs(self.config.recipes_dir)
+        checksum = self._tarball()
+        with open(os.path.join(self.config.recipes_dir, 'test-tarball.recipe'), 'w') as f:
+            f.write(RECIPE % {'checksum': checksum, 'name': '%(name)s', 'version': '%(version)s'})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _tarball(self):
+        content = os.path.join(self.tmp, 'test-tarball-1.0')
+        os.makedirs(content)
+        with open(os.path.join(content, 'meson.build'), 'w') as f:
+            f.write("project('test-tarball')\n")
+        path = os.path.join(self.tmp, 'test-tarball-1.0.tar.gz')
+        with tarfile.open(path, 'w:gz') as tf:
+            tf.add(content, arcname='test-tarball-1.0')
+        with open(path, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        SourceStore.from_config(self.config).add(checksum, path)
+        return checksum
+
+    def testCorruptedTarballDuringFetch(self):
+        recipe = CookBook(self.config).get_recipe('test-tarball')
+        unpack = source.shell.unpack
+        calls = []
+
+        async def failing_unpack(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise CommandError('corrupted tarball', ['tar'], 2)
+            await unpack(*args, **kwargs)
+
+        async def fetch():
+            # The redownload must not wait on the fetch lock of the tarball
+            await asyncio.wait_for(recipe.fetch(), 30)
+
+        with mock.patch.object(source.shell, 'unpack', failing_unpack):
+            run_until_complete(fetch())
+        self.assertEqual(len(calls), 2)
+        fname = os.path.join(recipe.download_dir, recipe.tarball_name)
+        self.assertTrue(os.path.exists(fname + '.failed-extract'))
+        self.assertTrue(os.path.exists(os.path.join(recipe.src_dir, 'meson.build')))
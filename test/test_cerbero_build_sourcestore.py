@@ -0,0 +1,83 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.sourcestore import SourceStore
+
+
+class SourceStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = SourceStore(os.path.join(self.tmp, 'store'))
+        self.downloads = os.path.join(self.tmp, 'downloads')
+        os.makedirs(self.downloads)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _tarball(self, name, size, mtime=None):
+        path = os.path.join(self.downloads, name)
+        data = os.urandom(size)
+        with open(path, 'wb') as f:
+            f.write(data)
+        checksum = hashlib.sha256(data).hexdigest()
+        self.store.add(checksum, path)
+        if mtime is not None:
+            os.utime(self.store.file_path(checksum), (mtime, mtime))
+        return path, checksum
+
+    def testAddLink(self):
+        path, checksum = self._tarball('a.tar.xz', 100)
+        dest = os.path.join(self.tmp, 'other-config', 'a.tar.xz')
+        self.assertTrue(self.store.link(checksum, dest))
+        with open(path, 'rb') as f1, open(dest, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        # Hard linked from the download directories
+        self.assertEqual(os.stat(self.store.file_path(checksum)).st_nlink, 3)
+        self.assertFalse(self.store.link('0' * 64, dest + '.missing'))
+        self.assertFalse(self.store.link(None, dest + '.missing'))
+        self.assertFalse(os.path.exists(dest + '.missing'))
+
+    def testLRU(self):
+        _, old = self._tarball('old.tar.xz', 1000, mtime=1000)
+        _, used = self._tarball('used.tar.xz', 1000, mtime=2000)
+        _, new = self._tarball('new.tar.xz', 1000, mtime=3000)
+        # Using a file makes it the most recently used one
+        self.store.link(used, os.path.join(self.tmp, 'used.tar.xz'))
+        self.store.max_size = 2500
+        self._tarball('newest.tar.xz', 500)
+        checksums = [os.path.basename(p) for p, _ in self.store.list_files()]
+        self.assertNotIn(old, checksums)
+        self.assertEqual(checksums[:2], [new, used])
+
+    def testGC(self):
+        path, checksum = self._tarball('a.tar.xz', 1000, mtime=1000)
+        unlinked, unlinked_checksum = self._tarball('b.tar.xz', 2000, mtime=2000)
+        os.remove(unlinked)
+        self.assertEqual(self.store.gc(max_size=0, dry_run=True), (2, 3000, 2000))
+        self.assertEqual(len(self.store.list_files()), 2)
+        self.assertEqual(self.store.gc(max_age=3600), (2, 3000, 2000))
+        self.assertEqual(self.store.list_files(), [])
+        # Files linked from the download directories are kept there
+        self.assertTrue(os.path.exists(path))
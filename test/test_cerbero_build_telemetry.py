@@ -0,0 +1,135 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.telemetry import BuildTelemetry, TimedLock
+from cerbero.errors import AbortedError
+from cerbero.utils.shell import ProcessUsage, _process_usage
+
+
+class BuildTelemetryTest(unittest.TestCase):
+    def setUp(self):
+        self.telemetry = BuildTelemetry({KeyError: 'retry'})
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _event(self, recipe, step, start, end, worker=0):
+        with self.telemetry.record_step(recipe, step) as event:
+            pass
+        event.start = start
+        event.end = end
+        event.worker = worker
+        return event
+
+    def testRecordStep(self):
+        self.telemetry.start_worker(1, 'compile')
+        with self.telemetry.record_step('a', 'compile', 0.5) as event:
+            pass
+        self.assertEqual(event.status, 'ok')
+        self.assertEqual(event.worker, 1)
+        self.assertEqual(event.queue_wait, 0.5)
+        self.assertLessEqual(event.start, event.end)
+        with self.telemetry.record_step('a', 'install') as event:
+            event.status = 'skipped'
+        self.assertEqual(event.status, 'skipped')
+        for exc, status in ((AbortedError, 'aborted'), (KeyError, 'retry'), (ValueError, 'failed')):
+            with self.assertRaises(exc):
+                with self.telemetry.record_step('b', 'compile'):
+                    raise exc()
+            self.assertEqual(self.telemetry.events[-1].status, status)
+        self.assertEqual(len(self.telemetry.events), 5)
+
+    def testTimedLock(self):
+        telemetry = self.telemetry
+        lock = TimedLock(asyncio.Lock(), 'install')
+
+        async def worker(worker_id, hold):
+            telemetry.start_worker(worker_id, 'install')
+            async with lock:
+                with telemetry.record_step('r%d' % worker_id, 'install'):
+                    await asyncio.sleep(hold)
+
+        async def run():
+            await asyncio.gather(worker(0, 0.1), worker(1, 0))
+
+        asyncio.get_event_loop().run_until_complete(run())
+        waits = dict((e.recipe, e.lock_waits['install']) for e in telemetry.events)
+        self.assertLess(waits['r0'], 0.05)
+        self.assertGreaterEqual(waits['r1'], 0.05)
+
+    def testProcessUsage(self):
+        with self.telemetry.record_step('a', 'compile') as event:
+            # What async_call() does for each command it runs
+            for sink in _process_usage.get():
+                sink.add(ProcessUsage(1, 2.0, 3.0, 0.5, 200 * 1024 * 1024))
+        self._event('a', 'install', 2, 3).usage.add(ProcessUsage(1, 1.0, 0.5, 0.5, 10 * 1024 * 1024))
+        self.assertEqual(event.usage.count, 1)
+        self.assertEqual(_process_usage.get(), ())
+        total, steps = self.telemetry.recipe_usage()['a']
+        self.assertEqual(total.count, 2)
+        self.assertEqual(total.utime, 3.5)
+        self.assertEqual(total.maxrss, 200 * 1024 * 1024)
+        self.assertEqual(list(steps), ['compile', 'install'])
+        args = self.telemetry.to_chrome_trace()['traceEvents'][0]['args']
+        self.assertEqual(args['peak_rss_mb'], 200)
+        self.assertEqual(args['user_cpu_s'], 3)
+        self.assertIn('peak RSS 200.0 MiB', self.telemetry.summary({})[-1])
+
+    def testCriticalPath(self):
+        # a -> b -> d and c in parallel, d depends on the slower of b and c
+        self._event('a', 'fetch', 0, 1)
+        self._event('a', 'compile', 1, 3)
+        self._event('b', 'compile', 3, 5)
+        self._event('c', 'compile', 3, 8, worker=1)
+        self._event('d', 'compile', 8, 9)
+        deps = {'a': set(), 'b': {'a'}, 'c': {'a'}, 'd': {'a', 'b', 'c'}}
+        path = self.telemetry.critical_path(deps)
+        self.assertEqual([p[0] for p in path], ['a', 'c', 'd'])
+        self.assertEqual(path[0][1:3], (0, 3))
+        self.assertEqual(dict(path[0][3]), {'fetch': 1, 'compile': 2})
+        lines = self.telemetry.summary(deps)
+        self.assertTrue(lines[2].startswith('a '))
+        self.assertIn('compile (2.0s)', lines[2])
+
+    def testChromeTrace(self):
+        self.telemetry.start_worker(3, 'fetch')
+        event = self._event('a', 'fetch', 0.25, 1.5, worker=3)
+        event.lock_waits = {'install': 0.002}
+        path = os.path.join(self.tmp, 'logs', 'build-trace.json')
+        self.telemetry.write_chrome_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        metadata = [e for e in trace['traceEvents'] if e['ph'] == 'M']
+        self.assertEqual(metadata[0]['tid'], 3)
+        self.assertEqual(metadata[0]['args']['name'], 'worker 3 (fetch)')
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['name'], 'a:fetch')
+        self.assertEqual(events[0]['ts'], 250000)
+        self.assertEqual(events[0]['dur'], 1250000)
+        self.assertEqual(events[0]['args']['status'], 'ok')
+        self.assertEqual(events[0]['args']['install_lock_wait_ms'], 2.0)
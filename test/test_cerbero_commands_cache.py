@@ -0,0 +1,148 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.cookbook import CookBook
+from cerbero.commands.cache import FetchCache, GenCache
+from cerbero.errors import FatalError
+from cerbero.utils import run_until_complete
+from test.test_common import DummyConfig
+
+
+RECIPE = """
+class Recipe(recipe.Recipe):
+    name = '%(name)s'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    files_misc = ['share/%(name)s']
+"""
+
+
+class ChunkedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.home_dir = os.path.join(self.tmp, 'home')
+        self.config.prefix = os.path.join(self.config.home_dir, 'dist')
+        self.config.recipes_dir = os.path.join(self.tmp, 'recipes')
+        self.config.cache_file = 'linux_x86_64.cache'
+        self.config.build_tools_cache = 'build-tools.cache'
+        build_tools = self.config.build_tools_config
+        build_tools.home_dir = self.config.home_dir
+        build_tools.prefix = os.path.join(self.config.home_dir, 'build-tools')
+        build_tools.recipes_dir = os.path.join(self.tmp, 'build-tools-recipes')
+        build_tools.cache_file = self.config.build_tools_cache
+        for recipes_dir, prefix, names in (
+            (self.config.recipes_dir, 'dist', ('recipe-a', 'recipe-b')),
+            (build_tools.recipes_dir, 'build-tools', ('tool',)),
+        ):
+            os.makedirs(recipes_dir)
+            for name in names:
+                with open(os.path.join(recipes_dir, name + '.recipe'), 'w') as f:
+                    f.write(RECIPE % {'name': name})
+                self._write(os.path.join(prefix, 'share', name), name)
+        self._write('dist/lib/leftover', 'leftover')
+        self._write('dist/var/tmp/junk', 'junk')
+        self._write('build-tools/bin/other', 'other')
+        # Creates the status files
+        CookBook(self.config)
+        CookBook(build_tools)
+        self.in_files = ['build-tools', self.config.build_tools_cache, 'dist', self.config.cache_file]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, path, content):
+        path = os.path.join(self.config.home_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _gen_chunks(self):
+        return GenCache().gen_chunks(self.config, self.config.home_dir, self.in_files, 'zstd', 1, ['var/tmp'])
+
+    def testSplitChunks(self):
+        chunks = dict(GenCache().split_chunks(self.config, self.config.home_dir, self.in_files, ['var/tmp']))
+        self.assertEqual(list(chunks), ['base', 'status', 'recipe-a', 'recipe-b', 'build-tools/tool'])
+        self.assertEqual(chunks['status'], ['build-tools.cache', 'linux_x86_64.cache'])
+        self.assertEqual(chunks['recipe-a'], ['dist/share/recipe-a'])
+        self.assertEqual(chunks['recipe-b'], ['dist/share/recipe-b'])
+        self.assertEqual(chunks['build-tools/tool'], ['build-tools/share/tool'])
+        self.assertIn('build-tools/bin/other', chunks['base'])
+        self.assertIn('dist/lib/leftover', chunks['base'])
+        self.assertNotIn('dist/var/tmp/junk', chunks['base'])
+
+    def testSplitChunksKeepsStatus(self):
+        cookbook = CookBook(self.config)
+        cookbook.update_step_status('recipe-a', 'install')
+        # A stale built version resets the status when the recipes are loaded
+        cookbook.status['recipe-a'].built_version = 'stale'
+        cookbook.save()
+        self.config.cookbook = None
+        GenCache().split_chunks(self.config, self.config.home_dir, self.in_files, ['var/tmp'])
+        status = CookBook(self.config, reset_status=False).status['recipe-a']
+        self.assertEqual(status.steps, ['install'])
+        self.assertEqual(status.built_version, 'stale')
+
+    def testOnlyChangedChunks(self):
+        manifest = self._gen_chunks()
+        files = dict((c['name'], c['file']) for c in manifest['chunks'])
+        self.assertEqual(len(os.listdir(GenCache().get_chunks_dir(self.config))), 5)
+        self._write('dist/share/recipe-b', 'changed')
+        os.utime(os.path.join(self.config.prefix, 'share/recipe-b'), (0, 0))
+        manifest = self._gen_chunks()
+        new_files = dict((c['name'], c['file']) for c in manifest['chunks'])
+        self.assertEqual(files['base'], new_files['base'])
+        self.assertEqual(files['recipe-a'], new_files['recipe-a'])
+        self.assertEqual(files['build-tools/tool'], new_files['build-tools/tool'])
+        self.assertNotEqual(files['recipe-b'], new_files['recipe-b'])
+
+    def testFetchChunks(self):
+        gen = GenCache()
+        manifest = self._gen_chunks()
+        # Publish the cache like upload-cache does
+        remote = os.path.join(self.tmp, 'remote')
+        shutil.copytree(gen.get_chunks_dir(self.config), os.path.join(remote, gen.chunks_dirname))
+        manifest_path = os.path.join(remote, 'sha-' + gen.manifest_filename)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        dep = {'commit': 'sha', 'checksum': gen.checksum(manifest_path), 'url': 'file://' + manifest_path}
+
+        # Only the chunk of recipe-b is missing locally
+        shutil.rmtree(os.path.join(self.config.home_dir, 'dist'))
+        shutil.rmtree(os.path.join(self.config.home_dir, 'build-tools'))
+        recipe_b = [c for c in manifest['chunks'] if c['name'] == 'recipe-b'][0]
+        os.remove(os.path.join(gen.get_chunks_dir(self.config), recipe_b['file']))
+        fetch = FetchCache()
+        fetch.dry_run = False
+        run_until_complete(fetch.fetch_chunked_dep(self.config, dep))
+        for path in ('dist/share/recipe-a', 'dist/share/recipe-b', 'build-tools/share/tool', 'build-tools/bin/other'):
+            self.assertTrue(os.path.exists(os.path.join(self.config.home_dir, path)))
+
+        # Corrupted chunks are downloaded again
+        with open(os.path.join(remote, gen.chunks_dirname, recipe_b['file']), 'wb') as f:
+            f.write(b'corrupted')
+        with open(os.path.join(gen.get_chunks_dir(self.config), recipe_b['file']), 'wb') as f:
+            f.write(b'corrupted')
+        self.assertRaises(FatalError, run_until_complete, fetch.fetch_chunked_dep(self.config, dep))
@@ -0,0 +1,136 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from cerbero.enums import Platform
+from cerbero.tools import depstracker, macho
+from cerbero.tools.depstracker import DepsCache, DepsTracker
+from cerbero.utils import shell
+from test.test_cerbero_tools_macho import mach_o
+
+
+def pe(dlls):
+    # PE32+ with a single section with the import descriptors and the names
+    dos = b'MZ' + b'\0' * 58 + struct.pack('<I', 0x40)
+    coff = b'PE\0\0' + struct.pack('<HHIIIHH', 0x8664, 1, 0, 0, 0, 240, 0)
+    optional = bytearray(240)
+    struct.pack_into('<H', optional, 0, 0x20B)
+    struct.pack_into('<I', optional, 108, 16)
+    struct.pack_into('<II', optional, 112 + 8, 0x1000, 20 * (len(dlls) + 1))
+    section = struct.pack('<8sIIII', b'.idata', 0x200, 0x1000, 0x200, 0x200) + b'\0' * 16
+    headers = dos + coff + bytes(optional) + section
+    descriptors = b''
+    names = b''
+    for dll in dlls:
+        descriptors += struct.pack('<IIIII', 0, 0, 0, 0x1100 + len(names), 0)
+        names += dll.encode() + b'\0'
+    data = descriptors + b'\0' * (0x100 - len(descriptors)) + names
+    return headers + b'\0' * (0x200 - len(headers)) + data + b'\0' * (0x200 - len(data))
+
+
+class DepsTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'prefix')
+        for d in ('bin', 'lib'):
+            os.makedirs(os.path.join(self.prefix, d))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, data):
+        path = os.path.join(self.prefix, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _c_file(self, name, code):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(code)
+        return path
+
+    @unittest.skipIf(shutil.which('gcc') is None, 'Requires gcc')
+    def testElf(self):
+        lib = os.path.join(self.prefix, 'lib')
+        bar = self._c_file('bar.c', 'int bar(void) { return 1; }\n')
+        foo = self._c_file('foo.c', 'int bar(void);\nint foo(void) { return bar(); }\n')
+        main = self._c_file('main.c', 'int foo(void);\nint main(void) { return foo(); }\n')
+        shell.new_call(['gcc', '-shared', '-fPIC', '-Wl,-soname,libbar.so.1', '-o', lib + '/libbar.so.1.0', bar])
+        os.symlink('libbar.so.1.0', lib + '/libbar.so.1')
+        os.symlink('libbar.so.1', lib + '/libbar.so')
+        shell.new_call(['gcc', '-shared', '-fPIC', '-o', lib + '/libfoo.so', foo, '-L' + lib, '-lbar'])
+        app = os.path.join(self.prefix, 'bin', 'app')
+        shell.new_call(['gcc', '-o', app, main, '-L' + lib, '-lfoo', '-lbar', '-Wl,-rpath,$ORIGIN/../lib'])
+
+        needed, rpaths = depstracker.read_elf_deps(app)
+        self.assertIn('libfoo.so', needed)
+        self.assertEqual(rpaths, ['$ORIGIN/../lib'])
+
+        cache_file = os.path.join(self.tmp, 'deps.cache')
+        tracker = DepsTracker(Platform.LINUX, self.prefix, DepsCache(cache_file))
+        self.assertEqual(tracker.file_deps(lib + '/libfoo.so'), [lib + '/libbar.so.1'])
+        closures = tracker.closure([app, lib + '/libfoo.so', lib + '/libbar.so.1.0'])
+        self.assertEqual(closures[app], [lib + '/libbar.so.1.0', lib + '/libfoo.so'])
+        self.assertEqual(closures[lib + '/libfoo.so'], [lib + '/libbar.so.1.0'])
+        self.assertEqual(closures[lib + '/libbar.so.1.0'], [])
+        self.assertEqual(
+            sorted(tracker.list_deps(app)), ['bin/app', 'lib/libbar.so.1', 'lib/libbar.so.1.0', 'lib/libfoo.so']
+        )
+
+        # The cache is used while the files don't change
+        tracker.cache.save()
+        cache = DepsCache(cache_file)
+        self.assertEqual(cache.read(app), (needed, rpaths))
+        os.remove(lib + '/libfoo.so')
+        shell.new_call(['gcc', '-shared', '-fPIC', '-o', lib + '/libfoo.so', foo])
+        self.assertEqual(DepsTracker(Platform.LINUX, self.prefix, cache).file_deps(lib + '/libfoo.so'), [])
+
+    def testPE(self):
+        app = self._write('bin/app.exe', pe(['libfoo-1.dll', 'KERNEL32.dll']))
+        foo = self._write('bin/LIBFOO-1.DLL', pe(['libbar-1.dll']))
+        bar = self._write('bin/libbar-1.dll', pe([]))
+        self.assertEqual(depstracker.read_pe_deps(app), ['libfoo-1.dll', 'KERNEL32.dll'])
+        tracker = DepsTracker(Platform.WINDOWS, self.prefix)
+        self.assertEqual(tracker.closure([app])[app], [bar, foo])
+
+    def testMachO(self):
+        lib = os.path.join(self.prefix, 'lib')
+        app = self._write(
+            'bin/app',
+            mach_o(
+                [
+                    (macho.LC_LOAD_DYLIB, '@rpath/libfoo.dylib'),
+                    (macho.LC_LOAD_DYLIB, '/usr/lib/libSystem.B.dylib'),
+                    (macho.LC_RPATH, '@loader_path/../lib'),
+                ]
+            ),
+        )
+        foo = self._write('lib/libfoo.dylib', mach_o([(macho.LC_LOAD_DYLIB, lib + '/libbar.dylib')]))
+        bar = self._write('lib/libbar.dylib', mach_o([(macho.LC_ID_DYLIB, '@rpath/libbar.dylib')]))
+        tracker = DepsTracker(Platform.DARWIN, self.prefix)
+        self.assertEqual(tracker.closure([app])[app], [bar, foo])
+        # Files that are not binaries have no dependencies
+        text = self._write('lib/foo.pc', b'prefix=/usr\n')
+        self.assertEqual(tracker.file_deps(text), [])
@@ -0,0 +1,301 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from cerbero.tools import macho
+from cerbero.tools.osxrelocator import OSXRelocator
+from cerbero.tools.prefixrelocator import PrefixRelocator
+
+
+def path_command(cmd, path, is64, endian):
+    # dylib_command has the timestamp and versions after the name offset
+    path_offset = 24 if cmd != macho.LC_RPATH else 12
+    align = 8 if is64 else 4
+    data = path.encode('utf-8') + b'\0'
+    size = path_offset + len(data)
+    size += -size % align
+    header = struct.pack(endian + 'III', cmd, size, path_offset)
+    if cmd != macho.LC_RPATH:
+        header += struct.pack(endian + 'III', 2, 0x10000, 0x10000)
+    return header + data + b'\0' * (size - path_offset - len(data))
+
+
+def segment_command(first_section, is64, endian):
+    if is64:
+        cmd = struct.pack(
+            endian + 'II16sQQQQIIII', macho.LC_SEGMENT_64, 72 + 80, b'__TEXT', 0, 0x2000, 0, 0x2000, 5, 5, 1, 0
+        )
+        sect = struct.pack(
+            endian + '16s16sQQIIIIIIII', b'__text', b'__TEXT', first_section, 16, first_section, 0, 0, 0, 0, 0, 0, 0
+        )
+    else:
+        cmd = struct.pack(
+            endian + 'II16sIIIIIIII', macho.LC_SEGMENT, 56 + 68, b'__TEXT', 0, 0x2000, 0, 0x2000, 5, 5, 1, 0
+        )
+        sect = struct.pack(
+            endian + '16s16sIIIIIIIII', b'__text', b'__TEXT', first_section, 16, first_section, 0, 0, 0, 0, 0, 0
+        )
+    return cmd + sect
+
+
+def mach_o(paths, is64=True, endian='<', first_section=0x1000, signed=False):
+    cmds = [segment_command(first_section, is64, endian)]
+    cmds += [path_command(cmd, path, is64, endian) for cmd, path in paths]
+    if signed:
+        # linkedit_data_command pointing past the sections
+        cmds.append(struct.pack(endian + 'IIII', macho.LC_CODE_SIGNATURE, 16, first_section + 16, 0))
+    ncmds = len(cmds)
+    cmds = b''.join(cmds)
+    magic = macho.MH_MAGIC_64 if is64 else macho.MH_MAGIC
+    header = struct.pack(endian + 'IiiIIII', magic, 7, 3, 6, ncmds, len(cmds), 0)
+    if is64:
+        header += b'\0' * 4
+    data = header + cmds
+    assert len(data) <= first_section
+    return data + b'\0' * (first_section - len(data)) + b'\xc3' * 16
+
+
+def fat(slices):
+    data = struct.pack('>II', macho.FAT_MAGIC, len(slices))
+    offset = 0x1000
+    body = b''
+    for i, s in enumerate(slices):
+        data += struct.pack('>iiIII', 7, 3, offset + len(body), len(s), 12)
+        body += s + b'\0' * (-len(s) % 0x1000)
+    return data + b'\0' * (offset - len(data)) + body
+
+
+PATHS = [
+    (macho.LC_ID_DYLIB, '/old/home/build-tools/lib/libfoo.dylib'),
+    (macho.LC_LOAD_DYLIB, '/old/home/build-tools/lib/libbar.dylib'),
+    (macho.LC_LOAD_DYLIB, '/usr/lib/libSystem.B.dylib'),
+    (macho.LC_RPATH, '/old/home/build-tools/lib'),
+]
+
+
+class MachOTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def testParse(self):
+        for is64, endian in ((True, '<'), (False, '>')):
+            path = self._write('libfoo.dylib', mach_o(PATHS, is64, endian))
+            self.assertTrue(macho.is_mach_o(path))
+            with macho.MachO(path) as m:
+                self.assertEqual(m.dylib_id(), PATHS[0][1])
+                self.assertEqual(m.shared_libraries(), [PATHS[1][1], PATHS[2][1]])
+                self.assertEqual(m.rpaths(), [PATHS[3][1]])
+
+    def testNotMachO(self):
+        path = self._write('text', b'#!/bin/sh\necho /old/home\n')
+        self.assertFalse(macho.is_mach_o(path))
+        self.assertRaises(macho.MachOError, macho.MachO, path)
+        # Java class files use the same magic as fat files
+        path = self._write('Foo.class', struct.pack('>IHH', macho.FAT_MAGIC, 0, 52))
+        self.assertFalse(macho.is_mach_o(path))
+
+    def testReplacePrefix(self):
+        for new in ('/new', '/a/much/longer/path/for/the/new/home/directory'):
+            path = self._write('libfoo.dylib', mach_o(PATHS))
+            size = os.path.getsize(path)
+            with macho.MachO(path, writable=True) as m:
+                self.assertEqual(m.replace_prefix('/old/home', new), 3)
+            with macho.MachO(path) as m:
+                self.assertEqual(m.dylib_id(), new + '/build-tools/lib/libfoo.dylib')
+                self.assertEqual(
+                    m.shared_libraries(), [new + '/build-tools/lib/libbar.dylib', '/usr/lib/libSystem.B.dylib']
+                )
+                self.assertEqual(m.rpaths(), [new + '/build-tools/lib'])
+            # Section data is untouched
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read()[0x1000:], b'\xc3' * 16)
+            self.assertEqual(os.path.getsize(path), size)
+
+    def testEdit(self):
+        path = self._write('libfoo.dylib', fat([mach_o(PATHS), mach_o(PATHS, False, '>')]))
+        with macho.MachO(path, writable=True) as m:
+            self.assertFalse(m.has_code_signature())
+            count = m.edit(
+                lambda cmd, p: '@rpath/libfoo.dylib' if cmd == macho.LC_ID_DYLIB else p,
+                delete_rpaths=['/old/home/build-tools/lib'],
+                add_rpaths=['@loader_path/../lib', '@loader_path/../lib', '@executable_path/../lib'],
+            )
+            # The ID, the deleted rpath and the two added, in each slice
+            self.assertEqual(count, 8)
+        with macho.MachO(path) as m:
+            for s in m.slices:
+                self.assertEqual(len(s.commands), len(PATHS) + 2)
+            self.assertEqual(m.dylib_id(), '@rpath/libfoo.dylib')
+            self.assertEqual(m.shared_libraries(), [PATHS[1][1], PATHS[2][1]])
+            self.assertEqual(m.rpaths(), ['@loader_path/../lib', '@executable_path/../lib'])
+
+    def testOSXRelocator(self):
+        prefix = os.path.join(self.tmp, 'prefix')
+        paths = [
+            (macho.LC_ID_DYLIB, prefix + '/lib/libfoo.dylib'),
+            (macho.LC_LOAD_DYLIB, prefix + '/lib/libbar.dylib'),
+            (macho.LC_LOAD_DYLIB, '/usr/lib/libSystem.B.dylib'),
+            (macho.LC_RPATH, prefix + '/lib'),
+            (macho.LC_RPATH, '@loader_path/../lib'),
+        ]
+        lib = self._write('prefix/lib/libfoo.dylib', mach_o(paths))
+        plugin = self._write('prefix/lib/gstreamer-1.0/libgstfoo.so', mach_o(paths[1:]))
+        static = self._write('prefix/lib/libfoo.a', b'!<arch>\n')
+        OSXRelocator(prefix, prefix, True).relocate_files([lib, plugin, static], jobs=2)
+        with macho.MachO(lib) as m:
+            self.assertEqual(m.dylib_id(), '@rpath/libfoo.dylib')
+            self.assertEqual(m.shared_libraries(), ['@rpath/libbar.dylib', '/usr/lib/libSystem.B.dylib'])
+            self.assertEqual(m.rpaths(), ['@loader_path/../lib', '@executable_path/../lib'])
+        with macho.MachO(plugin) as m:
+            self.assertIsNone(m.dylib_id())
+            self.assertEqual(m.shared_libraries(), ['@rpath/libbar.dylib', '/usr/lib/libSystem.B.dylib'])
+            self.assertEqual(
+                m.rpaths(),
+                [
+                    '@loader_path/../lib',
+                    '@loader_path/../../lib',
+                    '@executable_path/../../lib',
+                    '@executable_path/../lib',
+                    '@loader_path/..',
+                    '@executable_path/..',
+                ],
+            )
+
+    def testOSXRelocatorUniversal(self):
+        slices = []
+        for arch in ('x86_64', 'arm64'):
+            libdir = os.path.join(self.tmp, arch, 'lib')
+            paths = [(macho.LC_ID_DYLIB, libdir + '/libfoo.dylib'), (macho.LC_LOAD_DYLIB, libdir + '/libbar.dylib')]
+            slices.append(mach_o(paths + [(macho.LC_RPATH, libdir)]))
+        lib = self._write('universal/lib/libfoo.dylib', fat(slices))
+        x86_64, arm64 = os.path.join(self.tmp, 'x86_64'), os.path.join(self.tmp, 'arm64')
+        relocator = OSXRelocator(os.path.join(self.tmp, 'universal'), x86_64, False, other_prefixes=[arm64])
+        relocator.relocate_file(lib, os.path.join(x86_64, 'lib', 'libfoo.dylib'))
+        with macho.MachO(lib) as m:
+            self.assertEqual(m.shared_libraries(True), ['@rpath/libbar.dylib'])
+            self.assertEqual(m.rpaths(True), ['@loader_path/../lib', '@executable_path/../lib'])
+            for s in m.slices:
+                ids = [c.path for c in s.commands if c.cmd == macho.LC_ID_DYLIB]
+                self.assertEqual(ids, ['@rpath/libfoo.dylib'])
+
+    def testNoSpace(self):
+        data = mach_o(PATHS, first_section=0x200)
+        path = self._write('libfoo.dylib', data)
+        with macho.MachO(path, writable=True) as m:
+            self.assertRaises(macho.MachOError, m.replace_prefix, '/old/home', '/new' * 100)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def testFat(self):
+        path = self._write('libfoo.dylib', fat([mach_o(PATHS), mach_o(PATHS, False, '>')]))
+        self.assertTrue(macho.is_mach_o(path))
+        with macho.MachO(path, writable=True) as m:
+            self.assertEqual(len(m.slices), 2)
+            self.assertEqual(m.replace_prefix('/old/home', '/new/home/dir'), 6)
+        with macho.MachO(path) as m:
+            for s in m.slices:
+                rpaths = [c.path for c in s.commands if c.cmd == macho.LC_RPATH]
+                self.assertEqual(rpaths, ['/new/home/dir/build-tools/lib'])
+
+    def testPrefixRelocator(self):
+        text = self._write('home/lib/pkgconfig/foo.pc', b'prefix=/old/home/dist\nlibdir=/old/home/dist/lib\n')
+        script = self._write('home/bin/tool', b'#!/old/home/bin/python\n')
+        os.chmod(script, 0o755)
+        binary = self._write('home/lib/data.bin', b'\0/old/home\0')
+        lib = self._write('home/lib/libfoo.dylib', mach_o(PATHS))
+        relocator = PrefixRelocator(['/old/home'], '/new', jobs=2)
+        self.assertEqual(relocator.relocate_text_files([os.path.join(self.tmp, 'home')]), 2)
+        with open(text, 'rb') as f:
+            self.assertEqual(f.read(), b'prefix=/new/dist\nlibdir=/new/dist/lib\n')
+        self.assertTrue(os.access(script, os.X_OK))
+        with open(binary, 'rb') as f:
+            self.assertEqual(f.read(), b'\0/old/home\0')
+        self.assertEqual(relocator.relocate_mach_o_files([os.path.join(self.tmp, 'home')]), 1)
+        with macho.MachO(lib) as m:
+            self.assertEqual(m.rpaths(), ['/new/build-tools/lib'])
+
+    def testPrefixRelocatorSigned(self):
+        data = mach_o(PATHS, signed=True)
+        lib = self._write('home/lib/libfoo.dylib', data)
+        relocator = PrefixRelocator(['/old/home'], '/new')
+        with mock.patch('cerbero.tools.osxrelocator.shell.new_call', return_value=0) as new_call:
+            self.assertEqual(relocator.relocate_mach_o_files([os.path.join(self.tmp, 'home')]), 1)
+        # Left to install_name_tool, which signs it again
+        with open(lib, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        new_call.assert_called_once()
+        cmd = new_call.call_args[0][0]
+        self.assertEqual(
+            cmd,
+            [
+                'install_name_tool',
+                '-id',
+                '/new/build-tools/lib/libfoo.dylib',
+                '-change',
+                '/old/home/build-tools/lib/libbar.dylib',
+                '/new/build-tools/lib/libbar.dylib',
+                '-rpath',
+                '/old/home/build-tools/lib',
+                '/new/build-tools/lib',
+                lib,
+            ],
+        )
+        self.assertTrue(new_call.call_args[1]['fail'])
+
+    def testOSXRelocatorPartialFailure(self):
+        prefix = os.path.join(self.tmp, 'prefix')
+        paths = [
+            (macho.LC_ID_DYLIB, prefix + '/lib/libfoo.dylib'),
+            (macho.LC_LOAD_DYLIB, prefix + '/lib/libbar.dylib'),
+            (macho.LC_RPATH, prefix + '/lib'),
+        ]
+        lib = self._write('prefix/lib/libfoo.dylib', mach_o(paths, signed=True))
+        calls = []
+
+        def new_call(cmd, **kwargs):
+            calls.append(cmd[1:-1])
+            # The batch fails because of one of its edits
+            return 1 if '-delete_rpath' in cmd else 0
+
+        with mock.patch('cerbero.tools.osxrelocator.shell.new_call', side_effect=new_call):
+            OSXRelocator(prefix, prefix, False).relocate_file(lib)
+        edits = [
+            ['-id', '@rpath/libfoo.dylib'],
+            ['-change', prefix + '/lib/libbar.dylib', '@rpath/libbar.dylib'],
+            ['-delete_rpath', prefix + '/lib'],
+            ['-add_rpath', '@loader_path/../lib'],
+            ['-add_rpath', '@executable_path/../lib'],
+        ]
+        # The batch, and then each of its edits
+        self.assertEqual(calls, [sum(edits, [])] + edits)
@@ -25,8 +25,10 @@ import asyncio
 from cerbero.enums import Platform
 from cerbero.config import Architecture
 from cerbero.utils import shell, system_info
-from cerbero.tools.osxuniversalgenerator import OSXUniversalGenerator
+from cerbero.tools import macho
+from cerbero.tools.osxuniversalgenerator import OSXUniversalGenerator, get_merge_action
 from cerbero.tools.osxrelocator import OSXRelocator
+from test.test_cerbero_tools_macho import mach_o
 
 
 TEST_APP = """\
@@ -133,6 +135,41 @@ class OSXUniversalGeneratorTest(unittest.TestCase):
         )
         self.assertTrue(os.path.exists(os.path.join(self.tmp, Architecture.UNIVERSAL, 'share', 'test')))
 
+    def testMergeAction(self):
+        share = os.path.join(self.tmp, Architecture.X86, 'share')
+        lib = os.path.join(self.tmp, Architecture.X86, 'lib')
+        files = {
+            os.path.join(lib, 'libfoo.dylib'): (mach_o([(macho.LC_ID_DYLIB, '/lib/libfoo.dylib')]), 'merge'),
+            os.path.join(lib, 'libfoo.a'): (b'!<arch>\nfoo.o/', 'merge'),
+            os.path.join(lib, 'libfoo.la'): (b'# libfoo.la - a libtool library file\n', 'copy-la'),
+            os.path.join(lib, 'foo.pc'): (b'prefix=/lib\n', 'copy-pc'),
+            os.path.join(share, 'empty'): (b'', 'copy'),
+            os.path.join(share, 'foo.h'): (b'int foo(void);\n', 'copy'),
+        }
+        for path, (data, action) in files.items():
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assertEqual(get_merge_action(path), action, path)
+        os.symlink('libfoo.dylib', os.path.join(lib, 'libfoo.1.dylib'))
+        self.assertEqual(get_merge_action(os.path.join(lib, 'libfoo.1.dylib')), 'link')
+        self.assertEqual(get_merge_action(share), 'recurse')
+
+    def testMergeManyFiles(self):
+        files = ['share/test%d' % i for i in range(50)]
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            for f in files:
+                with open(os.path.join(self.tmp, arch, f), 'w') as fd:
+                    fd.write(f)
+        gen = OSXUniversalGenerator(os.path.join(self.tmp, Architecture.UNIVERSAL), jobs=4)
+        asyncio.run(
+            gen.merge_files(
+                files, [os.path.join(self.tmp, Architecture.X86), os.path.join(self.tmp, Architecture.X86_64)]
+            )
+        )
+        for f in files:
+            with open(os.path.join(self.tmp, Architecture.UNIVERSAL, f)) as fd:
+                self.assertEqual(fd.read(), f)
+
     def testMergeCopyAndLink(self):
         for arch in [Architecture.X86, Architecture.X86_64]:
             file1 = os.path.join(self.tmp, arch, 'share', 'test1')
@@ -0,0 +1,65 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from cerbero.tools import strip
+from test.test_common import DummyConfig
+
+
+@unittest.skipUnless(shutil.which('cc') and shutil.which('strip'), 'a C compiler and strip are needed')
+class StripTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        src = os.path.join(self.tmp, 'main.c')
+        with open(src, 'w') as f:
+            f.write('static int unused(void) { return 1; }\nint main(void) { return 0; }\n')
+        self.binary = os.path.join(self.tmp, 'bin', 'main')
+        os.makedirs(os.path.dirname(self.binary))
+        subprocess.check_call(['cc', '-g', '-o', self.binary, src])
+        self.text = os.path.join(self.tmp, 'bin', 'script')
+        with open(self.text, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.symlink('main', os.path.join(self.tmp, 'bin', 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testBinaryFormat(self):
+        self.assertEqual(strip.binary_format(self.binary), 'elf')
+        self.assertEqual(strip.binary_format(self.text), None)
+        self.assertFalse(strip.elf_is_stripped(self.binary))
+        subprocess.check_call(['strip', self.binary])
+        self.assertTrue(strip.elf_is_stripped(self.binary))
+
+    def testStripDir(self):
+        s = strip.Strip(DummyConfig(), jobs=2)
+        size = os.path.getsize(self.binary)
+        stats = s.strip_dir(os.path.join(self.tmp, 'bin'))
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.saved, size - os.path.getsize(self.binary))
+        self.assertGreater(stats.saved, 0)
+        self.assertTrue(strip.elf_is_stripped(self.binary))
+        # Already stripped binaries are skipped
+        stats = s.strip_dir(os.path.join(self.tmp, 'bin'))
+        self.assertEqual((stats.files, stats.skipped), (0, 1))
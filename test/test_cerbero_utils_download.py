@@ -0,0 +1,201 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from cerbero.errors import DownloadError, FatalError
+from cerbero.utils import download, run_until_complete
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('Range')))
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', '/file')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path != '/file':
+            self.send_error(404)
+            return
+        data = server.data
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        partial = server.ranges and match and (if_range is None or if_range == server.etag)
+        if partial:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        body = data[start : end + 1]
+        if server.fail_after is not None and len(body) > server.fail_after:
+            # Drop the connection in the middle of the response
+            self.wfile.write(body[: server.fail_after])
+            server.fail_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing the connections in the middle of a response
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = Server(('127.0.0.1', 0), RangeHandler)
+        self.server.data = os.urandom(1024 * 1024 + 123)
+        self.server.etag = '"v1"'
+        self.server.ranges = True
+        self.server.fail_after = None
+        self.server.connections = 0
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.dest = os.path.join(self.tmp, 'file.tar.xz')
+        self.min_range_size = download.MIN_RANGE_SIZE
+        download.MIN_RANGE_SIZE = 128 * 1024
+        self.downloaders = []
+
+    def _downloader(self, **kwargs):
+        downloader = download.Downloader(**kwargs)
+        self.downloaders.append(downloader)
+        return downloader
+
+    def tearDown(self):
+        download.MIN_RANGE_SIZE = self.min_range_size
+        for downloader in self.downloaders + [download.get_downloader()]:
+            downloader.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _check(self, checksum):
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), self.server.data)
+        self.assertEqual(checksum, hashlib.sha256(self.server.data).hexdigest())
+        self.assertFalse(os.path.exists(self.dest + download.PARTIAL_EXT))
+        self.assertFalse(os.path.exists(self.dest + download.STATE_EXT))
+
+    def testParallelRanges(self):
+        downloader = self._downloader(jobs=4)
+        self._check(downloader.download(self.base_url + '/file', self.dest))
+        ranges = sorted(r for _, r in self.server.requests)
+        self.assertEqual(len(ranges), 4)
+        self.assertIn('bytes=0-', ranges)
+
+    def testNoRanges(self):
+        self.server.ranges = False
+        downloader = self._downloader(jobs=4)
+        self._check(downloader.download(self.base_url + '/file', self.dest))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def testKeepAlive(self):
+        self.server.data = b'x' * 1000
+        downloader = self._downloader(jobs=1)
+        for i in range(3):
+            self._check(downloader.download(self.base_url + '/file', self.dest))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def testResume(self):
+        self.server.fail_after = 100 * 1024
+        downloader = self._downloader(jobs=1, retries=0)
+        with self.assertRaises(DownloadError):
+            downloader.download(self.base_url + '/file', self.dest)
+        self.assertTrue(os.path.exists(self.dest + download.STATE_EXT))
+        self._check(downloader.download(self.base_url + '/file', self.dest))
+        self.assertEqual(self.server.requests[-1][1], 'bytes=%d-' % (100 * 1024))
+
+    def testRetry(self):
+        self.server.fail_after = 100 * 1024
+        downloader = self._downloader(jobs=4)
+        self._check(downloader.download(self.base_url + '/file', self.dest))
+
+    def testResumeOtherURL(self):
+        self.server.fail_after = 100 * 1024
+        downloader = self._downloader(jobs=1, retries=0)
+        with self.assertRaises(DownloadError):
+            downloader.download(self.base_url + '/file', self.dest)
+        del self.server.requests[:]
+        # The partial download of a different URL is discarded
+        self._check(downloader.download(self.base_url + '/redirect', self.dest))
+        self.assertNotIn('bytes=%d-' % (100 * 1024), [r for _, r in self.server.requests])
+
+    def testChangedWhileResuming(self):
+        self.server.fail_after = 100 * 1024
+        downloader = self._downloader(jobs=1, retries=0)
+        with self.assertRaises(DownloadError):
+            downloader.download(self.base_url + '/file', self.dest)
+        self.server.data = os.urandom(2000)
+        self.server.etag = '"v2"'
+        self._check(downloader.download(self.base_url + '/file', self.dest))
+
+    def testRedirectAndFallback(self):
+        checksum = run_until_complete(
+            download.download(
+                self.base_url + '/missing', self.dest, fallback_urls=[self.base_url + '/redirect'], overwrite=True
+            )
+        )
+        self._check(checksum)
+        self.assertEqual([p for p, _ in self.server.requests[:2]], ['/missing', '/redirect'])
+
+    def testExternalToolFallback(self):
+        with mock.patch.object(download.shell, 'download', side_effect=FatalError('failed')) as shell_download:
+            checksum = run_until_complete(
+                download.download('ftp://127.0.0.1/file', self.dest, fallback_urls=[self.base_url + '/file'])
+            )
+        self._check(checksum)
+        shell_download.assert_called_once()
+
+    def testNotFound(self):
+        with self.assertRaises(DownloadError):
+            run_until_complete(download.download(self.base_url + '/missing', self.dest))
+        self.assertFalse(os.path.exists(self.dest))
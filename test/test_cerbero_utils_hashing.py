@@ -0,0 +1,90 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cerbero.utils import hashing, shell
+
+
+class FileHasherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.hasher = hashing.FileHasher()
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.tmp, 'file%d' % i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(hashing.CHUNK_SIZE + i))
+            # Old enough to be memoized
+            os.utime(path, (1000000000, 1000000000))
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testDigests(self):
+        for path in self.files:
+            self.assertEqual(self.hasher.file_digest(path), hashlib.sha256(self._read(path)).hexdigest())
+        concat = b''.join(self._read(p) for p in self.files)
+        self.assertEqual(self.hasher.files_digest(self.files, 'md5'), hashlib.md5(concat).hexdigest())
+        expected = [hashlib.sha256(self._read(p)).hexdigest() for p in self.files]
+        self.assertEqual(self.hasher.file_digests(self.files, jobs=3), expected)
+
+    def testMemo(self):
+        digest = self.hasher.file_digest(self.files[0])
+        with mock.patch('hashlib.new', side_effect=AssertionError('file hashed again')):
+            self.assertEqual(self.hasher.file_digest(self.files[0]), digest)
+        # Changing the file changes its stat
+        with open(self.files[0], 'wb') as f:
+            f.write(b'changed')
+        os.utime(self.files[0], (1000000001, 1000000001))
+        self.assertEqual(self.hasher.file_digest(self.files[0]), hashlib.sha256(b'changed').hexdigest())
+
+    def testRacyFilesNotMemoized(self):
+        os.utime(self.files[0])
+        self.hasher.file_digest(self.files[0])
+        self.assertEqual(self.hasher._memo, {})
+
+    def testIndex(self):
+        index = os.path.join(self.tmp, 'index')
+        self.hasher.load_index(index)
+        digest = self.hasher.file_digest(self.files[1], 'md5')
+        self.hasher.save_index()
+        hasher = hashing.FileHasher(index)
+        with mock.patch('hashlib.new', side_effect=AssertionError('file hashed again')):
+            self.assertEqual(hasher.file_digest(self.files[1], 'md5'), digest)
+        # Entries of removed files are dropped
+        os.remove(self.files[1])
+        hasher._dirty = True
+        hasher.save_index()
+        self.assertEqual(hashing.FileHasher(index)._memo, {})
+
+    def testShellChecksums(self):
+        concat = b''.join(self._read(p) for p in self.files)
+        self.assertEqual(shell.files_checksum(self.files), hashlib.md5(concat).digest())
+        self.assertEqual(shell.file_hash(self.files[0]), hashlib.md5(self._read(self.files[0])).digest())
@@ -0,0 +1,98 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.utils import jobserver, run_until_complete
+
+
+@unittest.skipUnless(jobserver.Jobserver.supported(), 'named pipes are not supported')
+class JobserverTest(unittest.TestCase):
+    def setUp(self):
+        self.jobserver = jobserver.Jobserver(2)
+
+    def tearDown(self):
+        self.jobserver.close()
+
+    def testSlots(self):
+        events = []
+
+        async def job(name, duration):
+            async with self.jobserver:
+                events.append(('start', name))
+                await asyncio.sleep(duration)
+                events.append(('end', name))
+
+        async def run():
+            await asyncio.gather(job('a', 0.05), job('b', 0.1), job('c', 0))
+
+        run_until_complete(run())
+        # 'c' waits for 'a' to give back its slot
+        self.assertEqual(events.index(('start', 'c')), events.index(('end', 'a')) + 1)
+        self.assertLess(events.index(('start', 'c')), events.index(('end', 'b')))
+        # All the tokens are back in the pipe
+        fd = os.open(self.jobserver.path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            self.assertEqual(os.read(fd, 10), b'++')
+        finally:
+            os.close(fd)
+
+    def testClientEnv(self):
+        env = {'PATH': '/usr/bin'}
+        client_env = self.jobserver.client_env(env)
+        self.assertEqual(env, {'PATH': '/usr/bin'})
+        self.assertEqual(client_env['MAKEFLAGS'], '-j2 --jobserver-auth=fifo:%s' % self.jobserver.path)
+        self.assertEqual(client_env['CARGO_MAKEFLAGS'], client_env['MAKEFLAGS'])
+
+    def testClose(self):
+        path = self.jobserver.path
+        self.jobserver.close()
+        self.assertFalse(os.path.exists(path))
+        self.jobserver = jobserver.Jobserver(1)
+
+
+class StripJobsTest(unittest.TestCase):
+    def testStripJobs(self):
+        self.assertEqual(jobserver.strip_jobs(['make', 'V=1', '-j8']), ['make', 'V=1'])
+        self.assertEqual(jobserver.strip_jobs(['ninja', '-v', '-j', '4', 'all']), ['ninja', '-v', 'all'])
+        self.assertEqual(jobserver.strip_jobs(['cargo', 'cbuild', '--jobs=4', '-v']), ['cargo', 'cbuild', '-v'])
+        self.assertEqual(jobserver.strip_jobs(['make', '-j', 'all']), ['make', 'all'])
+        self.assertEqual(jobserver.strip_jobs('make -j4'), 'make -j4')
+
+    @unittest.skipIf(os.name == 'nt', 'the fake ninja is a shell script')
+    def testIsClient(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        env = {'PATH': tmp}
+        self.assertTrue(jobserver.is_client(['make', '-j4'], env))
+        self.assertTrue(jobserver.is_client(['cargo', 'build'], env))
+        for version, client in (('1.12.1', False), ('1.13.0', True)):
+            bindir = os.path.join(tmp, version)
+            os.makedirs(bindir)
+            ninja = os.path.join(bindir, 'ninja')
+            with open(ninja, 'w') as f:
+                f.write('#!/bin/sh\necho %s\n' % version)
+            os.chmod(ninja, 0o755)
+            env = {'PATH': bindir}
+            self.assertEqual(jobserver.is_client(['ninja', '-v', '-j4'], env), client)
+            self.assertEqual(jobserver.is_client(ninja, env), client)
@@ -0,0 +1,167 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2024, Fluendo, S.A.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from cerbero.errors import FatalError
+from cerbero.utils import shell, run_until_complete
+
+
+class TarStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tmp, 'work')
+        for name in ('dist/lib/libfoo.so', 'dist/var/tmp/junk', 'build-tools/bin/tool', 'test.cache'):
+            path = os.path.join(self.workdir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(name * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _check_roundtrip(self, codec, force_tarfile):
+        compressor = shell.TAR_COMPRESSORS[codec]
+        if not shutil.which(compressor.compress[0]):
+            self.skipTest('%s not available' % compressor.compress[0])
+        out_file = os.path.join(self.tmp, 'cache.' + compressor.suffix)
+        files = ['dist', 'build-tools', 'test.cache']
+        shell.write_tar(out_file, self.workdir, files, codec, compressor.levels[0], exclude=['var/tmp'])
+        self.assertEqual(shell.tar_compressor_for(out_file), codec)
+        out_dir = os.path.join(self.tmp, 'out')
+        run_until_complete(shell.unpack_tar_stream(out_file, out_dir, force_tarfile=force_tarfile))
+        for name in ('dist/lib/libfoo.so', 'build-tools/bin/tool', 'test.cache'):
+            with open(os.path.join(out_dir, name)) as f:
+                self.assertEqual(f.read(), name * 100)
+        self.assertFalse(os.path.exists(os.path.join(out_dir, 'dist/var/tmp')))
+
+    def testXz(self):
+        self._check_roundtrip('xz', False)
+
+    def testZstd(self):
+        self._check_roundtrip('zstd', False)
+
+    def testTarfile(self):
+        self._check_roundtrip('xz', True)
+
+    def testCompressCmd(self):
+        self.assertEqual(shell.compress_cmd('zstd', 19)[-1], '-19')
+        self.assertRaises(FatalError, shell.compress_cmd, 'xz', 10)
+        self.assertRaises(FatalError, shell.compress_cmd, 'lz4')
+
+
+class ProcessAccountingTest(unittest.TestCase):
+    def setUp(self):
+        self.accounting = shell.PROCESS_ACCOUNTING
+        shell.PROCESS_ACCOUNTING = True
+
+    def tearDown(self):
+        shell.PROCESS_ACCOUNTING = self.accounting
+
+    def testAccountProcesses(self):
+        # Allocate and touch 64MiB to raise the peak RSS
+        allocate = [sys.executable, '-c', 'b = bytearray(64 * 1024 * 1024); print("done")']
+        outer = shell.ProcessUsage()
+        with shell.account_processes(outer):
+            with shell.account_processes(shell.ProcessUsage()) as inner:
+                output = run_until_complete(shell.async_call_output(allocate))
+            self.assertEqual(output.strip(), 'done')
+            run_until_complete(shell.async_call([sys.executable, '-c', 'pass']))
+        self.assertEqual(inner.count, 1)
+        self.assertEqual(outer.count, 2)
+        self.assertGreater(outer.wall, 0)
+        if hasattr(os, 'wait4'):
+            self.assertGreater(inner.utime + inner.stime, 0)
+            self.assertGreater(inner.maxrss, 64 * 1024 * 1024)
+            self.assertEqual(outer.maxrss, inner.maxrss)
+
+    def testExitCode(self):
+        usage = shell.ProcessUsage()
+        with shell.account_processes(usage):
+            ret = run_until_complete(shell.async_call([sys.executable, '-c', 'exit(3)'], fail=False))
+            with self.assertRaises(FatalError):
+                run_until_complete(shell.async_call([sys.executable, '-c', 'exit(1)']))
+        self.assertEqual(ret, 3)
+        self.assertEqual(usage.count, 2)
+
+    def testCancel(self):
+        if not hasattr(os, 'wait4'):
+            self.skipTest('wait4 not available')
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        pid_file = os.path.join(tmp, 'pid')
+        sleep = [
+            sys.executable,
+            '-c',
+            'import os, time; open(%r, "w").write(str(os.getpid())); time.sleep(60)' % pid_file,
+        ]
+
+        async def cancel():
+            task = asyncio.ensure_future(shell.async_call(sleep))
+            while not os.path.exists(pid_file) or not os.path.getsize(pid_file):
+                await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with shell.account_processes(shell.ProcessUsage()):
+            run_until_complete(cancel())
+        with open(pid_file) as f:
+            pid = int(f.read())
+        # The command was killed and reaped
+        self.assertRaises(ProcessLookupError, os.kill, pid, 0)
+
+    def testDisabled(self):
+        shell.PROCESS_ACCOUNTING = False
+        usage = shell.ProcessUsage()
+        with shell.account_processes(usage):
+            run_until_complete(shell.async_call([sys.executable, '-c', 'pass']))
+        self.assertEqual(usage.count, 0)
+
+
+class CopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        with open(self.src, 'wb') as f:
+            f.write(b'data' * 1000)
+        os.chmod(self.src, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _check_copy(self, dest):
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'data' * 1000)
+        self.assertEqual(os.stat(dest).st_mode & 0o777, 0o755)
+
+    def testReflinkOrCopy(self):
+        dest = os.path.join(self.tmp, 'dest')
+        shell.reflink_or_copy(self.src, dest)
+        self._check_copy(dest)
+        self.assertNotEqual(os.stat(dest).st_ino, os.stat(self.src).st_ino)
+
+    def testLinkOrCopy(self):
+        dest = os.path.join(self.tmp, 'dest')
+        shell.link_or_copy(self.src, dest)
+        self._check_copy(dest)